@@ -0,0 +1,313 @@
+'''
+Benchmarks for the hot paths of loading and editing a ROM.
+
+Run from the project root with `python -m bench`. Everything runs against a
+synthetic ROM (see `synthetic_rom.py`), so no real ROMs are needed. Results
+are written to JSON; pass an earlier results file with `--compare` to see
+what got slower.
+
+GUI benchmarks run with Qt's offscreen platform, and are skipped if PyQt5
+isn't installed.
+'''
+
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from json import dump, load
+from os import environ
+from os.path import join
+from random import Random
+from statistics import mean, median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional
+import gc
+import platform
+import sys
+
+from data.pointer_index import PointerIndex
+from data.rom_data import numpy, RomData
+from data.rom_loader import ROM_INFO_MAP
+from data.rom_scanner import findCharPointerPairs, findTextTable
+from data.rom_text import CharPointerPair, CharTreeBlock
+from data.string_provider import StringProvider
+from data.text_decoder import TextDecoder
+from data.text_encoder import buildCharTrees, TextEncoder
+from data.text_index import TextIndex
+from data.text_search import TextSearchIndex
+
+from .synthetic_rom import buildRom, SyntheticRom
+
+DEFAULT_OUTPUT = 'bench_results.json'
+SEARCH_QUERIES = ['Is', 'Isaac', 'Isaac and', 'lighthouse', 'Mars Star', 'zzz']
+
+class Timer:
+    'Times whatever runs inside `with timer:`. Setup outside the block is not counted.'
+    def __init__(self):
+        self.times: List[float] = []
+
+    def __enter__(self) -> None:
+        self._start = perf_counter()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.times.append(perf_counter() - self._start)
+
+@dataclass
+class Context:
+    'Everything a benchmark might need, built once per run.'
+    rom: SyntheticRom
+    romPath: str
+    romData: RomData = field(init=False)
+
+    def __post_init__(self):
+        self.romData = RomData.fromFile(self.romPath)
+
+    def freshData(self) -> RomData:
+        'Returns a private, writable copy of the ROM data.'
+        return RomData(memoryview(bytearray(self.rom.data)))
+
+    def treeBlock(self, romData: Optional[RomData]=None) -> CharTreeBlock:
+        romData = romData or self.romData
+        return CharTreeBlock(romData, CharPointerPair(romData, self.rom.charPointerPair))
+
+    def textIndex(self, romData: Optional[RomData]=None) -> TextIndex:
+        return TextIndex(romData or self.romData, self.rom.textTable)
+
+    def decoder(self) -> TextDecoder:
+        return TextDecoder(self.romData, self.treeBlock(), self.textIndex())
+
+Benchmark = Callable[[Context, Timer], None]
+_benchmarks: Dict[str, Benchmark] = {}
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    'Registers a benchmark. It is called once per run, and should time its work with the `Timer`.'
+    def register(function: Benchmark) -> Benchmark:
+        _benchmarks[name] = function
+        return function
+    return register
+
+@benchmark('romData.fromFile.mapped')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        RomData.fromFile(ctx.romPath)
+
+@benchmark('romData.fromFile.read')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        RomData.fromFile(ctx.romPath, mapped=False)
+
+@benchmark('romData.crc32')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        ctx.romData.crc32()
+
+@benchmark('scanner.textAnchors')
+def _(ctx: Context, timer: Timer) -> None:
+    # Not scanTextAnchors, since that caches by CRC.
+    with timer:
+        for pairAddress in findCharPointerPairs(ctx.romData):
+            if findTextTable(ctx.romData, pairAddress) is not None:
+                break
+
+@benchmark('pointerIndex.build')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        PointerIndex(ctx.romData)
+
+@benchmark('text.charTreeBlock')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        ctx.treeBlock()
+
+@benchmark('text.textIndex')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        ctx.textIndex()
+
+@benchmark('text.decodeAll')
+def _(ctx: Context, timer: Timer) -> None:
+    decoder = ctx.decoder()
+    with timer:
+        for id in range(decoder.stringCount()):
+            decoder.decodeString(id)
+
+@benchmark('text.stringProvider.random1000')
+def _(ctx: Context, timer: Timer) -> None:
+    provider = StringProvider(ctx.decoder())
+    random = Random(len(timer.times))
+    ids = [random.randrange(len(provider)) for _ in range(1000)]
+    with timer:
+        for id in ids:
+            provider[id]
+
+@benchmark('text.encode.buildCharTrees')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        buildCharTrees(ctx.rom.strings)
+
+@benchmark('text.encode.incremental')
+def _(ctx: Context, timer: Timer) -> None:
+    romData = ctx.freshData()
+    encoder = TextEncoder(romData, ctx.treeBlock(romData), ctx.textIndex(romData))
+    # Swapping two strings keeps every char pair encodable with the existing trees.
+    edits = {10: ctx.rom.strings[20], 20: ctx.rom.strings[10]}
+    with timer:
+        encoder.writeStrings(edits)
+
+@benchmark('text.encode.full')
+def _(ctx: Context, timer: Timer) -> None:
+    romData = ctx.freshData()
+    encoder = TextEncoder(romData, ctx.treeBlock(romData), ctx.textIndex(romData))
+    # Shortening a string frees up the space the rebuilt trees might need.
+    with timer:
+        encoder.writeStrings({0: 'Sol'}, incremental=False)
+
+@benchmark('search.buildIndex')
+def _(ctx: Context, timer: Timer) -> None:
+    with timer:
+        TextSearchIndex(ctx.rom.strings)
+
+@benchmark('search.typing')
+def _(ctx: Context, timer: Timer) -> None:
+    'Searches for each prefix of each query, like someone typing it.'
+    index = TextSearchIndex(ctx.rom.strings)
+    with timer:
+        for query in SEARCH_QUERIES:
+            for end in range(1, len(query) + 1):
+                index.search(query[:end], caseSensitive=False)
+
+@benchmark('search.regex')
+def _(ctx: Context, timer: Timer) -> None:
+    index = TextSearchIndex(ctx.rom.strings)
+    with timer:
+        index.search(r'Isaac \w+ Garet', regex=True)
+
+_app: Any = None
+
+def _qtApp() -> Any:
+    'Returns the QApplication, making one the first time. Kept alive until exit.'
+    global _app
+    if _app is None:
+        environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PyQt5.QtWidgets import QApplication
+        _app = QApplication.instance() or QApplication([])
+    return _app
+
+def _guiBenchmarks() -> None:
+    'Registers the GUI benchmarks, if Qt is available.'
+    try:
+        import PyQt5 # noqa: F401
+    except ImportError:
+        return
+
+    @benchmark('gui.stringList.populate')
+    def _(ctx: Context, timer: Timer) -> None:
+        _qtApp()
+        from views.widgets import StringList
+        provider = StringProvider(ctx.decoder())
+        with timer:
+            stringList = StringList(provider)
+            stringList.resize(600, 800)
+            stringList.show()
+        stringList.deleteLater()
+
+    @benchmark('gui.stringList.search')
+    def _(ctx: Context, timer: Timer) -> None:
+        'Time from setting the search text to the results being shown, without the debounce delay.'
+        _qtApp()
+        from PyQt5.QtCore import QEventLoop
+        from views.widgets import StringList
+        stringList = StringList(list(ctx.rom.strings))
+        stringList.setSearchDelay(0)
+        stringList.model().sourceModel().searchIndex()
+
+        loop = QEventLoop()
+        stringList.searchFinished.connect(lambda _: loop.quit())
+        with timer:
+            stringList.setSearchText('Isaac and')
+            loop.exec_()
+        stringList.deleteLater()
+
+_guiBenchmarks()
+
+def run(ctx: Context, repeat: int, only: Optional[str]=None) -> Dict[str, Dict[str, float]]:
+    'Runs every (matching) benchmark `repeat` times. Returns stats in milliseconds.'
+    results = {}
+    for name, function in _benchmarks.items():
+        if only is not None and only not in name:
+            continue
+        timer = Timer()
+        for _ in range(repeat):
+            function(ctx, timer)
+        times = [seconds * 1000 for seconds in timer.times]
+        results[name] = {
+            'runs': len(times),
+            'minMs': min(times),
+            'medianMs': median(times),
+            'meanMs': mean(times),
+            'maxMs': max(times),
+        }
+        print(f'{name:<36} {results[name]["medianMs"]:10.2f} ms (median of {len(times)})', flush=True)
+    return results
+
+def compare(results: Dict[str, Dict[str, float]], baselinePath: str, threshold: float) -> int:
+    'Prints how each result changed since the baseline. Returns how many got slower than `threshold`.'
+    with open(baselinePath) as baselineFile:
+        baseline = load(baselineFile)['results']
+
+    regressions = 0
+    print(f'\nCompared to {baselinePath}:')
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        ratio = stats['medianMs'] / max(baseline[name]['medianMs'], 1e-9)
+        slower = ratio > threshold
+        regressions += slower
+        print(f'{name:<36} {ratio:6.2f}x{"  <-- slower" if slower else ""}')
+    return regressions
+
+def main() -> int:
+    parser = ArgumentParser(prog='python -m bench', description=__doc__)
+    parser.add_argument('--game', default='AGSE', choices=sorted(ROM_INFO_MAP), help='Game ID to build the ROM for.')
+    parser.add_argument('--strings', type=int, default=12000, help='Number of strings in the script.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random script.')
+    parser.add_argument('--repeat', type=int, default=5, help='Times to run each benchmark.')
+    parser.add_argument('--filter', help='Only run benchmarks whose name contains this.')
+    parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT, help='Where to write JSON results.')
+    parser.add_argument('--compare', metavar='BASELINE', help='Earlier results to compare against.')
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slowdown ratio that counts as a regression.')
+    args = parser.parse_args()
+
+    rom = buildRom(args.game, args.strings, args.seed)
+    # Cleanup errors are ignored in case a benchmark failed while the file was still mapped.
+    with TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+        romPath = join(directory, 'synthetic.gba')
+        with open(romPath, 'wb') as romFile:
+            romFile.write(rom.data)
+        results = run(Context(rom, romPath), args.repeat, args.filter)
+        # The file stays mapped until every view of it is gone, and mapped
+        # files can't be deleted on Windows. By now the `Context` is unreachable,
+        # but Qt widgets and decoders can be stuck in reference cycles.
+        gc.collect()
+
+    with open(args.output, 'w') as outputFile:
+        dump({
+            'meta': {
+                'time': datetime.now(timezone.utc).isoformat(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'numpy': numpy.__version__ if numpy is not None else None,
+                'game': args.game,
+                'strings': args.strings,
+                'seed': args.seed,
+            },
+            'results': results,
+        }, outputFile, indent=2)
+    print(f'\nWrote {args.output}')
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
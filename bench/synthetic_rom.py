@@ -0,0 +1,125 @@
+'''
+Builds fake GBA ROMs with a well-formed Golden Sun text section, for
+benchmarks. We can't ship real ROMs, but the text code only cares about the
+shape of the data, so random strings compressed the same way work fine.
+
+Layout of a generated ROM:
+- GBA header, for the requested game ID (see `ROM_INFO_MAP`).
+- Character Tree Block, then the char offset table, then the `CharPointerPair`.
+- Each text block's data followed by its length table.
+- The Text Block Pointer Table.
+- Zeros until the ROM size for that game.
+'''
+
+from dataclasses import dataclass
+from random import Random
+from typing import List, Tuple
+import struct
+
+from data.rom_header import GBA_HEADER_ID_ADDR, GBA_HEADER_NAME_ADDR, GBA_HEADER_NAME_LEN
+from data.rom_loader import ROM_INFO_MAP
+from data.rom_text import NO_CHAR_OFFSET, ROM_OFFSET
+from data.text_encoder import buildCharTrees, Codes, encodeLengths, encodeString
+from data.text_index import STRINGS_PER_BLOCK, TEXT_BLOCK_ENTRY_SIZE
+
+GBA_HEADER_FIXED_ADDR = 0xB2
+GBA_HEADER_FIXED_VALUE = 0x96
+GBA_HEADER_CHECKSUM_ADDR = 0xBD
+
+TREE_BLOCK_ADDR = 0x1000
+'Where the Character Tree Block starts. Anywhere past the header works.'
+
+MIN_CHAR_TABLE_ENTRIES = 0x100
+'The real games pad their char offset table out, so we do too.'
+
+WORDS = [
+    'Isaac', 'Garet', 'Ivan', 'Mia', 'Felix', 'Jenna', 'Sheba', 'Piers',
+    'Kraden', 'Psynergy', 'Djinn', 'Vale', 'Vault', 'Sol', 'Sanctum', 'Mercury',
+    'Venus', 'Mars', 'Jupiter', 'Elemental', 'Star', 'Lighthouse', 'Alchemy',
+    'the', 'of', 'and', 'you', 'to', 'is', 'we', 'must', 'go', 'what', 'here',
+]
+PUNCTUATION = ['.', '!', '?', ',', '...']
+
+@dataclass
+class SyntheticRom:
+    'A generated ROM, and where its text tables ended up.'
+    data: bytearray
+    strings: List[str]
+    charPointerPair: int
+    textTable: int
+
+def makeStrings(count: int, seed: int=0) -> List[str]:
+    'Makes `count` random, sentence-ish strings. Same `seed`, same strings.'
+    random = Random(seed)
+    strings = []
+    for _ in range(count):
+        words = [random.choice(WORDS) for _ in range(random.randint(1, 24))]
+        strings.append(' '.join(words) + random.choice(PUNCTUATION))
+    return strings
+
+def buildRom(gameId: str='AGSE', stringCount: int=12000, seed: int=0) -> SyntheticRom:
+    'Builds a ROM for `gameId` with `stringCount` random strings.'
+    info = ROM_INFO_MAP[gameId]
+    rom = bytearray(info.size)
+    _writeHeader(rom, info.internal_name, gameId)
+
+    strings = makeStrings(stringCount, seed)
+    pairAddress, codes = _writeCharTrees(rom, strings)
+    textTable = _writeText(rom, strings, codes, pairAddress + 8)
+    return SyntheticRom(rom, strings, pairAddress, textTable)
+
+def _writeHeader(rom: bytearray, internalName: str, gameId: str) -> None:
+    rom[GBA_HEADER_NAME_ADDR:GBA_HEADER_NAME_ADDR + GBA_HEADER_NAME_LEN] = \
+        internalName.encode('ascii').ljust(GBA_HEADER_NAME_LEN, b'\0')
+    rom[GBA_HEADER_ID_ADDR:GBA_HEADER_ID_ADDR + 4] = gameId.encode('ascii')
+    rom[GBA_HEADER_FIXED_ADDR] = GBA_HEADER_FIXED_VALUE
+    rom[GBA_HEADER_CHECKSUM_ADDR] = -(sum(rom[0xA0:GBA_HEADER_CHECKSUM_ADDR]) + 0x19) & 0xFF
+
+def _writeCharTrees(rom: bytearray, strings: List[str]) -> Tuple[int, Codes]:
+    '''Writes the Character Tree Block, offset table and `CharPointerPair`.
+    Returns the address of the pair, and the codes to compress text with.'''
+    trees = buildCharTrees(strings)
+    block = bytearray()
+    offsets = [NO_CHAR_OFFSET] * max(max(trees) + 1, MIN_CHAR_TABLE_ENTRIES)
+    for char, tree in trees.items():
+        block += tree.lookupBytes()
+        offsets[char] = len(block)
+        block += tree.treeBytes()
+    # Unused entries after the last char are padding.
+    offsets[max(trees) + 1:] = [0x0] * (len(offsets) - max(trees) - 1)
+
+    # CharTreeBlock expects a gap before the offset table, and the pair has to be aligned.
+    offsetTable = TREE_BLOCK_ADDR + len(block) + 1
+    offsetTable += -offsetTable % 4
+    offsets += [0x0] * (len(offsets) % 2)
+    pairAddress = offsetTable + len(offsets) * 2
+
+    rom[TREE_BLOCK_ADDR:TREE_BLOCK_ADDR + len(block)] = block
+    struct.pack_into(f'<{len(offsets)}H', rom, offsetTable, *offsets)
+    struct.pack_into('<II', rom, pairAddress, TREE_BLOCK_ADDR + ROM_OFFSET, offsetTable + ROM_OFFSET)
+    return pairAddress, {char: tree.codes for char, tree in trees.items()}
+
+def _writeText(rom: bytearray, strings: List[str], codes: Codes, address: int) -> int:
+    '''Writes every text block (data, then length table) starting at `address`,
+    then the Text Block Pointer Table. Returns the address of the table.'''
+    # The scanner finds the table by its first entry pointing right after the pair.
+    entries = []
+    for blockStart in range(0, len(strings), STRINGS_PER_BLOCK):
+        encoded = [encodeString(string, codes) for string in strings[blockStart:blockStart + STRINGS_PER_BLOCK]]
+        text = b''.join(encoded)
+        lengths = encodeLengths(map(len, encoded))
+        rom[address:address + len(text)] = text
+        rom[address + len(text):address + len(text) + len(lengths)] = lengths
+        entries.append((address, address + len(text)))
+        address += len(text) + len(lengths)
+
+    textTable = address + -address % 4
+    for block, (textAddress, lengthAddress) in enumerate(entries):
+        struct.pack_into(
+            '<II',
+            rom,
+            textTable + block * TEXT_BLOCK_ENTRY_SIZE,
+            textAddress + ROM_OFFSET,
+            lengthAddress + ROM_OFFSET,
+        )
+    return textTable
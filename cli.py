@@ -1,22 +1,120 @@
-from argparse import ArgumentParser
+from argparse import Action, ArgumentParser
+from contextlib import contextmanager
 from pathlib import Path
 from signal import signal, SIGINT
-from sys import exit
+from sys import argv, exit, stderr
+from time import perf_counter
+from typing import Iterator, List, Tuple
 
-from app import PsynergyApp
-from info import PROGRAM_DESCRIPTION, PROGRAM_NAME, PROGRAM_VERSION
+# NOTE: Keep imports here light. Everything heavy (Qt, ROM parsing) is imported
+# only once we know we need it, so `--version` and friends return instantly.
+from data.tracing import start as startTracing, startFromEnvironment as startTracingFromEnvironment
+from info import PROGRAM_DESCRIPTION, PROGRAM_NAME, programVersion
+
+_importStart = perf_counter()
+
+HEADLESS_COMMANDS = ('info', 'identify', 'verify', 'dump-text', 'import-text', 'patch')
+'Subcommands handled by commands.py instead of launching the GUI.'
+
+class VersionAction(Action):
+    'Like argparse\'s built-in "version" action, but only looks up the version when used.'
+    def __init__(self, option_strings, dest, **kwargs):
+        super().__init__(option_strings, dest, nargs=0, help="show program's version number and exit")
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print(programVersion())
+        parser.exit()
+
+class StartupProfiler:
+    'Times each phase of startup, for `--profile-startup`.'
+    def __init__(self, start: float):
+        self._start = start
+        self._phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        self._phases.append((name, seconds))
+
+    def report(self) -> None:
+        'Prints the time spent in each phase to stderr.'
+        total = perf_counter() - self._start
+        width = max(len(name) for name, _ in self._phases)
+        print('Startup profile:', file=stderr)
+        for name, seconds in self._phases:
+            print(f'  {name:<{width}}  {seconds * 1000:8.1f} ms', file=stderr)
+        print(f'  {"total":<{width}}  {total * 1000:8.1f} ms', file=stderr, flush=True)
 
 argParser = ArgumentParser(
     description=PROGRAM_DESCRIPTION,
+    epilog=f'Headless commands (no GUI): {", ".join(HEADLESS_COMMANDS)}. '
+        'Run `%(prog)s <command> --help` for details.',
     prog=PROGRAM_NAME.lower(),
 )
-argParser.add_argument('-v', '--version', action='version', version=PROGRAM_VERSION)
+argParser.add_argument('-v', '--version', action=VersionAction)
 argParser.add_argument('file', type=Path, nargs='?', help='ROM file to open.')
+argParser.add_argument(
+    '--release-tabs-after',
+    type=float,
+    metavar='SECONDS',
+    help='Free editor tabs that have not been shown for this long. They are rebuilt when reopened.',
+)
+argParser.add_argument(
+    '--profile-startup',
+    action='store_true',
+    help='Print how long each phase of startup took, once the window is up.',
+)
+argParser.add_argument(
+    '--no-cache',
+    action='store_true',
+    help='Analyze ROMs from scratch instead of using (and updating) the analysis cache.',
+)
+argParser.add_argument(
+    '--trace',
+    metavar='FILE',
+    help='Record where time goes and write it to FILE as Chrome trace JSON on exit. '
+        'Also enabled by the PSYNERGY_TRACE environment variable, which works for headless commands too.',
+)
+argParser.add_argument(
+    '--trace-memory',
+    action='store_true',
+    help='With --trace, also record peak memory per span. Slow.',
+)
 
 if __name__ == '__main__':
-    args = argParser.parse_args()
+    # Headless commands never touch Qt. See commands.py.
+    if len(argv) > 1 and argv[1] in HEADLESS_COMMANDS:
+        startTracingFromEnvironment()
+        from commands import runCommand
+        exit(runCommand(argv[1:], prog=PROGRAM_NAME.lower()))
 
-    app = PsynergyApp([str(args.file)] if args.file else [])
+    profiler = StartupProfiler(_importStart)
+    with profiler.phase('parse arguments'):
+        args = argParser.parse_args()
+    if args.trace:
+        startTracing(args.trace, args.trace_memory)
+    else:
+        startTracingFromEnvironment()
+
+    with profiler.phase('import Qt'):
+        from PyQt5.QtCore import QTimer
+    with profiler.phase('import app'):
+        from app import PsynergyApp
+        from views.state import state
+
+    state.releaseTabsAfter = args.release_tabs_after
+    if not args.no_cache:
+        from data.analysis_cache import defaultCache
+        state.analysisCache = defaultCache()
+
+    with profiler.phase('create window'):
+        app = PsynergyApp([str(args.file)] if args.file else [])
 
     def handleInterrupt(sig, frame):
         print('Unclean exit via interrupt!')
@@ -24,4 +122,12 @@ if __name__ == '__main__':
         exit()
     signal(SIGINT, handleInterrupt)
 
+    # Runs once the window is shown and the event loop is running.
+    showStart = perf_counter()
+    def onEventLoopStarted():
+        profiler.record('show window', perf_counter() - showStart)
+        profiler.report()
+    if args.profile_startup:
+        QTimer.singleShot(0, onEventLoopStarted)
+
     exit(app.exec())
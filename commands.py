@@ -0,0 +1,244 @@
+'''
+Headless subcommands, for scripts and batch jobs.
+
+Run as `python cli.py <command> ...` (see `HEADLESS_COMMANDS` there). Nothing here imports Qt, so these work
+on machines without a display (or without PyQt5 installed at all).
+
+Output is JSON Lines on stdout: one JSON object per line, written as soon as
+it's ready. Errors for a single ROM are reported as an object with an
+`error` key, and the command moves on to the next ROM. The exit code is
+non-zero if anything failed.
+'''
+
+from argparse import ArgumentParser, Namespace
+from json import dumps, loads
+from sys import stdin, stdout
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+from data.analysis_cache import AnalysisCache, defaultCache
+from data.rom_identify import identifyRoms, IdentifyError, MODIFIED, UNKNOWN
+from data.rom_loader import Rom
+from data.rom_patch import applyPatch, createPatch, PATCH_FORMATS
+from data.rom_text import CharPointerPair, CharTreeBlock
+from data.text_encoder import TextEncoder
+from data.text_index import TextIndex
+
+_failed: List[str] = []
+'Everything that failed during this command. Decides the exit code.'
+
+def emit(record: Dict[str, Any], out: TextIO=stdout) -> None:
+    'Writes one JSON Lines record and flushes it, so readers see it right away.'
+    out.write(dumps(record, ensure_ascii=False) + '\n')
+    out.flush()
+
+def _cache(args: Namespace) -> Optional[AnalysisCache]:
+    return None if args.no_cache else defaultCache()
+
+def _eachRom(paths: List[str], cache: Optional[AnalysisCache]) -> Iterator[Rom]:
+    'Yields a `Rom` for each path. Paths that fail to load are reported and skipped.'
+    for path in paths:
+        try:
+            rom = Rom(path, cache)
+        except Exception as e:
+            _failed.append(path)
+            emit({'path': path, 'error': str(e)})
+            continue
+        yield rom
+
+def _runForEach(args: Namespace, action: Callable[[Rom], Dict[str, Any]]) -> None:
+    for rom in _eachRom(args.roms, _cache(args)):
+        try:
+            emit(action(rom))
+        except Exception as e:
+            _failed.append(rom.filePath())
+            emit({'path': rom.filePath(), 'error': str(e)})
+
+def _romInfo(rom: Rom) -> Dict[str, Any]:
+    info = rom.matchedInfo()
+    return {
+        'path': rom.filePath(),
+        'gameId': rom.header().gameId(),
+        'fullGameId': rom.header().fullGameId(),
+        'internalName': rom.header().internalName(),
+        'name': rom.gameName(),
+        'known': info is not None,
+        'size': rom.data().size(),
+        'crc32': rom.crc32(),
+    }
+
+def _identify(args: Namespace, failStatuses: Set[str]) -> None:
+    'Identifies every ROM under `args.paths`, in parallel. ROMs with one of `failStatuses` count as failures.'
+    for result in identifyRoms(args.paths, args.jobs, _cache(args)):
+        if isinstance(result, IdentifyError):
+            _failed.append(result.path)
+            emit({'path': result.path, 'error': result.error})
+            continue
+        if result.status in failStatuses:
+            _failed.append(result.path)
+        emit(result.toDict())
+
+def _textTables(rom: Rom) -> Tuple[int, int]:
+    'Returns the addresses of the `CharPointerPair` and Text Block Pointer Table.'
+    anchors = rom.textAnchors()
+    if anchors.charPointerPair is None or anchors.textTable is None:
+        raise Exception(f'Could not find the text tables in {rom.filePath()}')
+    return anchors.charPointerPair, anchors.textTable
+
+def infoCommand(args: Namespace) -> None:
+    _runForEach(args, _romInfo)
+
+def identifyCommand(args: Namespace) -> None:
+    _identify(args, set())
+
+def verifyCommand(args: Namespace) -> None:
+    _identify(args, {MODIFIED} if args.allow_unknown else {MODIFIED, UNKNOWN})
+
+def dumpTextCommand(args: Namespace) -> None:
+    for rom in _eachRom([args.rom], _cache(args)):
+        try:
+            pairAddress, textTable = _textTables(rom)
+            strings: Any
+            if args.jobs > 1:
+                # Process pools are slow to import, so only pay for it here.
+                from data.parallel_decode import decodeScript
+                strings = decodeScript(rom.filePath(), pairAddress, textTable, args.jobs)
+            else:
+                strings = rom.strings()
+            end = len(strings) if args.end is None else min(args.end, len(strings))
+            for id in range(args.start, end):
+                emit({'id': id, 'text': strings[id]})
+        except Exception as e:
+            _failed.append(rom.filePath())
+            emit({'path': rom.filePath(), 'error': str(e)})
+
+def importTextCommand(args: Namespace) -> None:
+    for rom in _eachRom([args.rom], _cache(args)):
+        try:
+            lines = stdin if args.strings == '-' else open(args.strings, encoding='utf-8')
+            edits: Dict[int, str] = {}
+            try:
+                for line in lines:
+                    if line.strip():
+                        record = loads(line)
+                        edits[int(record['id'])] = record['text']
+            finally:
+                if lines is not stdin:
+                    lines.close()
+
+            pairAddress, textTable = _textTables(rom)
+            data = rom.data()
+            encoder = TextEncoder(
+                data,
+                CharTreeBlock(data, CharPointerPair(data, pairAddress)),
+                TextIndex(data, textTable),
+            )
+            blocks = encoder.writeStrings(edits, incremental=not args.full)
+            written = rom.saveAs(args.output) if args.output else rom.save()
+            emit({
+                'path': rom.filePath(),
+                'edited': len(edits),
+                'blocksRewritten': blocks,
+                'bytesWritten': written,
+            })
+        except Exception as e:
+            _failed.append(rom.filePath())
+            emit({'path': rom.filePath(), 'error': str(e)})
+
+def patchCreateCommand(args: Namespace) -> None:
+    for rom in _eachRom([args.rom], _cache(args)):
+        try:
+            differences = createPatch(rom, args.vanilla, args.patch, args.format, validate=not args.no_validate)
+            emit({'path': rom.filePath(), 'patch': args.patch, 'format': args.format, 'differences': differences})
+        except Exception as e:
+            _failed.append(rom.filePath())
+            emit({'path': rom.filePath(), 'error': str(e)})
+
+def patchApplyCommand(args: Namespace) -> None:
+    try:
+        applyPatch(args.patch, args.source, args.output, validate=not args.no_validate)
+        emit({'patch': args.patch, 'source': args.source, 'output': args.output})
+    except Exception as e:
+        _failed.append(args.patch)
+        emit({'patch': args.patch, 'error': str(e)})
+
+def makeParser(prog: Optional[str]=None) -> ArgumentParser:
+    parser = ArgumentParser(prog=prog, description='Headless commands. Output is JSON Lines.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # Options shared by every command that loads a ROM.
+    romOptions = ArgumentParser(add_help=False)
+    romOptions.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Analyze ROMs from scratch instead of using (and updating) the analysis cache.',
+    )
+
+    info = commands.add_parser('info', parents=[romOptions], help='Print header info and CRC32 for ROMs.')
+    info.add_argument('roms', nargs='+', metavar='ROM')
+    info.set_defaults(run=infoCommand)
+
+    # Both of these only read headers, and hash just the ROMs that could be vanilla.
+    identifyHelp = 'ROM files, or directories to search for .gba files.'
+    identify = commands.add_parser(
+        'identify',
+        parents=[romOptions],
+        help='Tell whether ROMs are vanilla, modified, or unknown. Results are printed as they are ready.',
+    )
+    identify.add_argument('paths', nargs='+', metavar='PATH', help=identifyHelp)
+    identify.add_argument('-j', '--jobs', type=int, help='Identify this many ROMs at once.')
+    identify.set_defaults(run=identifyCommand)
+
+    verify = commands.add_parser(
+        'verify',
+        parents=[romOptions],
+        help='Like identify, but exits non-zero if any ROMs are modified or unknown.',
+    )
+    verify.add_argument('paths', nargs='+', metavar='PATH', help=identifyHelp)
+    verify.add_argument('-j', '--jobs', type=int, help='Verify this many ROMs at once.')
+    verify.add_argument('--allow-unknown', action='store_true', help="Only fail on modified ROMs, not unknown ones.")
+    verify.set_defaults(run=verifyCommand)
+
+    dumpText = commands.add_parser('dump-text', parents=[romOptions], help='Print every string in the game script.')
+    dumpText.add_argument('rom', metavar='ROM')
+    dumpText.add_argument('--start', type=int, default=0, help='First string ID to print.')
+    dumpText.add_argument('--end', type=int, help='Stop before this string ID.')
+    dumpText.add_argument('-j', '--jobs', type=int, default=1, help='Decode with this many processes.')
+    dumpText.set_defaults(run=dumpTextCommand)
+
+    importText = commands.add_parser(
+        'import-text',
+        parents=[romOptions],
+        help='Write strings (as printed by dump-text) into a ROM.',
+    )
+    importText.add_argument('rom', metavar='ROM')
+    importText.add_argument('strings', metavar='STRINGS', help='JSON Lines file of {"id", "text"}, or - for stdin.')
+    importText.add_argument('-o', '--output', help='Save to this file instead of modifying ROM.')
+    importText.add_argument('--full', action='store_true', help='Rebuild the char trees and recompress everything.')
+    importText.set_defaults(run=importTextCommand)
+
+    patch = commands.add_parser('patch', help='Create or apply IPS/UPS/BPS patches.')
+    patchCommands = patch.add_subparsers(dest='patchCommand', required=True)
+
+    create = patchCommands.add_parser('create', parents=[romOptions], help='Make a patch from a vanilla ROM to a modified one.')
+    create.add_argument('rom', metavar='ROM', help='The modified ROM.')
+    create.add_argument('vanilla', metavar='VANILLA', help='The vanilla ROM.')
+    create.add_argument('patch', metavar='PATCH', help='Where to write the patch.')
+    create.add_argument('-f', '--format', choices=PATCH_FORMATS, default='bps')
+    create.add_argument('--no-validate', action='store_true', help="Don't require VANILLA to be a known ROM.")
+    create.set_defaults(run=patchCreateCommand)
+
+    apply = patchCommands.add_parser('apply', help='Apply a patch to a ROM.')
+    apply.add_argument('patch', metavar='PATCH')
+    apply.add_argument('source', metavar='SOURCE', help='The ROM to patch.')
+    apply.add_argument('output', metavar='OUTPUT', help='Where to write the patched ROM.')
+    apply.add_argument('--no-validate', action='store_true', help="Don't check the patch's checksums.")
+    apply.set_defaults(run=patchApplyCommand)
+
+    return parser
+
+def runCommand(argv: List[str], prog: Optional[str]=None) -> int:
+    'Runs a headless command. Returns the exit code.'
+    args = makeParser(prog).parse_args(argv)
+    _failed.clear()
+    args.run(args)
+    return 1 if _failed else 0
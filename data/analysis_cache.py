@@ -0,0 +1,231 @@
+'''
+A persistent, on-disk cache of ROM analysis, so reopening a ROM is near-instant.
+
+Everything we work out by scanning a ROM (its CRC32, where the text tables
+are, the string index, ...) only depends on the bytes in the file, so it's
+stored under the file's CRC32:
+
+    <cache dir>/v<FORMAT_VERSION>/<crc32>/<name>.bin
+
+Each entry is a list of flat integer arrays, in a compact binary format (see
+`writeArrays`) that loads with a single read and no parsing. Bump
+`FORMAT_VERSION` whenever what's stored under a name changes meaning, and
+old entries will simply be ignored.
+
+Working out the CRC32 means reading the whole file, so `files.json` also
+remembers the CRC32 (and any other hashes) of each file we've seen by its
+path, size and mtime. If none of those changed, the file is assumed
+unchanged and isn't hashed again.
+
+The cache is best-effort: anything that can't be read (missing, truncated,
+from another version) is treated as a miss, and failures to write are ignored.
+'''
+
+from array import array
+from json import dump, load
+from os import environ, makedirs, remove, replace, stat
+from os.path import abspath, dirname, expanduser, join
+from shutil import rmtree
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import Any, Callable, Dict, IO, List, Optional
+import struct
+import sys
+
+FORMAT_VERSION = 2
+'Version of everything stored in the cache. Entries from other versions are ignored.'
+
+CACHE_DIR_ENV = 'PSYNERGY_CACHE_DIR'
+'Environment variable to override where the cache is kept.'
+
+MAX_REMEMBERED_FILES = 1000
+'How many file fingerprints `files.json` holds before the oldest are dropped.'
+
+ARRAYS_MAGIC = b'PSYC'
+ARRAYS_HEADER = struct.Struct('<4sHH')
+'Magic, format version, array count.'
+ARRAY_HEADER = struct.Struct('<c3xI')
+'Typecode, padding, item count. Each array starts 8-byte aligned, so the file could be mapped and cast in place.'
+ARRAY_TYPECODES = {b'B', b'H', b'I', b'i', b'q'}
+'Typecodes whose size is the same on every platform.'
+
+def defaultCacheDir() -> str:
+    'Returns `PSYNERGY_CACHE_DIR`, or the per-user cache directory for this OS.'
+    override = environ.get(CACHE_DIR_ENV)
+    if override:
+        return override
+    if sys.platform == 'win32':
+        base = environ.get('LOCALAPPDATA') or expanduser('~')
+    elif sys.platform == 'darwin':
+        base = expanduser('~/Library/Caches')
+    else:
+        base = environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return join(base, 'psynergy')
+
+def writeArrays(arrays: List['array[int]']) -> bytes:
+    'Packs `arrays` into the cache entry format. Data is stored little-endian.'
+    parts = [ARRAYS_HEADER.pack(ARRAYS_MAGIC, FORMAT_VERSION, len(arrays))]
+    size = ARRAYS_HEADER.size
+    for values in arrays:
+        typecode = values.typecode.encode()
+        if typecode not in ARRAY_TYPECODES:
+            raise ValueError(f'Cannot cache arrays of type {values.typecode!r}')
+        if sys.byteorder == 'big':
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        padding = -(size + ARRAY_HEADER.size) % 8
+        parts += [b'\0' * padding, ARRAY_HEADER.pack(typecode, len(values)), data]
+        size += padding + ARRAY_HEADER.size + len(data)
+    return b''.join(parts)
+
+def readArrays(data: bytes) -> List['array[int]']:
+    '''Unpacks arrays packed by `writeArrays`.
+    :raises
+        ValueError: if `data` isn't a valid entry for this format version.
+    '''
+    magic, version, count = ARRAYS_HEADER.unpack_from(data, 0)
+    if magic != ARRAYS_MAGIC or version != FORMAT_VERSION:
+        raise ValueError('Not a cache entry for this version')
+
+    arrays = []
+    offset = ARRAYS_HEADER.size
+    for _ in range(count):
+        offset += -(offset + ARRAY_HEADER.size) % 8
+        typecode, length = ARRAY_HEADER.unpack_from(data, offset)
+        offset += ARRAY_HEADER.size
+        if typecode not in ARRAY_TYPECODES:
+            raise ValueError(f'Bad array type {typecode!r}')
+        values = array(typecode.decode())
+        end = offset + length * values.itemsize
+        if end > len(data):
+            raise ValueError('Cache entry is truncated')
+        values.frombytes(data[offset:end])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        arrays.append(values)
+        offset = end
+    return arrays
+
+class AnalysisCache:
+    '''A directory of cached analysis, keyed by ROM CRC32.
+
+    Safe to share between threads and processes: every file is written to a
+    temporary file and renamed into place, so readers never see half of one.
+    '''
+
+    def __init__(self, directory: str):
+        self._directory = join(directory, f'v{FORMAT_VERSION}')
+        self._files: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = Lock()
+
+    def directory(self) -> str:
+        return self._directory
+
+    def _filesPath(self) -> str:
+        return join(self._directory, 'files.json')
+
+    def _loadFiles(self) -> Dict[str, Dict[str, Any]]:
+        if self._files is None:
+            try:
+                with open(self._filesPath()) as filesFile:
+                    self._files = load(filesFile)
+            except (OSError, ValueError):
+                self._files = {}
+        return self._files # type: ignore
+
+    @staticmethod
+    def _fingerprint(filePath: str) -> Dict[str, int]:
+        info = stat(filePath)
+        return {'size': info.st_size, 'mtimeNs': info.st_mtime_ns}
+
+    @staticmethod
+    def _sameFile(remembered: Dict[str, Any], fingerprint: Dict[str, int]) -> bool:
+        return remembered['size'] == fingerprint['size'] and remembered['mtimeNs'] == fingerprint['mtimeNs']
+
+    def fileHashes(self, filePath: str) -> Dict[str, str]:
+        '''Returns the remembered hashes of `filePath`, keyed by algorithm (e.g. `crc32`).
+        Empty if the file is unknown or changed since they were remembered.'''
+        with self._lock:
+            remembered = self._loadFiles().get(abspath(filePath))
+        if remembered is None:
+            return {}
+        try:
+            fingerprint = AnalysisCache._fingerprint(filePath)
+        except OSError:
+            return {}
+        if not AnalysisCache._sameFile(remembered, fingerprint):
+            return {}
+        return dict(remembered['hashes'])
+
+    def rememberFileHashes(self, filePath: str, hashes: Dict[str, str]) -> None:
+        '''Remembers that `filePath` (as it is on disk right now) has these hashes.
+        Only call this with hashes of the file's current contents.'''
+        try:
+            fingerprint: Dict[str, Any] = AnalysisCache._fingerprint(filePath)
+        except OSError:
+            return
+        with self._lock:
+            # Reloaded, so files remembered by other processes since aren't lost.
+            self._files = None
+            files = self._loadFiles()
+            remembered = files.pop(abspath(filePath), None)
+            fingerprint['hashes'] = dict(hashes)
+            if remembered is not None and AnalysisCache._sameFile(remembered, fingerprint):
+                fingerprint['hashes'] = {**remembered['hashes'], **hashes}
+            # Re-inserted so the dict stays in least-recently-remembered order.
+            files[abspath(filePath)] = fingerprint
+            while len(files) > MAX_REMEMBERED_FILES:
+                del files[next(iter(files))]
+            self._write(self._filesPath(), lambda outputFile: dump(files, outputFile), text=True)
+
+    def _entryPath(self, crc32: str, name: str) -> str:
+        return join(self._directory, crc32, f'{name}.bin')
+
+    def load(self, crc32: str, name: str) -> Optional[List['array[int]']]:
+        'Returns the arrays stored as `name` for the ROM with this CRC32, or `None` on a miss.'
+        try:
+            with open(self._entryPath(crc32, name), 'rb') as entryFile:
+                return readArrays(entryFile.read())
+        except (OSError, ValueError, struct.error):
+            return None
+
+    def store(self, crc32: str, name: str, arrays: List['array[int]']) -> None:
+        'Stores `arrays` as `name` for the ROM with this CRC32.'
+        data = writeArrays(arrays)
+        self._write(self._entryPath(crc32, name), lambda outputFile: outputFile.write(data))
+
+    def _write(self, path: str, write: Callable[[IO[Any]], Any], text: bool=False) -> None:
+        'Writes a file atomically. Errors are only printed, since the cache is just an optimization.'
+        tempPath = None
+        try:
+            makedirs(dirname(path), exist_ok=True)
+            with NamedTemporaryFile('w' if text else 'wb', dir=dirname(path), suffix='.tmp', delete=False) as tempFile:
+                tempPath = tempFile.name
+                write(tempFile)
+            replace(tempPath, path)
+        except OSError as e:
+            print(f'Could not write to the analysis cache: {e}', file=sys.stderr)
+            if tempPath is not None:
+                try:
+                    remove(tempPath)
+                except OSError:
+                    pass
+
+    def clear(self) -> None:
+        'Deletes everything in the cache.'
+        with self._lock:
+            rmtree(self._directory, ignore_errors=True)
+            self._files = None
+
+    def __str__(self) -> str:
+        return f'{AnalysisCache.__name__}({self._directory})'
+
+_defaultCache: Optional[AnalysisCache] = None
+
+def defaultCache() -> AnalysisCache:
+    'Returns the cache in `defaultCacheDir`, shared by everything in this process.'
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = AnalysisCache(defaultCacheDir())
+    return _defaultCache
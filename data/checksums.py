@@ -0,0 +1,161 @@
+'''
+Checksums of ROM data, computed in chunks so they can run on a worker thread.
+
+`binascii.crc32` and `hashlib` release the GIL while hashing a large buffer,
+so hashing in big chunks lets the GUI thread keep running. Between chunks we
+check whether the caller gave up, e.g. because another ROM was opened.
+
+`IncrementalCrc32` keeps the CRC32 of every fixed-size chunk of the ROM, so
+after an edit only the chunks it touched are hashed again, and the chunk CRCs
+are combined into the CRC32 of the whole ROM with a bit of GF(2) algebra
+(the same trick as zlib's `crc32_combine`).
+'''
+
+from binascii import crc32
+from functools import lru_cache
+from threading import Lock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import hashlib
+
+from .rom_data import RomData
+from .tracing import span
+
+CRC_CHUNK_SIZE = 64 * 1024
+'Size of the chunks `IncrementalCrc32` keeps a CRC32 for. Smaller chunks make edits cheaper to rehash.'
+
+HASH_CHUNK_SIZE = 1024 * 1024
+'How much data is hashed between checks for cancellation.'
+
+HASH_ALGORITHMS = ('md5', 'sha1')
+'Hashes (besides CRC32) used by ROM databases like No-Intro.'
+
+CRC32_POLYNOMIAL = 0xEDB88320
+'The reversed CRC-32 polynomial used by zlib and binascii.'
+
+Cancelled = Optional[Callable[[], bool]]
+'Called between chunks. Hashing stops (returning `None`) once it returns `True`.'
+
+def _gf2Times(matrix: List[int], vector: int) -> int:
+    'Multiplies a 32x32 GF(2) matrix (a list of columns) by a 32-bit vector.'
+    result = 0
+    column = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[column]
+        vector >>= 1
+        column += 1
+    return result
+
+def _gf2Multiply(left: List[int], right: List[int]) -> List[int]:
+    return [_gf2Times(left, column) for column in right]
+
+@lru_cache(maxsize=8)
+def _zerosOperator(length: int) -> Tuple[int, ...]:
+    'Returns the matrix that advances a CRC32 register past `length` zero bytes.'
+    # One zero bit: shift right, and fold in the polynomial if the low bit was set.
+    power = [CRC32_POLYNOMIAL] + [1 << n for n in range(31)]
+    # Squared three times: one zero byte.
+    for _ in range(3):
+        power = _gf2Multiply(power, power)
+
+    result = [1 << n for n in range(32)]
+    while length:
+        if length & 1:
+            result = _gf2Multiply(power, result)
+        length >>= 1
+        if length:
+            power = _gf2Multiply(power, power)
+    return tuple(result)
+
+def crc32Combine(crc1: int, crc2: int, length2: int) -> int:
+    '''Returns the CRC32 of two blocks of data joined together, given the CRC32
+    of each and the length of the second.'''
+    return _gf2Times(list(_zerosOperator(length2)), crc1) ^ crc2
+
+def _chunks(romData: RomData, chunkSize: int) -> Iterator[memoryview]:
+    for start in range(0, romData.size(), chunkSize):
+        yield romData.view(start, min(start + chunkSize, romData.size()))
+
+class IncrementalCrc32:
+    '''The CRC32 of a `RomData`, which only rehashes the parts that were edited.
+
+    Edits are found through the data's dirty ranges, so writes that aren't
+    marked dirty are missed, and `crc32` must be called again before the dirty
+    ranges are cleared (e.g. by saving). `Rom` takes care of that.
+    '''
+
+    def __init__(self, romData: RomData, chunkSize: int=CRC_CHUNK_SIZE):
+        self._romData = romData
+        self._chunkSize = chunkSize
+        self._chunkCrcs: Optional[List[int]] = None
+        self._crc32 = 0
+        self._lock = Lock()
+
+    def isComputed(self) -> bool:
+        'Returns whether the first full pass is done, so `crc32` only has to rehash edits.'
+        return self._chunkCrcs is not None
+
+    def crc32(self, cancelled: Cancelled=None) -> Optional[str]:
+        '''Returns the hexadecimal CRC32 of the data as it is now.
+        The first call hashes everything. Returns `None` if `cancelled`.'''
+        with self._lock:
+            if self._chunkCrcs is None:
+                with span('checksums.crc32.full'):
+                    chunkCrcs = []
+                    for chunk in _chunks(self._romData, self._chunkSize):
+                        if cancelled is not None and cancelled():
+                            return None
+                        chunkCrcs.append(crc32(chunk))
+                self._chunkCrcs = chunkCrcs
+                self._combine()
+            else:
+                self._update()
+            return format(self._crc32, 'x')
+
+    def _update(self) -> None:
+        'Rehashes every chunk that overlaps a dirty range.'
+        chunkCrcs = self._chunkCrcs
+        assert chunkCrcs is not None
+        chunkSize = self._chunkSize
+        size = self._romData.size()
+        changed = False
+        with span('checksums.crc32.update'):
+            for start, end in self._romData.dirtyRanges():
+                for chunk in range(start // chunkSize, (min(end, size) - 1) // chunkSize + 1):
+                    chunkStart = chunk * chunkSize
+                    chunkCrc = crc32(self._romData.view(chunkStart, min(chunkStart + chunkSize, size)))
+                    if chunkCrcs[chunk] != chunkCrc:
+                        chunkCrcs[chunk] = chunkCrc
+                        changed = True
+            if changed:
+                self._combine()
+
+    def _combine(self) -> None:
+        chunkCrcs = self._chunkCrcs
+        assert chunkCrcs is not None
+        if not chunkCrcs:
+            self._crc32 = 0
+            return
+        fullChunk = list(_zerosOperator(self._chunkSize))
+        total = chunkCrcs[0]
+        for chunkCrc in chunkCrcs[1:-1]:
+            total = _gf2Times(fullChunk, total) ^ chunkCrc
+        if len(chunkCrcs) > 1:
+            lastSize = self._romData.size() - (len(chunkCrcs) - 1) * self._chunkSize
+            total = crc32Combine(total, chunkCrcs[-1], lastSize)
+        self._crc32 = total
+
+def hashRomData(romData: RomData, algorithms: Iterable[str]=HASH_ALGORITHMS, cancelled: Cancelled=None) \
+-> Optional[Dict[str, str]]:
+    '''Returns the hex digest of `romData` for each `hashlib` algorithm.
+    Every algorithm is fed in the same pass. Returns `None` if `cancelled`.'''
+    hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    if not hashes:
+        return {}
+    with span('checksums.hash', algorithms=','.join(hashes)):
+        for chunk in _chunks(romData, HASH_CHUNK_SIZE):
+            if cancelled is not None and cancelled():
+                return None
+            for hash in hashes.values():
+                hash.update(chunk)
+    return {algorithm: hash.hexdigest() for algorithm, hash in hashes.items()}
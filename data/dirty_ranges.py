@@ -0,0 +1,58 @@
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Tuple
+
+class DirtyRanges:
+    '''A set of modified byte ranges, kept sorted and merged.
+
+    Ranges are half-open (`[start, end)`). Adding a range that overlaps or
+    touches existing ones merges them all into a single range.
+    '''
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._ends: List[int] = []
+
+    def add(self, start: int, end: int) -> None:
+        'Marks `[start, end)` as dirty.'
+        if end <= start:
+            return
+
+        # Every range that ends at or after our start, and starts at or before
+        # our end, overlaps or touches us.
+        first = bisect_left(self._ends, start)
+        last = bisect_right(self._starts, end)
+        if first < last:
+            start = min(start, self._starts[first])
+            end = max(end, self._ends[last - 1])
+        self._starts[first:last] = [start]
+        self._ends[first:last] = [end]
+
+    def clear(self) -> None:
+        'Forgets all dirty ranges.'
+        self._starts.clear()
+        self._ends.clear()
+
+    def totalSize(self) -> int:
+        'Returns the total number of dirty bytes.'
+        return sum(self._ends) - sum(self._starts)
+
+    def pages(self, pageSize: int) -> List[Tuple[int, int]]:
+        '''Returns the dirty ranges expanded out to whole `pageSize` pages,
+        with ranges that now touch merged together.'''
+        pages = DirtyRanges()
+        for start, end in self:
+            pages.add(start - start % pageSize, end + -end % pageSize)
+        return list(pages)
+
+    def __bool__(self) -> bool:
+        return len(self._starts) > 0
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        return zip(self._starts, self._ends)
+
+    def __str__(self) -> str:
+        return f'{DirtyRanges.__name__}(' + \
+            ', '.join(f'[{hex(start)}, {hex(end)})' for start, end in self) + ')'
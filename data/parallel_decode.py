@@ -0,0 +1,106 @@
+'''
+Decodes a game's whole script across a pool of worker processes.
+
+Meant for batch jobs (dumping, diffing, searching) where decoding every
+string in one process is the bottleneck. Work is split up by text block.
+
+Workers never receive ROM data through pickling. Each worker memory-maps the
+ROM file itself (see `RomData.fromFile`), so every worker reads the same pages
+from the OS page cache. ROM data that only exists in memory (e.g. unsaved
+edits) is written to a temporary file once, then mapped the same way. Only
+the parent's `TextIndex` arrays are sent over, so workers don't have to walk
+every length table again.
+'''
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, remove
+from tempfile import NamedTemporaryFile
+from typing import List, Optional, Tuple
+
+from .rom_data import RomData
+from .rom_text import CharPointerPair, CharTreeBlock
+from .text_decoder import TextDecoder
+from .text_index import TextIndex
+
+TASKS_PER_WORKER = 4
+'''Blocks are split into about this many tasks per worker, so a worker that
+gets a block of long strings doesn't hold everyone else up.'''
+
+# Set up once per worker process by _initWorker.
+_workerDecoder: Optional[TextDecoder] = None
+
+def _initWorker(romPath: str, pairAddress: int, textTableAddress: int, textIndexArrays: List['array[int]']) -> None:
+    global _workerDecoder
+    romData = RomData.fromFile(romPath)
+    treeBlock = CharTreeBlock(romData, CharPointerPair(romData, pairAddress))
+    # The parent already walked every length table, so don't do it again here.
+    textIndex = TextIndex.fromArrays(textTableAddress, textIndexArrays)
+    _workerDecoder = TextDecoder(romData, treeBlock, textIndex)
+
+def _decodeBlocks(blocks: Tuple[int, int]) -> List[str]:
+    'Decodes every string in blocks `[start, end)`, in ID order.'
+    decoder = _workerDecoder
+    if decoder is None:
+        raise Exception('Worker used before being initialized.')
+
+    textIndex = decoder.textIndex()
+    return [
+        decoder.decodeString(id)
+        for block in range(*blocks)
+        for id in textIndex.blockRange(block)
+    ]
+
+def decodeScript(
+    romSource: 'str|RomData',
+    pairAddress: int,
+    textTableAddress: int,
+    maxWorkers: Optional[int]=None,
+) -> List[str]:
+    '''Decodes every string in the ROM, indexed by string ID.
+
+    `romSource` is either a path to a ROM file or already-loaded `RomData`.
+    `pairAddress` and `textTableAddress` are the addresses of the
+    `CharPointerPair` and the Text Block Pointer Table, respectively.
+    '''
+    if isinstance(romSource, RomData):
+        romData = romSource
+    else:
+        romData = RomData.fromFile(romSource)
+
+    textIndex = TextIndex(romData, textTableAddress)
+    blockCount = textIndex.blockCount()
+    if blockCount == 0:
+        return []
+
+    tempPath: Optional[str] = None
+    if isinstance(romSource, RomData):
+        with NamedTemporaryFile(suffix='.gba', delete=False) as tempFile:
+            tempFile.write(romSource.getBytes(0, romSource.size()))
+            tempPath = tempFile.name
+        romPath = tempPath
+    else:
+        romPath = romSource
+
+    try:
+        maxWorkers = max(1, min(maxWorkers or cpu_count() or 1, blockCount))
+
+        # Split blocks into roughly even, contiguous ranges. Since
+        # executor.map returns results in task order, concatenating them puts
+        # strings back in ID order.
+        taskCount = min(blockCount, maxWorkers * TASKS_PER_WORKER)
+        bounds = [blockCount * task // taskCount for task in range(taskCount + 1)]
+        tasks = list(zip(bounds, bounds[1:]))
+
+        strings: List[str] = []
+        with ProcessPoolExecutor(
+            max_workers=maxWorkers,
+            initializer=_initWorker,
+            initargs=(romPath, pairAddress, textTableAddress, textIndex.arrays()),
+        ) as executor:
+            for blockStrings in executor.map(_decodeBlocks, tasks):
+                strings.extend(blockStrings)
+        return strings
+    finally:
+        if tempPath is not None:
+            remove(tempPath)
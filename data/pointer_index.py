@@ -0,0 +1,117 @@
+'''
+A reverse index of every pointer in the ROM, for relocating data.
+
+Moving anything (a text block, the char trees, ...) means rewriting every
+pointer to it, and pointers can be anywhere. `PointerIndex` scans every
+aligned 32-bit word once, keeps the ones that point into the ROM (see
+`ROM_OFFSET`), and sorts them by target. After that, "who points at X" and
+"what points into [a, b)" are each a binary search.
+
+The scan is a single vectorized pass with NumPy, if it's installed. Without
+it, a regex over the high byte of every word finds the candidates (like
+`rom_scanner` does), which is slower but still well under a second for a
+16 MiB ROM.
+
+Any word that looks like a pointer is counted, so there will be false
+positives (e.g. code or data that happens to look like an address). Check
+what's around a pointer before rewriting it.
+'''
+
+from array import array
+from bisect import bisect_left
+from typing import List, Tuple
+import re
+
+from .rom_data import numpy, RomData
+from .rom_text import ROM_OFFSET
+from .tracing import span
+
+class PointerIndex:
+    '''Every aligned word in a ROM that points into the ROM, sorted by target.
+
+    Addresses (both where a pointer is and where it points) are offsets into
+    the ROM data, without `ROM_OFFSET`.
+
+    NOTE: Not an accessor over `RomData`. It reflects the data as it was
+    when the index was built, so rebuild it after moving things around.
+    '''
+
+    def __init__(self, romData: RomData):
+        self._targets = array('I')
+        'Where each pointer points, in ascending order.'
+        self._sources = array('I')
+        'Where each pointer is, in the same order as `_targets`.'
+
+        with span('pointerIndex.build', size=romData.size()):
+            if numpy is not None:
+                self._scanNumpy(romData)
+            else:
+                self._scanRegex(romData)
+
+    def _scanNumpy(self, romData: RomData) -> None:
+        words = romData.getInt32Array(0, romData.size() // 4, asNumpy=True)
+        isPointer = (words >= ROM_OFFSET) & (words < ROM_OFFSET + romData.size())
+        sources = numpy.flatnonzero(isPointer).astype(numpy.uint32) * 4
+        targets = (words[isPointer] - ROM_OFFSET).astype(numpy.uint32)
+        # Stable, so pointers to the same target stay in address order.
+        order = numpy.argsort(targets, kind='stable')
+        self._targets.frombytes(targets[order].tobytes())
+        self._sources.frombytes(sources[order].tobytes())
+
+    def _scanRegex(self, romData: RomData) -> None:
+        size = romData.size() - romData.size() % 4
+        if size == 0:
+            return
+        words = romData.getInt32Array(0, size // 4)
+        # Pull out the high byte of every word (a cheap, strided copy) and
+        # find the ones that could be ROM pointers: 0x08, or 0x09 for 32 MiB ROMs.
+        highBytes = romData.getInt8Array(0, size)[3::4].tobytes()
+        pattern = re.compile(b'[' + re.escape(bytes(range(0x08, 0x08 + -(-romData.size() // 0x1000000)))) + b']')
+        romEnd = ROM_OFFSET + romData.size()
+
+        sources = array('I')
+        targets = array('I')
+        for match in pattern.finditer(highBytes):
+            index = match.start()
+            word = words[index]
+            if word < romEnd:
+                sources.append(index * 4)
+                targets.append(word - ROM_OFFSET)
+
+        # sorted() is stable, so pointers to the same target stay in address order.
+        order = sorted(range(len(targets)), key=targets.__getitem__)
+        self._targets = array('I', (targets[i] for i in order))
+        self._sources = array('I', (sources[i] for i in order))
+
+    @staticmethod
+    def fromArrays(arrays: List['array[int]']) -> 'PointerIndex':
+        '''Rebuilds an index from the `arrays()` of an earlier one, without reading any ROM data.
+        :raises
+            ValueError: if `arrays` don't look like they came from `arrays()`.
+        '''
+        if [values.typecode for values in arrays] != ['I', 'I'] or len(arrays[0]) != len(arrays[1]):
+            raise ValueError('Not the arrays of a PointerIndex')
+        index = PointerIndex.__new__(PointerIndex)
+        index._targets, index._sources = arrays
+        return index
+
+    def arrays(self) -> List['array[int]']:
+        'Returns the whole index as flat arrays, e.g. to cache it. See `fromArrays`.'
+        return [self._targets, self._sources]
+
+    def __len__(self) -> int:
+        return len(self._targets)
+
+    def pointersTo(self, address: int) -> List[int]:
+        'Returns the address of every pointer to `address`, in ascending order.'
+        return [source for source, _ in self.pointersInto(address, address + 1)]
+
+    def pointersInto(self, start: int, end: int) -> List[Tuple[int, int]]:
+        '''Returns `(pointer address, target)` for every pointer to an address
+        in `[start, end)`, ordered by target, then pointer address.'''
+        first = bisect_left(self._targets, start)
+        last = bisect_left(self._targets, end, first)
+        return list(zip(self._sources[first:last], self._targets[first:last]))
+
+    def __str__(self) -> str:
+        return f'{PointerIndex.__name__}({len(self)} pointers)'
@@ -1,6 +1,21 @@
+from array import array
 from binascii import crc32
-from typing import cast
+from typing import Any, cast, Iterator, Pattern, Sequence, TYPE_CHECKING
+import mmap
+import re
 import struct
+import sys
+
+from .dirty_ranges import DirtyRanges
+from .tracing import span
+
+try:
+    import numpy
+except ImportError: # NumPy is optional. Only needed for `asNumpy=True`.
+    numpy = None
+
+if TYPE_CHECKING:
+    from .rom_journal import RomJournal
 
 class RomData:
     '''Holds the data of a ROM file in a `memoryview`.
@@ -10,23 +25,62 @@ class RomData:
     as invalid memory values.
 
     All operations are little-endian.
+
+    Every write through this class is recorded in a set of dirty ranges, so
+    saving only has to write back what changed. Slices share their parent's
+    dirty ranges. Writes made some other way (e.g. through an array returned
+    by `getInt32Array`) should be reported with `markDirty`.
+
+    Writes are also recorded in a `RomJournal`, if one is attached, so they
+    can be undone. Writes reported with `markDirty` can't be.
     '''
 
     @staticmethod
-    def fromFile(filePath: str) -> 'RomData':
-        with open(filePath, 'rb') as romFile:
+    def fromFile(filePath: str, mapped: bool=True) -> 'RomData':
+        '''Loads a ROM file from disk.
+
+        By default the file is memory-mapped copy-on-write instead of read in
+        up front. Reads go straight to the mapped file without copying, and
+        writes land in private pages that the OS only copies when they're
+        first touched. The file on disk is never modified by writes to the
+        returned `RomData`.
+
+        Pass `mapped=False` to read the whole file into a private buffer.
+        '''
+        with span('romData.fromFile', mapped=mapped), open(filePath, 'rb') as romFile:
+            if mapped:
+                try:
+                    # The mapping stays valid after the file is closed.
+                    romMap = mmap.mmap(romFile.fileno(), 0, access=mmap.ACCESS_COPY)
+                    return RomData(memoryview(romMap))
+                except ValueError:
+                    # Empty files can't be mapped. Fall through to a plain read.
+                    pass
             romData = memoryview(bytearray(romFile.read()))
         return RomData(romData)
 
     def __init__(self, romDataView: memoryview):
         self._romDataView = romDataView
+        self._dirty = DirtyRanges()
+        self._base = 0
+        'Where this data starts in `_dirty`. Non-zero for slices.'
+        self._root = self
+        'The unsliced data. Holds the journal, so slices see it even if attached later.'
+        self._journal: 'RomJournal|None' = None
 
     def __getitem__(self, subscript: 'int|slice') -> 'int|RomData':
         '''An accessor for getting single bytes or byte ranges of RomData.
         Slices are wrapped in a new `RomData`
         '''
         if isinstance(subscript, slice):
-            return RomData(self._romDataView[subscript])
+            start, _, step = subscript.indices(len(self))
+            if step != 1:
+                raise ValueError('RomData slices must be contiguous')
+            sliced = RomData(self._romDataView[subscript])
+            sliced._dirty = self._dirty
+            sliced._base = self._base + start
+            sliced._root = self._root
+            return sliced
         else:
             return self._romDataView[subscript]
 
@@ -35,7 +89,8 @@ class RomData:
 
     def crc32(self) -> str:
         'The hexadecimal CRC32 hash of the binary data.'
-        return hex(crc32(self._romDataView))[2:]
+        with span('romData.crc32', size=len(self)):
+            return hex(crc32(self._romDataView))[2:]
 
     def size(self) -> int:
         '''An alias for `len(self)` to avoid that awkward thing where
@@ -56,15 +111,110 @@ class RomData:
 
     def setInt8(self, index: int, value: int) -> None:
         'Writes an 8-bit, unsigned, little-endian int to `index`.'
-        struct.pack_into('<B', self._romDataView, index, value)
+        self._write(index, struct.pack('<B', value))
 
     def setInt16(self, index: int, value: int) -> None:
         'Writes a 16-bit, unsigned, little-endian int to `index`.'
-        struct.pack_into('<H', self._romDataView, index, value)
+        self._write(index, struct.pack('<H', value))
 
     def setInt32(self, index: int, value: int) -> None:
         'Writes a 32-bit, unsigned, little-endian int to `index`.'
-        struct.pack_into('<I', self._romDataView, index, value)
+        self._write(index, struct.pack('<I', value))
+
+    def _write(self, index: int, data: bytes) -> None:
+        'Every write goes through here, so it gets marked dirty and journaled.'
+        end = index + len(data)
+        if index < 0 or end > len(self):
+            raise IndexError(f'Bytes [{hex(index)}, {hex(end)}) out of range')
+        journal = self._root._journal
+        if journal is not None:
+            old = self._romDataView[index:end].tobytes()
+        self._romDataView[index:end] = data
+        self.markDirty(index, end)
+        if journal is not None:
+            journal.record(self._base + index, old, bytes(data))
+
+    def journal(self) -> 'RomJournal|None':
+        'Returns the journal recording writes to this data, if there is one.'
+        return self._root._journal
+
+    def setJournal(self, journal: 'RomJournal|None') -> None:
+        '''Records every write to this data (and all of its slices) in `journal`.
+        Usually called by `RomJournal` itself.'''
+        if self._root is not self:
+            raise ValueError('Journals must be attached to the whole ROM, not a slice')
+        self._journal = journal
+
+    def markDirty(self, start: int, end: int) -> None:
+        'Records that `[start, end)` was modified.'
+        self._dirty.add(self._base + start, self._base + end)
+
+    def dirtyRanges(self) -> DirtyRanges:
+        '''Returns the ranges modified since the last `clearDirty`.
+
+        NOTE: For slices, these are relative to the original (unsliced) data.
+        '''
+        return self._dirty
+
+    def isDirty(self) -> bool:
+        'Returns whether anything was modified since the last `clearDirty`.'
+        return bool(self._dirty)
+
+    def clearDirty(self) -> None:
+        'Forgets all modified ranges, e.g. after saving.'
+        self._dirty.clear()
+
+    def getInt8Array(self, start: int, count: int, asNumpy: bool=False) -> Any:
+        '''Reads `count` 8-bit, unsigned ints starting at `start`.
+        See `getInt32Array` for the return type.'''
+        return self._getArray('B', start, count, asNumpy)
+
+    def getInt16Array(self, start: int, count: int, asNumpy: bool=False) -> Any:
+        '''Reads `count` 16-bit, unsigned, little-endian ints starting at `start`.
+        See `getInt32Array` for the return type.'''
+        return self._getArray('H', start, count, asNumpy)
+
+    def getInt32Array(self, start: int, count: int, asNumpy: bool=False) -> Any:
+        '''Reads `count` 32-bit, unsigned, little-endian ints starting at `start`.
+
+        Returns a typed `memoryview` over the ROM data, so nothing is copied
+        and writes to the data show up in the view. With `asNumpy=True` this
+        is a (still zero-copy) NumPy array instead. On big-endian machines
+        the plain path has to byte swap, so it returns a copied `array`.
+        '''
+        return self._getArray('I', start, count, asNumpy)
+
+    def setInt8Array(self, start: int, values: Sequence[int]) -> None:
+        'Writes `values` as 8-bit, unsigned ints starting at `start`.'
+        self._setArray('B', start, values)
+
+    def setInt16Array(self, start: int, values: Sequence[int]) -> None:
+        'Writes `values` as 16-bit, unsigned, little-endian ints starting at `start`.'
+        self._setArray('H', start, values)
+
+    def setInt32Array(self, start: int, values: Sequence[int]) -> None:
+        'Writes `values` as 32-bit, unsigned, little-endian ints starting at `start`.'
+        self._setArray('I', start, values)
+
+    def _getArray(self, fmt: str, start: int, count: int, asNumpy: bool) -> Any:
+        end = start + count * struct.calcsize(fmt)
+        if start < 0 or count < 0 or end > len(self):
+            raise IndexError(f'Array [{hex(start)}, {hex(end)}) out of range')
+        byteView = self._romDataView[start:end]
+
+        if asNumpy:
+            if numpy is None:
+                raise ImportError('asNumpy=True requires NumPy to be installed')
+            return numpy.frombuffer(byteView, dtype=f'<{fmt}')
+        if sys.byteorder == 'little' or fmt == 'B':
+            return byteView.cast(fmt)
+
+        values = array(fmt, byteView.tobytes())
+        values.byteswap()
+        return values
+
+    def _setArray(self, fmt: str, start: int, values: Sequence[int]) -> None:
+        self._write(start, struct.pack(f'<{len(values)}{fmt}', *values))
 
     def getAsciiString(self, index: int, length: int) -> str:
         '''Reads a chunk of memory as an ASCII string.
@@ -76,6 +226,36 @@ class RomData:
             struct.unpack_from(f'<{length}s', self._romDataView, index)[0],
         ).decode('ASCII')
 
+    def getBytes(self, index: int, length: int) -> bytes:
+        'Reads a chunk of memory as raw bytes.'
+        return self._romDataView[index:index + length].tobytes()
+
+    def view(self, start: int, end: int) -> memoryview:
+        'Returns a read-only view of `[start, end)`, without copying it.'
+        return self._romDataView[start:end].toreadonly()
+
+    def setBytes(self, index: int, data: bytes) -> None:
+        'Writes raw bytes to memory, starting at `index`.'
+        self._write(index, data)
+
+    def findAll(self, pattern: 'bytes|Pattern[bytes]', alignment: int=1) -> Iterator[int]:
+        '''Yields the address of every match of `pattern`, in order.
+
+        `pattern` is either a literal byte string (in which case matches may
+        overlap) or a compiled regex. Only addresses that are a multiple of
+        `alignment` are returned. The search itself runs in C, so this is much
+        faster than reading the data one value at a time.
+        '''
+        if isinstance(pattern, bytes):
+            # Only the first byte is consumed, so matches can overlap.
+            pattern = re.compile(
+                re.escape(pattern[:1]) + b'(?=' + re.escape(pattern[1:]) + b')',
+                re.DOTALL,
+            )
+        for match in pattern.finditer(self._romDataView):
+            if match.start() % alignment == 0:
+                yield match.start()
+
     # NOTE: There is no setAsciiString because it would be a pain in the ass.
 
     def getSliceRange(self, start: 'int|None'=None, end: 'int|None'=None) -> 'RomData':
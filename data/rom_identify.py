@@ -0,0 +1,157 @@
+'''
+Identifies whole libraries of ROM files as vanilla, modified or unknown.
+
+Each file is triaged as cheaply as possible:
+1. Only the header is read, to get the game ID. Unknown IDs stop here.
+2. The file size is checked against the known vanilla ROM. A vanilla ROM can
+   only have one size, so anything else is modified without hashing it.
+3. Only files that pass both are hashed (or their CRC32 is taken from the
+   analysis cache, if the file hasn't changed since it was last hashed).
+
+Files are identified on a thread pool. Hashing releases the GIL, so threads
+are enough to keep every core busy, and results are yielded as they arrive.
+'''
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from os import cpu_count, scandir, stat
+from os.path import isdir, splitext
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from .analysis_cache import AnalysisCache
+from .rom_data import RomData
+from .rom_header import GBA_HEADER_ID_ADDR, GBA_HEADER_ID_LEN, GbaHeader
+from .rom_loader import ROM_INFO_MAP
+from .tracing import span
+
+ROM_EXTENSIONS = {'.gba'}
+'File extensions picked up when walking a directory.'
+
+HEADER_SIZE = GBA_HEADER_ID_ADDR + GBA_HEADER_ID_LEN
+'How much of a file is read to get its game ID.'
+
+VANILLA = 'vanilla'
+MODIFIED = 'modified'
+UNKNOWN = 'unknown'
+
+@dataclass
+class Identification:
+    'What a single ROM file turned out to be.'
+    path: str
+    status: str
+    '`VANILLA`, `MODIFIED` or `UNKNOWN`.'
+    gameId: Optional[str]
+    'From the header. `None` if the file is too small to have one.'
+    name: Optional[str]
+    'Name of the game, if the game ID is known.'
+    size: int
+    expectedSize: Optional[int]
+    crc32: Optional[str]
+    "`None` if it didn't need to be hashed to tell what the ROM is."
+    expectedCrc32: Optional[str]
+
+    def toDict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+def findRomFiles(
+    paths: Iterable[str],
+    extensions: Set[str]=ROM_EXTENSIONS,
+    onError: Optional[Callable[[str, OSError], None]]=None,
+) -> Iterator[str]:
+    '''Yields every path in `paths` that's a file, and every file with one of
+    `extensions` in (and below) every path that's a directory.
+
+    Directories that can't be read are passed to `onError` and skipped, or
+    raise if there's no `onError`. Symlinked directories aren't followed, so a
+    link back up the tree can't loop forever. Symlinked files are still found.
+    '''
+    for path in paths:
+        if not isdir(path):
+            yield path
+            continue
+        directories = [path]
+        while directories:
+            directory = directories.pop()
+            try:
+                # Sorted so results come out in the same order every run.
+                entries = sorted(scandir(directory), key=lambda entry: entry.name, reverse=True)
+            except OSError as e:
+                if onError is None:
+                    raise
+                onError(directory, e)
+                continue
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif splitext(entry.name)[1].lower() in extensions and entry.is_file():
+                    yield entry.path
+
+def identifyRom(path: str, cache: Optional[AnalysisCache]=None) -> Identification:
+    '''Identifies a single ROM file, hashing it only if needed.
+    :raises
+        OSError: if the file can't be read.
+    '''
+    with span('identify.rom'):
+        size = stat(path).st_size
+        with open(path, 'rb') as romFile:
+            header = romFile.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            return Identification(path, UNKNOWN, None, None, size, None, None, None)
+
+        try:
+            gameId = GbaHeader(RomData(memoryview(bytearray(header)))).gameId()
+        except UnicodeDecodeError:
+            # Not a GBA ROM, or not one with a real header.
+            return Identification(path, UNKNOWN, None, None, size, None, None, None)
+        info = ROM_INFO_MAP.get(gameId)
+        if info is None:
+            return Identification(path, UNKNOWN, gameId, None, size, None, None, None)
+        if size != info.size:
+            return Identification(path, MODIFIED, gameId, info.name, size, info.size, None, info.crc32)
+
+        crc32 = cache.fileHashes(path).get('crc32') if cache is not None else None
+        if crc32 is None:
+            crc32 = RomData.fromFile(path).crc32()
+            if cache is not None:
+                cache.rememberFileHashes(path, {'crc32': crc32})
+        status = VANILLA if crc32 == info.crc32 else MODIFIED
+        return Identification(path, status, gameId, info.name, size, info.size, crc32, info.crc32)
+
+@dataclass
+class IdentifyError:
+    'A file that could not be identified.'
+    path: str
+    error: str
+
+def identifyRoms(paths: Iterable[str], jobs: Optional[int]=None, cache: Optional[AnalysisCache]=None) \
+-> Iterator['Identification|IdentifyError']:
+    '''Identifies every ROM in `paths` (files or directories, see `findRomFiles`).
+
+    Yields each result as soon as it's ready, so the order isn't the order of
+    `paths`. Files that can't be read are yielded as an `IdentifyError`.
+    Directories are walked while earlier files are being identified, so the
+    first results arrive before the walk is done.
+    '''
+    jobs = jobs or min(32, (cpu_count() or 1) + 4)
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='identify') as pool:
+        pending: Dict['Future[Identification]', str] = {}
+        walkErrors: List[IdentifyError] = []
+
+        def finished(block: bool) -> Iterator['Identification|IdentifyError']:
+            done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    yield future.result()
+                except OSError as e:
+                    yield IdentifyError(path, str(e))
+
+        for path in findRomFiles(paths, onError=lambda path, e: walkErrors.append(IdentifyError(path, str(e)))):
+            yield from walkErrors
+            walkErrors.clear()
+            pending[pool.submit(identifyRom, path, cache)] = path
+            # Keep a few files queued per worker, rather than the whole library.
+            yield from finished(block=len(pending) >= jobs * 4)
+        yield from walkErrors
+        while pending:
+            yield from finished(block=True)
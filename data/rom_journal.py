@@ -0,0 +1,206 @@
+'''
+An undo/redo history for edits to `RomData`.
+
+Only the bytes that changed are stored, as `(offset, old bytes, new bytes)`
+parts, so undoing a two-byte edit to a 16 MiB ROM costs two bytes, not a
+snapshot of the whole ROM. Undo and redo write through `RomData.setBytes`,
+which marks the bytes dirty, so `Rom.save` picks them up like any other edit.
+
+Every write between two calls to `checkpoint` makes up one entry, which is
+undone and redone as a whole. One user action often writes to places far
+apart (e.g. a text block and the pointer table that points at it), and
+undoing only some of those writes would leave the ROM broken. Call
+`checkpoint` (or use `transaction`) around each user action. Within an entry,
+writes that overlap or touch are merged into one part, so e.g. writing a
+table one int at a time only stores it once.
+'''
+
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Iterator, List
+
+from .rom_data import RomData
+
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+'Default memory cap for a journal, counting both old and new bytes.'
+
+@dataclass
+class JournalPart:
+    'A single run of changed bytes.'
+    offset: int
+    'Where the edit starts, relative to the start of the (unsliced) ROM data.'
+    old: bytes
+    'The bytes before the edit.'
+    new: bytes
+    'The bytes after the edit.'
+
+    def end(self) -> int:
+        return self.offset + len(self.new)
+
+    def size(self) -> int:
+        'Roughly how much memory this part holds onto.'
+        return len(self.old) + len(self.new)
+
+@dataclass
+class JournalEntry:
+    'Every write between two checkpoints, undone and redone together.'
+    parts: List[JournalPart] = field(default_factory=list)
+    'In the order they were first written. Parts never overlap or touch.'
+
+    def size(self) -> int:
+        'Roughly how much memory this entry holds onto.'
+        return sum(part.size() for part in self.parts)
+
+class RomJournal:
+    '''Records every write to a `RomData` so it can be undone and redone.
+
+    Attaches itself to `romData` when created. Entries are dropped
+    oldest-first once the undo and redo history together hold more than
+    `maxBytes` of data, except for the newest one.
+    '''
+
+    def __init__(self, romData: RomData, maxBytes: int=DEFAULT_MAX_BYTES):
+        self._romData = romData
+        self._maxBytes = maxBytes
+        self._undoStack: Deque[JournalEntry] = deque()
+        self._redoStack: List[JournalEntry] = []
+        self._size = 0
+        self._coalesce = False
+        'Whether the next write may be merged into the newest undo entry.'
+        self._replaying = False
+        romData.setJournal(self)
+
+    def record(self, offset: int, old: bytes, new: bytes) -> None:
+        '''Records a write of `new` over `old` at `offset`.
+        Called by `RomData` for every write; there's no need to call this directly.'''
+        if self._replaying or old == new:
+            return
+
+        if self._redoStack:
+            self._size -= sum(entry.size() for entry in self._redoStack)
+            self._redoStack.clear()
+
+        if not (self._coalesce and self._undoStack):
+            self._undoStack.append(JournalEntry())
+        entry = self._undoStack[-1]
+        self._size -= entry.size()
+
+        # Fold every part this write overlaps or touches into one. Tables are
+        # usually written front to back, so the newest part is checked first.
+        merged = JournalPart(offset, bytes(old), bytes(new))
+        kept: List[JournalPart] = []
+        for part in reversed(entry.parts):
+            if merged.offset <= part.end() and part.offset <= merged.end():
+                merged = RomJournal._merge(part, merged)
+            else:
+                kept.append(part)
+        kept.reverse()
+        kept.append(merged)
+        entry.parts = kept
+
+        self._size += entry.size()
+        self._coalesce = True
+        self._evict()
+
+    @staticmethod
+    def _merge(earlier: JournalPart, later: JournalPart) -> JournalPart:
+        'Merges two parts that overlap or touch, where `later` was written after `earlier`.'
+        start = min(earlier.offset, later.offset)
+        end = max(earlier.end(), later.end())
+
+        # Bytes first written by `earlier` keep its old value. Everything else
+        # keeps the old value from `later`.
+        mergedOld = bytearray(end - start)
+        mergedOld[later.offset - start:later.end() - start] = later.old
+        mergedOld[earlier.offset - start:earlier.end() - start] = earlier.old
+
+        mergedNew = bytearray(end - start)
+        mergedNew[earlier.offset - start:earlier.end() - start] = earlier.new
+        mergedNew[later.offset - start:later.end() - start] = later.new
+        return JournalPart(start, bytes(mergedOld), bytes(mergedNew))
+
+    def _evict(self) -> None:
+        '''Drops the oldest entries until the journal fits in its memory cap.
+        The newest entry is always kept, even if it's over the cap by itself,
+        so the last edit can always be undone.'''
+        while self._size > self._maxBytes and len(self._undoStack) > 1:
+            self._size -= self._undoStack.popleft().size()
+        # Redo entries are only dropped if the newest edit is over the cap by itself.
+        while self._size > self._maxBytes and self._redoStack:
+            self._size -= self._redoStack.pop(0).size()
+
+    def checkpoint(self) -> None:
+        'Ends the current entry. The next write will start a new one.'
+        self._coalesce = False
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        'Makes every write inside the `with` block a single entry, separate from any before or after.'
+        self.checkpoint()
+        try:
+            yield
+        finally:
+            self.checkpoint()
+
+    def canUndo(self) -> bool:
+        return len(self._undoStack) > 0
+
+    def canRedo(self) -> bool:
+        return len(self._redoStack) > 0
+
+    def undo(self) -> 'JournalEntry|None':
+        'Reverts the newest entry. Returns it, or `None` if there was nothing to undo.'
+        if not self._undoStack:
+            return None
+        entry = self._undoStack.pop()
+        with self._replay():
+            for part in reversed(entry.parts):
+                self._romData.setBytes(part.offset, part.old)
+        self._redoStack.append(entry)
+        self._coalesce = False
+        return entry
+
+    def redo(self) -> 'JournalEntry|None':
+        'Reapplies the most recently undone entry. Returns it, or `None` if there was nothing to redo.'
+        if not self._redoStack:
+            return None
+        entry = self._redoStack.pop()
+        with self._replay():
+            for part in entry.parts:
+                self._romData.setBytes(part.offset, part.new)
+        self._undoStack.append(entry)
+        self._coalesce = False
+        return entry
+
+    @contextmanager
+    def _replay(self) -> Iterator[None]:
+        'Stops our own undo/redo writes from being recorded as new edits.'
+        self._replaying = True
+        try:
+            yield
+        finally:
+            self._replaying = False
+
+    def clear(self) -> None:
+        'Forgets all undo and redo history.'
+        self._undoStack.clear()
+        self._redoStack.clear()
+        self._size = 0
+        self._coalesce = False
+
+    def size(self) -> int:
+        'Returns how many bytes of history the journal is holding.'
+        return self._size
+
+    def maxSize(self) -> int:
+        return self._maxBytes
+
+    def setMaxSize(self, maxBytes: int) -> None:
+        'Changes the memory cap, dropping old entries if needed.'
+        self._maxBytes = maxBytes
+        self._evict()
+
+    def __str__(self) -> str:
+        return f'{RomJournal.__name__}(undo: {len(self._undoStack)}, ' + \
+            f'redo: {len(self._redoStack)}, {self._size}/{self._maxBytes} bytes)'
@@ -1,8 +1,27 @@
+from array import array
 from dataclasses import dataclass
-from typing import Optional
+from mmap import PAGESIZE
+from os import close, fsync, remove, replace
+from os.path import abspath, dirname, exists, samefile
+from shutil import copyfile
+from tempfile import mkstemp
+from typing import Any, BinaryIO, Callable, cast, Dict, Iterable, List, Optional, TypeVar
 
+from .analysis_cache import AnalysisCache
+from .checksums import Cancelled, HASH_ALGORITHMS, hashRomData, IncrementalCrc32
 from .rom_data import RomData
+from .pointer_index import PointerIndex
 from .rom_header import GbaHeader
+from .rom_journal import RomJournal
+from .rom_scanner import scanTextAnchors, TextAnchors
+from .rom_text import CharPointerPair, CharTreeBlock
+from .string_provider import StringProvider
+from .text_decoder import TextDecoder
+from .text_encoder import TextEncoder
+from .text_index import TextIndex
+from .tracing import span
+
+T = TypeVar('T')
 
 @dataclass
 class RomInfo:
@@ -196,14 +215,26 @@ ROM_INFO_MAP = {
 class Rom:
     '''The entry point for reading and manipulating ROM data.
     Contains handles for working with things like ROM headers and string lists.
+
+    Pass an `AnalysisCache` to remember the results of scanning the ROM
+    between sessions. It's only used while the data matches the file on disk.
     '''
     # TODO this might be better in RomInfo
     UNKNOWN_NAME = '<Unknown>'
 
-    def __init__(self, filepath: str):
+    def __init__(self, filepath: str, cache: Optional[AnalysisCache]=None):
         self._data = RomData.fromFile(filepath)
         self._filePath = filepath
+        self._cache = cache
+        self._fileHashes: Dict[str, str] = {}
+        'Hashes of the file on disk worked out so far, keyed by algorithm.'
+        self._incrementalCrc = IncrementalCrc32(self._data)
         self._header = GbaHeader(self._data)
+        self._journal = RomJournal(self._data)
+        self._textAnchors: Optional[TextAnchors] = None
+        self._strings: Optional[StringProvider] = None
+        self._pointerIndex: Optional[PointerIndex] = None
+        self._parsed: Dict[str, Any] = {}
 
     def data(self) -> RomData:
         'Returns the underlying ROM data.'
@@ -216,6 +247,261 @@ class Rom:
     def header(self) -> GbaHeader:
         return self._header
 
+    def journal(self) -> RomJournal:
+        '''Returns the undo/redo history for edits to this ROM.
+        Use `undo` and `redo` here rather than on the journal, so the script is reloaded.'''
+        return self._journal
+
+    def save(self) -> int:
+        '''Writes changes back to the ROM file on disk.
+
+        Only the pages that were modified get written, so this costs about the
+        same for a one-byte edit to a 16 MiB ROM as it does for a tiny file.
+        Returns the number of bytes written.
+        '''
+        with open(self._filePath, 'r+b') as romFile:
+            written = self._writeDirtyPages(romFile)
+        self._afterSave()
+        return written
+
+    def saveAs(self, filePath: str) -> int:
+        '''Writes the ROM to a new file on disk, and uses that file from now on.
+
+        The original file is copied to a temporary file next to `filePath`,
+        modified pages are written on top of it, then it's renamed into place.
+        This way `filePath` is never left half-written.
+        Returns the number of modified bytes written.
+        '''
+        if exists(filePath) and samefile(filePath, self._filePath):
+            return self.save()
+
+        tempFd, tempPath = mkstemp(dir=dirname(abspath(filePath)), suffix='.tmp')
+        close(tempFd)
+        try:
+            copyfile(self._filePath, tempPath)
+            with open(tempPath, 'r+b') as romFile:
+                written = self._writeDirtyPages(romFile)
+            replace(tempPath, filePath)
+        except BaseException:
+            remove(tempPath)
+            raise
+
+        self._filePath = filePath
+        self._afterSave()
+        return written
+
+    def _afterSave(self) -> None:
+        'Clears the dirty ranges, and remembers the CRC32 of the file now on disk.'
+        self._fileHashes = {}
+        # Only if it's cheap, i.e. just the edits need rehashing.
+        if self._incrementalCrc.isComputed():
+            self._fileHashes = {'crc32': cast(str, self._incrementalCrc.crc32())}
+            if self._cache is not None:
+                self._cache.rememberFileHashes(self._filePath, self._fileHashes)
+        self._data.clearDirty()
+
+    def _writeDirtyPages(self, romFile: BinaryIO) -> int:
+        'Writes every modified page to `romFile` and flushes it to disk.'
+        written = 0
+        for start, end in self._data.dirtyRanges().pages(PAGESIZE):
+            end = min(end, self._data.size())
+            romFile.seek(start)
+            romFile.write(self._data.getBytes(start, end - start))
+            written += end - start
+        romFile.flush()
+        fsync(romFile.fileno())
+        return written
+
+    def crc32(self) -> str:
+        'Returns the hexadecimal CRC32 of the ROM data. See `checksums`.'
+        return cast(Dict[str, str], self.checksums(()))['crc32']
+
+    def checksums(self, algorithms: Iterable[str]=HASH_ALGORITHMS, cancelled: Cancelled=None) \
+    -> Optional[Dict[str, str]]:
+        '''Returns the hexadecimal CRC32 and `hashlib` `algorithms` (e.g. MD5
+        and SHA-1, for matching against No-Intro) of the ROM data, keyed by name.
+
+        While the data matches the file on disk, each hash is only worked out
+        once, and is remembered by the analysis cache (if there is one) until
+        the file changes. Once the ROM is edited, the CRC32 only rehashes the
+        edited parts, but other hashes need a full pass.
+
+        Safe to call from a worker thread. Returns `None` if `cancelled`.
+        '''
+        algorithms = list(algorithms)
+        if self._data.isDirty():
+            crc32 = self._incrementalCrc.crc32(cancelled)
+            hashes = hashRomData(self._data, algorithms, cancelled)
+            if crc32 is None or hashes is None:
+                return None
+            return {'crc32': crc32, **hashes}
+
+        known = self._fileHashes
+        if self._cache is not None and not known:
+            known = self._cache.fileHashes(self._filePath)
+        found: Dict[str, str] = {}
+        if 'crc32' not in known:
+            crc32 = self._incrementalCrc.crc32(cancelled)
+            if crc32 is None:
+                return None
+            found['crc32'] = crc32
+        missing = [algorithm for algorithm in algorithms if algorithm not in known]
+        if missing:
+            hashes = hashRomData(self._data, missing, cancelled)
+            if hashes is None:
+                return None
+            found.update(hashes)
+
+        if found:
+            known = {**known, **found}
+            if self._cache is not None:
+                self._cache.rememberFileHashes(self._filePath, known)
+        # Swapped in whole, since other threads may be reading it.
+        self._fileHashes = known
+        return {'crc32': known['crc32'], **{algorithm: known[algorithm] for algorithm in algorithms}}
+
+    def _cacheKey(self) -> Optional[str]:
+        'Returns the CRC32 to look up analysis by, or `None` if the analysis cache can\'t be used.'
+        if self._cache is None or self._data.isDirty():
+            return None
+        return self.crc32()
+
+    def textAnchors(self, crc32: Optional[str]=None) -> TextAnchors:
+        '''Returns the addresses of the tables needed to read the game script.
+        Found by scanning the ROM (or loaded from the analysis cache) the first
+        time this is called. Pass `crc32` if it's already known, to skip hashing
+        the ROM again.'''
+        if self._textAnchors is None:
+            with span('rom.textAnchors'):
+                key = self._cacheKey()
+                cached = self._cache.load(key, 'textAnchors') if self._cache and key else None
+                if cached and len(cached[0]) == 2:
+                    pairAddress, textTable = cached[0]
+                    self._textAnchors = TextAnchors(
+                        pairAddress if pairAddress >= 0 else None,
+                        textTable if textTable >= 0 else None,
+                    )
+                else:
+                    self._textAnchors = scanTextAnchors(self._data, crc32 or key)
+                    if self._cache and key:
+                        anchors = self._textAnchors
+                        self._cache.store(key, 'textAnchors', [array('q', [
+                            -1 if anchors.charPointerPair is None else anchors.charPointerPair,
+                            -1 if anchors.textTable is None else anchors.textTable,
+                        ])])
+        return self._textAnchors
+
+    def _textIndex(self, textTable: int) -> TextIndex:
+        'Reads the `TextIndex`, or loads it from the analysis cache.'
+        key = self._cacheKey()
+        cached = self._cache.load(key, 'textIndex') if self._cache and key else None
+        if cached:
+            try:
+                return TextIndex.fromArrays(textTable, cached)
+            except ValueError:
+                pass
+        textIndex = TextIndex(self._data, textTable)
+        if self._cache and key:
+            self._cache.store(key, 'textIndex', textIndex.arrays())
+        return textIndex
+
+    def writeStrings(self, incremental: bool=True) -> List[int]:
+        '''Writes every string edited through `strings()` into the ROM data,
+        then reloads the script from it. Returns the text blocks that were
+        rewritten. See `TextEncoder.writeStrings`.
+        :raises
+            ValueError: if the edits can't be encoded, or don't fit in the
+            space the script has. Nothing is written, and the edits are kept.
+        '''
+        strings = self.strings()
+        edits = strings.editedStrings() if strings is not None else {}
+        if strings is None or not edits:
+            return []
+        anchors = self.textAnchors()
+        assert anchors.charPointerPair is not None and anchors.textTable is not None
+
+        with span('rom.writeStrings', edits=len(edits)):
+            treeBlock = CharTreeBlock(self._data, CharPointerPair(self._data, anchors.charPointerPair))
+            encoder = TextEncoder(self._data, treeBlock, strings.decoder().textIndex())
+            blocks = encoder.writeStrings(edits, incremental)
+            strings.clearEdits()
+            self._reloadAfterWrite()
+        return blocks
+
+    def undo(self) -> bool:
+        '''Undoes the newest edit in the `journal`, and reloads anything that
+        was read from the data it changed. Returns whether there was anything to undo.'''
+        if self._journal.undo() is None:
+            return False
+        self._reloadAfterWrite()
+        return True
+
+    def redo(self) -> bool:
+        '''Redoes the most recently undone edit in the `journal`, and reloads
+        anything that was read from the data it changed. Returns whether there was anything to redo.'''
+        if self._journal.redo() is None:
+            return False
+        self._reloadAfterWrite()
+        return True
+
+    def _reloadAfterWrite(self) -> None:
+        '''Drops or rebuilds everything read from the data, after a write that
+        may have moved it around. Strings edited through `strings()`, but not
+        written yet, are kept.'''
+        # The trees and block pointers may have changed, so everything read
+        # through them is stale.
+        strings = self._strings
+        anchors = self._textAnchors
+        if strings is not None and anchors is not None \
+        and anchors.charPointerPair is not None and anchors.textTable is not None:
+            treeBlock = CharTreeBlock(self._data, CharPointerPair(self._data, anchors.charPointerPair))
+            strings.setDecoder(TextDecoder(self._data, treeBlock, self._textIndex(anchors.textTable)))
+        self._pointerIndex = None
+
+    def pointerIndex(self, rebuild: bool=False) -> PointerIndex:
+        '''Returns the index of every pointer in the ROM, built (or loaded from
+        the analysis cache) the first time this is called.
+
+        It isn't updated by edits, so pass `rebuild` after moving data or
+        rewriting pointers.'''
+        if self._pointerIndex is None or rebuild:
+            key = self._cacheKey()
+            cached = self._cache.load(key, 'pointerIndex') if self._cache and key else None
+            if cached:
+                try:
+                    self._pointerIndex = PointerIndex.fromArrays(cached)
+                    return self._pointerIndex
+                except ValueError:
+                    pass
+            self._pointerIndex = PointerIndex(self._data)
+            if self._cache and key:
+                self._cache.store(key, 'pointerIndex', self._pointerIndex.arrays())
+        return self._pointerIndex
+
+    def strings(self) -> Optional[StringProvider]:
+        '''Returns the game script, decoded lazily by string ID.
+        `None` if the text tables couldn't be found in this ROM.
+        Edits made through it stay out of the ROM data until `writeStrings`.'''
+        if self._strings is None:
+            anchors = self.textAnchors()
+            if anchors.charPointerPair is None or anchors.textTable is None:
+                return None
+            with span('rom.strings'):
+                treeBlock = CharTreeBlock(self._data, CharPointerPair(self._data, anchors.charPointerPair))
+                textIndex = self._textIndex(anchors.textTable)
+                self._strings = StringProvider(TextDecoder(self._data, treeBlock, textIndex))
+        return self._strings
+
+    def parsed(self, key: str, parse: 'Callable[[Rom], T]') -> T:
+        '''Returns the data cached under `key`, calling `parse(self)` to load it the first time.
+
+        Editors should load the tables they show through here (or one of the
+        accessors above), so rebuilding an editor doesn't parse the ROM again.
+        '''
+        if key not in self._parsed:
+            self._parsed[key] = parse(self)
+        return self._parsed[key]
+
     # There is no internal human-readable name, so we forward this specific
     # value from RomInfo. All other known-good fields should be read using
     # `matchedInfo().whatever`
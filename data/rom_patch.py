@@ -0,0 +1,507 @@
+'''
+Creates and applies IPS, UPS, and BPS patches.
+
+Everything streams in fixed-size chunks, so memory use stays flat regardless
+of ROM size. When creating a patch, each chunk is compared in one shot (a big
+int XOR, then a regex for the non-zero bytes) rather than byte by byte. If the
+modified ROM was loaded from the vanilla file itself, only its dirty ranges
+can differ, so only those are compared.
+
+Format references:
+- IPS: https://zerosoft.zophar.net/ips.php
+- UPS: https://www.romhacking.net/documents/392/
+- BPS: https://www.romhacking.net/documents/746/
+'''
+
+from abc import ABC, abstractmethod
+from binascii import crc32
+from os import close, remove, replace
+from os.path import abspath, dirname, samefile
+from shutil import copyfile
+from tempfile import mkstemp
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Tuple, Type
+import re
+import struct
+
+from .rom_data import RomData
+from .rom_loader import Rom, ROM_INFO_MAP
+
+PATCH_FORMATS = ('ips', 'ups', 'bps')
+
+CHUNK_SIZE = 1 << 20
+'How many bytes are compared or copied at once.'
+
+IPS_MAX_OFFSET = 0xFFFFFF
+IPS_MAX_RECORD_SIZE = 0xFFFF
+IPS_EOF_OFFSET = 0x454F46
+'An offset of "EOF" would be read as the end of the patch.'
+IPS_MERGE_GAP = 5
+'''Records separated by this many unchanged bytes or fewer are merged.
+Copying the unchanged bytes is no bigger than starting a new record.'''
+
+_DIFF_PATTERN = re.compile(b'[^\x00]+')
+
+def createPatch(
+    rom: Rom,
+    vanillaPath: str,
+    patchPath: str,
+    format: str='bps',
+    validate: bool=True,
+) -> int:
+    '''Writes a patch that turns the ROM at `vanillaPath` into `rom`.
+
+    With `validate`, the vanilla ROM's CRC32 must match the known-good one in
+    `ROM_INFO_MAP`. Returns the number of bytes that differ.
+    '''
+    if format not in PATCH_FORMATS:
+        raise ValueError(f'Unknown patch format {repr(format)}. Expected one of {PATCH_FORMATS}')
+
+    target = rom.data()
+    with open(vanillaPath, 'rb') as sourceFile:
+        sourceCrc, sourceSize = _fileCrc32(sourceFile)
+        if validate:
+            info = ROM_INFO_MAP.get(rom.header().gameId())
+            if info is None or info.crc32 != hex(sourceCrc)[2:]:
+                raise ValueError(f'{vanillaPath} is not a known vanilla ROM for {rom.gameName()}')
+
+        # If we were loaded from the vanilla file, anything that differs must
+        # have been written since, so it'll be in a dirty range.
+        regions: Iterable[Tuple[int, int]]
+        if samefile(rom.filePath(), vanillaPath) and target.size() == sourceSize:
+            regions = target.dirtyRanges().pages(CHUNK_SIZE)
+        else:
+            regions = [(0, target.size())]
+
+        writers: Dict[str, Type[_PatchFileWriter]] = {'ips': _IpsWriter, 'ups': _UpsWriter, 'bps': _BpsWriter}
+        diffCount = 0
+        with open(patchPath, 'wb') as patchFile:
+            writer = writers[format](patchFile, target, sourceFile, sourceSize, sourceCrc)
+            for start, end in _diffSpans(target, sourceFile, sourceSize, regions):
+                writer.hunk(start, end)
+                diffCount += end - start
+            writer.finish()
+        return diffCount
+
+def applyPatch(patchPath: str, sourcePath: str, outputPath: str, validate: bool=True) -> None:
+    '''Applies the patch at `patchPath` to the ROM at `sourcePath`, writing the
+    result to `outputPath`. The format is detected from the patch header.
+
+    The output is written to a temporary file and renamed into place, so
+    `outputPath` is never left half-written (and can be the same as `sourcePath`).
+    With `validate`, UPS and BPS checksums are verified.
+    '''
+    tempFd, tempPath = mkstemp(dir=dirname(abspath(outputPath)), suffix='.tmp')
+    close(tempFd)
+    try:
+        with open(patchPath, 'rb') as patchFile:
+            magic = patchFile.read(5)
+            patchFile.seek(0)
+            if magic == b'PATCH':
+                _applyIps(patchFile, sourcePath, tempPath)
+            elif magic[:4] == b'UPS1':
+                _applyUps(_PatchReader(patchFile), sourcePath, tempPath, validate)
+            elif magic[:4] == b'BPS1':
+                _applyBps(_PatchReader(patchFile), sourcePath, tempPath, validate)
+            else:
+                raise ValueError(f'{patchPath} is not an IPS, UPS, or BPS patch')
+        replace(tempPath, outputPath)
+    except BaseException:
+        remove(tempPath)
+        raise
+
+def _fileCrc32(file: BinaryIO) -> Tuple[int, int]:
+    'Returns the CRC32 and size of `file`, reading it in chunks.'
+    file.seek(0)
+    checksum = 0
+    size = 0
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            return checksum, size
+        checksum = crc32(chunk, checksum)
+        size += len(chunk)
+
+def _diffSpans(
+    target: RomData,
+    sourceFile: BinaryIO,
+    sourceSize: int,
+    regions: Iterable[Tuple[int, int]],
+) -> Iterator[Tuple[int, int]]:
+    '''Yields `[start, end)` for each run of bytes that differ between `target`
+    and the source file, within `regions`. Bytes past the end of the source
+    are treated as 0. Bytes past the end of the target are ignored, since the
+    patched ROM gets truncated anyway.'''
+    pendingStart = pendingEnd = -1
+    for regionStart, regionEnd in regions:
+        regionEnd = min(regionEnd, target.size())
+        for chunkStart in range(regionStart, regionEnd, CHUNK_SIZE):
+            chunkSize = min(CHUNK_SIZE, regionEnd - chunkStart)
+            targetChunk = _readPadded(target, chunkStart, chunkSize)
+            sourceFile.seek(chunkStart)
+            sourceChunk = sourceFile.read(chunkSize).ljust(chunkSize, b'\0')
+            if targetChunk == sourceChunk:
+                continue
+
+            # XOR leaves 0 wherever the bytes match.
+            diff = (
+                int.from_bytes(targetChunk, 'little') ^ int.from_bytes(sourceChunk, 'little')
+            ).to_bytes(chunkSize, 'little')
+            for match in _DIFF_PATTERN.finditer(diff):
+                start, end = chunkStart + match.start(), chunkStart + match.end()
+                # Runs can continue across chunk boundaries.
+                if start == pendingEnd:
+                    pendingEnd = end
+                    continue
+                if pendingStart >= 0:
+                    yield pendingStart, pendingEnd
+                pendingStart, pendingEnd = start, end
+    if pendingStart >= 0:
+        yield pendingStart, pendingEnd
+
+def _readPadded(data: RomData, start: int, size: int) -> bytes:
+    'Reads `size` bytes from `data`, padding with 0 past the end.'
+    return data.getBytes(start, size).ljust(size, b'\0')
+
+def _encodeVarint(value: int) -> bytes:
+    'Encodes a number the way UPS and BPS do.'
+    encoded = bytearray()
+    while True:
+        part = value & 0x7F
+        value >>= 7
+        if value == 0:
+            encoded.append(0x80 | part)
+            return bytes(encoded)
+        encoded.append(part)
+        value -= 1
+
+class _PatchFileWriter(ABC):
+    'Writes to a patch file, keeping a running CRC32 of everything written.'
+    def __init__(
+        self,
+        patchFile: BinaryIO,
+        target: RomData,
+        sourceFile: BinaryIO,
+        sourceSize: int,
+        sourceCrc: int,
+    ):
+        self._patchFile = patchFile
+        self._target = target
+        self._sourceFile = sourceFile
+        self._sourceSize = sourceSize
+        self._sourceCrc = sourceCrc
+        self._patchCrc = 0
+
+    def _write(self, data: bytes) -> None:
+        self._patchFile.write(data)
+        self._patchCrc = crc32(data, self._patchCrc)
+
+    def _writeFooter(self) -> None:
+        'Writes the source, target, and patch CRC32s used by UPS and BPS.'
+        self._write(struct.pack('<II', self._sourceCrc, int(self._target.crc32(), 16)))
+        self._write(struct.pack('<I', self._patchCrc))
+
+    @abstractmethod
+    def hunk(self, start: int, end: int) -> None:
+        'Writes the bytes in `[start, end)` that differ from the source. Called in ascending order.'
+
+    @abstractmethod
+    def finish(self) -> None:
+        'Writes whatever is still pending, and the footer.'
+
+class _IpsWriter(_PatchFileWriter):
+    def __init__(self, *args):
+        super().__init__(*args)
+        if self._target.size() > IPS_MAX_OFFSET + 1:
+            raise ValueError('IPS patches cannot address more than 16 MiB')
+        self._write(b'PATCH')
+        self._pendingStart = self._pendingEnd = -1
+
+    def hunk(self, start: int, end: int) -> None:
+        if start - self._pendingEnd <= IPS_MERGE_GAP and self._pendingStart >= 0:
+            self._pendingEnd = end
+            return
+        self._flush()
+        self._pendingStart, self._pendingEnd = start, end
+
+    def _flush(self) -> None:
+        start, end = self._pendingStart, self._pendingEnd
+        if start < 0:
+            return
+        end = min(end, self._target.size())
+        while start < end:
+            if start == IPS_EOF_OFFSET:
+                start -= 1
+            size = min(end - start, IPS_MAX_RECORD_SIZE)
+            self._write(struct.pack('>I', start)[1:] + struct.pack('>H', size))
+            self._write(self._target.getBytes(start, size))
+            start += size
+        self._pendingStart = self._pendingEnd = -1
+
+    def finish(self) -> None:
+        targetSize = self._target.size()
+        # Patchers only grow the file as far as the last record. Make sure
+        # that's the very end of the ROM.
+        if targetSize > self._sourceSize and max(self._pendingEnd, self._sourceSize) < targetSize:
+            self.hunk(targetSize - 1, targetSize)
+        self._flush()
+        self._write(b'EOF')
+        if targetSize < self._sourceSize:
+            self._write(struct.pack('>I', targetSize)[1:])
+
+class _UpsWriter(_PatchFileWriter):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._write(
+            b'UPS1' + _encodeVarint(self._sourceSize) + _encodeVarint(self._target.size())
+        )
+        self._position = 0
+
+    def hunk(self, start: int, end: int) -> None:
+        # Hunks are XORed against the source, and end with a 0 byte that
+        # stands in for the (unchanged) byte right after them.
+        self._write(_encodeVarint(start - self._position))
+        targetBytes = _readPadded(self._target, start, end - start)
+        sourceBytes = self._readSource(start, end - start)
+        self._write((
+            int.from_bytes(targetBytes, 'little') ^ int.from_bytes(sourceBytes, 'little')
+        ).to_bytes(end - start, 'little') + b'\0')
+        self._position = end + 1
+
+    def _readSource(self, start: int, size: int) -> bytes:
+        self._sourceFile.seek(start)
+        return self._sourceFile.read(size).ljust(size, b'\0')
+
+    def finish(self) -> None:
+        self._writeFooter()
+
+class _BpsWriter(_PatchFileWriter):
+    SOURCE_READ = 0
+    TARGET_READ = 1
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._write(
+            b'BPS1' + _encodeVarint(self._sourceSize) + _encodeVarint(self._target.size()) +
+            _encodeVarint(0) # No metadata
+        )
+        self._position = 0
+
+    def _action(self, command: int, length: int) -> None:
+        self._write(_encodeVarint(((length - 1) << 2) | command))
+
+    def _copyUnchanged(self, end: int) -> None:
+        'Emits actions for the unchanged bytes from the current position to `end`.'
+        # Unchanged bytes past the end of the source are zeros we have to spell out.
+        sourceEnd = min(end, self._sourceSize)
+        if sourceEnd > self._position:
+            self._action(_BpsWriter.SOURCE_READ, sourceEnd - self._position)
+            self._position = sourceEnd
+        if end > self._position:
+            self._targetRead(self._position, end)
+
+    def _targetRead(self, start: int, end: int) -> None:
+        self._action(_BpsWriter.TARGET_READ, end - start)
+        for chunkStart in range(start, end, CHUNK_SIZE):
+            self._write(_readPadded(self._target, chunkStart, min(CHUNK_SIZE, end - chunkStart)))
+        self._position = end
+
+    def hunk(self, start: int, end: int) -> None:
+        end = min(end, self._target.size())
+        if end <= start:
+            return
+        self._copyUnchanged(start)
+        self._targetRead(start, end)
+
+    def finish(self) -> None:
+        self._copyUnchanged(self._target.size())
+        self._writeFooter()
+
+class _PatchReader:
+    'Buffered reads from a patch file, keeping a running CRC32 of everything read.'
+    def __init__(self, patchFile: BinaryIO):
+        self._patchFile = patchFile
+        self._buffer = b''
+        self._offset = 0
+        self.crc = 0
+        patchFile.seek(0, 2)
+        self.size = patchFile.tell()
+        patchFile.seek(0)
+        self.position = 0
+
+    def read(self, size: int) -> bytes:
+        parts: List[bytes] = []
+        while size > 0:
+            if self._offset == len(self._buffer):
+                self._buffer = self._patchFile.read(CHUNK_SIZE)
+                self._offset = 0
+                if not self._buffer:
+                    raise ValueError('Patch ended unexpectedly')
+            part = self._buffer[self._offset:self._offset + size]
+            self._offset += len(part)
+            size -= len(part)
+            parts.append(part)
+        data = b''.join(parts)
+        self.crc = crc32(data, self.crc)
+        self.position += len(data)
+        return data
+
+    def readUntilZero(self) -> bytes:
+        'Reads up to (and consumes, but does not return) the next 0 byte.'
+        parts: List[bytes] = []
+        while True:
+            if self._offset == len(self._buffer):
+                self._buffer = self._patchFile.read(CHUNK_SIZE)
+                self._offset = 0
+                if not self._buffer:
+                    raise ValueError('Patch ended unexpectedly')
+            zero = self._buffer.find(b'\0', self._offset)
+            end = len(self._buffer) if zero < 0 else zero + 1
+            part = self._buffer[self._offset:end]
+            self._offset = end
+            self.crc = crc32(part, self.crc)
+            self.position += len(part)
+            if zero >= 0:
+                parts.append(part[:-1])
+                return b''.join(parts)
+            parts.append(part)
+
+    def readVarint(self) -> int:
+        value = 0
+        shift = 1
+        while True:
+            part = self.read(1)[0]
+            value += (part & 0x7F) * shift
+            if part & 0x80:
+                return value
+            shift <<= 7
+            value += shift
+
+def _checkFooter(reader: _PatchReader, sourcePath: str, outputPath: str) -> None:
+    'Verifies the source, target, and patch CRC32s at the end of a UPS or BPS patch.'
+    sourceCrc, targetCrc = struct.unpack('<II', reader.read(8))
+    patchCrc = reader.crc
+    expectedPatchCrc = struct.unpack('<I', reader.read(4))[0]
+    with open(sourcePath, 'rb') as sourceFile:
+        if _fileCrc32(sourceFile)[0] != sourceCrc:
+            raise ValueError('Patch was made for a different source ROM')
+    with open(outputPath, 'rb') as outputFile:
+        if _fileCrc32(outputFile)[0] != targetCrc:
+            raise ValueError('Patched ROM does not match the expected checksum')
+    if patchCrc != expectedPatchCrc:
+        raise ValueError('Patch file is corrupt')
+
+def _applyIps(patchFile: BinaryIO, sourcePath: str, outputPath: str) -> None:
+    copyfile(sourcePath, outputPath)
+    patchFile.read(5)
+    with open(outputPath, 'r+b') as outputFile:
+        while True:
+            header = patchFile.read(3)
+            if header == b'EOF':
+                break
+            if len(header) < 3:
+                raise ValueError('Patch ended unexpectedly')
+            offset = int.from_bytes(header, 'big')
+            size = struct.unpack('>H', patchFile.read(2))[0]
+            if size == 0:
+                # Run-length encoded record.
+                runLength = struct.unpack('>H', patchFile.read(2))[0]
+                data = patchFile.read(1) * runLength
+            else:
+                data = patchFile.read(size)
+            outputFile.seek(offset)
+            outputFile.write(data)
+
+        # Optional truncation extension.
+        truncate = patchFile.read(3)
+        if len(truncate) == 3:
+            outputFile.truncate(int.from_bytes(truncate, 'big'))
+
+def _applyUps(reader: _PatchReader, sourcePath: str, outputPath: str, validate: bool) -> None:
+    reader.read(4)
+    reader.readVarint() # Source size. Checked via CRC instead.
+    targetSize = reader.readVarint()
+
+    copyfile(sourcePath, outputPath)
+    with open(outputPath, 'r+b') as outputFile:
+        outputFile.truncate(targetSize)
+        position = 0
+        while reader.position < reader.size - 12:
+            position += reader.readVarint()
+            xorBytes = reader.readUntilZero()
+            outputFile.seek(position)
+            current = outputFile.read(len(xorBytes)).ljust(len(xorBytes), b'\0')
+            outputFile.seek(position)
+            outputFile.write((
+                int.from_bytes(current, 'little') ^ int.from_bytes(xorBytes, 'little')
+            ).to_bytes(len(xorBytes), 'little'))
+            position += len(xorBytes) + 1
+        outputFile.truncate(targetSize)
+
+    if validate:
+        _checkFooter(reader, sourcePath, outputPath)
+
+def _applyBps(reader: _PatchReader, sourcePath: str, outputPath: str, validate: bool) -> None:
+    reader.read(4)
+    reader.readVarint() # Source size. Checked via CRC instead.
+    targetSize = reader.readVarint()
+    reader.read(reader.readVarint()) # Metadata. We don't use it.
+
+    with open(sourcePath, 'rb') as sourceFile, open(outputPath, 'w+b') as outputFile:
+        outputOffset = 0
+        sourceRelative = 0
+        targetRelative = 0
+        while reader.position < reader.size - 12:
+            action = reader.readVarint()
+            command = action & 3
+            length = (action >> 2) + 1
+            if outputOffset + length > targetSize:
+                raise ValueError('Patch writes past the end of the patched ROM')
+
+            if command == 0: # SourceRead
+                sourceFile.seek(outputOffset)
+                _copy(sourceFile, outputFile, length)
+            elif command == 1: # TargetRead
+                for chunkStart in range(0, length, CHUNK_SIZE):
+                    outputFile.write(reader.read(min(CHUNK_SIZE, length - chunkStart)))
+            elif command == 2: # SourceCopy
+                relative = reader.readVarint()
+                sourceRelative += -(relative >> 1) if relative & 1 else relative >> 1
+                if sourceRelative < 0:
+                    raise ValueError('Patch copies from before the start of the source ROM')
+                sourceFile.seek(sourceRelative)
+                _copy(sourceFile, outputFile, length)
+                sourceRelative += length
+            else: # TargetCopy
+                relative = reader.readVarint()
+                targetRelative += -(relative >> 1) if relative & 1 else relative >> 1
+                # Anything else would copy nothing, forever.
+                if not 0 <= targetRelative < outputOffset:
+                    raise ValueError('Patch copies from outside the patched ROM written so far')
+                # The copy can overlap what it's writing (e.g. a run of
+                # repeated bytes), so only copy what's already been written.
+                writeOffset = outputOffset
+                while writeOffset < outputOffset + length:
+                    size = min(outputOffset + length - writeOffset, writeOffset - targetRelative, CHUNK_SIZE)
+                    outputFile.seek(targetRelative)
+                    data = outputFile.read(size)
+                    outputFile.seek(writeOffset)
+                    outputFile.write(data)
+                    targetRelative += size
+                    writeOffset += size
+            outputOffset += length
+            outputFile.seek(outputOffset)
+
+        if outputOffset != targetSize:
+            raise ValueError('Patched ROM is the wrong size')
+
+    if validate:
+        _checkFooter(reader, sourcePath, outputPath)
+
+def _copy(fromFile: BinaryIO, toFile: BinaryIO, length: int) -> None:
+    'Copies `length` bytes between files, in chunks.'
+    while length > 0:
+        data = fromFile.read(min(length, CHUNK_SIZE))
+        if not data:
+            raise ValueError('Patch reads past the end of the source ROM')
+        toFile.write(data)
+        length -= len(data)
@@ -0,0 +1,155 @@
+'''
+Finds the addresses of known tables in a ROM by their shape, so we don't have
+to hard-code them for every game and region.
+
+Currently this finds the text anchors:
+- The `CharPointerPair`: two pointers, the second pointing at a table of
+  16-bit char tree offsets that ends right where the pair begins.
+- The Text Block Pointer Table: its first entry points at the text data
+  directly after the `CharPointerPair`.
+
+Candidates are found with a bulk search over the whole ROM (NumPy if it's
+installed, a regex otherwise), then checked in Python. Results are cached by
+CRC32, so each ROM is only scanned once per session.
+'''
+
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Tuple
+import re
+import struct
+
+from .rom_data import numpy, RomData
+from .rom_text import NO_CHAR_OFFSET, ROM_OFFSET
+from .text_decoder import CharDecodeTable
+
+MAX_CHAR_TABLE_SIZE = 0x1000 * 2
+'Characters are 12-bit, so the char offset table has at most 4096 entries.'
+
+@dataclass
+class TextAnchors:
+    'The addresses of the tables needed to read the game script.'
+    charPointerPair: Optional[int]
+    'Address of the `CharPointerPair`.'
+    textTable: Optional[int]
+    'Address of the Text Block Pointer Table.'
+
+    def found(self) -> bool:
+        'Returns whether both anchors were found.'
+        return self.charPointerPair is not None and self.textTable is not None
+
+SCAN_CHUNK_WORDS = 1 << 20
+'How many 32-bit words the NumPy scan looks at at once.'
+
+_anchorCache: Dict[str, TextAnchors] = {}
+
+def scanTextAnchors(romData: RomData, crc32: Optional[str]=None) -> TextAnchors:
+    '''Finds the `CharPointerPair` and Text Block Pointer Table in `romData`.
+
+    Results are cached by CRC32. Pass `crc32` if it's already known, to skip
+    hashing the ROM again.
+    '''
+    if crc32 is None:
+        crc32 = romData.crc32()
+
+    anchors = _anchorCache.get(crc32)
+    if anchors is None:
+        anchors = TextAnchors(None, None)
+        for pairAddress in findCharPointerPairs(romData):
+            textTable = findTextTable(romData, pairAddress)
+            # Keep looking if this pair has no text. Some other table might
+            # coincidentally look like a pair.
+            if anchors.charPointerPair is None or textTable is not None:
+                anchors = TextAnchors(pairAddress, textTable)
+            if textTable is not None:
+                break
+        _anchorCache[crc32] = anchors
+    return anchors
+
+def findCharPointerPairs(romData: RomData) -> Iterator[int]:
+    'Yields the address of everything in `romData` that looks like a `CharPointerPair`.'
+    for address, treeBlockPtr, offsetTablePtr in _pointerPairCandidates(romData):
+        if _isCharPointerPair(romData, address, treeBlockPtr, offsetTablePtr):
+            yield address
+
+def findTextTable(romData: RomData, pairAddress: int) -> Optional[int]:
+    '''Returns the address of the Text Block Pointer Table for the
+    `CharPointerPair` at `pairAddress`, or `None` if there isn't one.'''
+    firstTextPtr = pairAddress + 8 + ROM_OFFSET
+    romEnd = ROM_OFFSET + romData.size()
+    for address in romData.findAll(struct.pack('<I', firstTextPtr), alignment=4):
+        if address + 8 > romData.size():
+            continue
+        lengthPtr = romData.getInt32(address + 4)
+        if firstTextPtr < lengthPtr < romEnd:
+            return address
+    return None
+
+def _pointerPairCandidates(romData: RomData) -> Iterator[Tuple[int, int, int]]:
+    '''Yields `(address, first, second)` for every aligned pair of ROM pointers
+    whose second pointer lands a little way before the pair itself.
+
+    This is the cheap, bulk filter. Most of the ROM is ruled out here.
+    '''
+    size = romData.size() - romData.size() % 4
+    if size < 8:
+        return
+
+    if numpy is not None:
+        allWords = romData.getInt32Array(0, size // 4, asNumpy=True)
+        # Chunked (with one word of overlap) to keep the 64-bit temporaries small.
+        for chunkStart in range(0, len(allWords) - 1, SCAN_CHUNK_WORDS):
+            words = allWords[chunkStart:chunkStart + SCAN_CHUNK_WORDS + 1].astype(numpy.int64)
+            first, second = words[:-1], words[1:]
+            address = (numpy.arange(len(first), dtype=numpy.int64) + chunkStart) * 4 + ROM_OFFSET
+            tableSize = address - second
+            mask = (first >= ROM_OFFSET) & (first < second) & (second - first < NO_CHAR_OFFSET) \
+                & (tableSize > 0) & (tableSize <= MAX_CHAR_TABLE_SIZE) & (tableSize % 2 == 0)
+            for index in numpy.nonzero(mask)[0]:
+                yield (chunkStart + int(index)) * 4, int(first[index]), int(second[index])
+        return
+
+    # Without NumPy, pull out the high byte of every word (a cheap, strided
+    # copy) and let a regex find neighboring words that both look like ROM
+    # pointers (high byte 0x08, or 0x09 for 32 MiB ROMs).
+    words = romData.getInt32Array(0, size // 4)
+    highBytes = romData.getInt8Array(0, size)[3::4].tobytes()
+    pointerHighBytes = b'[' + re.escape(bytes(range(0x08, 0x08 + -(-size // 0x1000000)))) + b']'
+    pattern = re.compile(pointerHighBytes + b'(?=' + pointerHighBytes + b')')
+    for match in pattern.finditer(highBytes):
+        index = match.start()
+        first = words[index]
+        second = words[index + 1]
+        tableSize = index * 4 + ROM_OFFSET - second
+        if first < second and second - first < NO_CHAR_OFFSET \
+        and 0 < tableSize <= MAX_CHAR_TABLE_SIZE and tableSize % 2 == 0:
+            yield index * 4, first, second
+
+def _isCharPointerPair(romData: RomData, address: int, treeBlockPtr: int, offsetTablePtr: int) -> bool:
+    'Checks a candidate pair against everything we know about char tree data.'
+    treeBlockAddress = treeBlockPtr - ROM_OFFSET
+    offsetTableAddress = offsetTablePtr - ROM_OFFSET
+    treeBlockSize = offsetTableAddress - treeBlockAddress
+    offsets = romData.getInt16Array(offsetTableAddress, (address - offsetTableAddress) // 2)
+
+    # Every string starts from the null tree, so it has to exist.
+    if offsets[0] in (0x0, NO_CHAR_OFFSET):
+        return False
+
+    # Trees are stored in char order, followed by nothing but padding.
+    prevOffset = 0
+    inPadding = False
+    for offset in offsets:
+        if offset == 0x0:
+            inPadding = True
+        elif inPadding:
+            return False
+        elif offset != NO_CHAR_OFFSET:
+            if not prevOffset < offset < treeBlockSize:
+                return False
+            prevOffset = offset
+
+    # Finally, the null tree should actually parse as a tree.
+    try:
+        return len(CharDecodeTable.readTreeCodes(romData, treeBlockAddress + offsets[0])) > 0
+    except (ValueError, IndexError, struct.error):
+        return False
@@ -14,7 +14,7 @@ character has its own smaller tree. Whatever the last character read was, that
 character's tree is used to determine the next character in the string. Every
 string encoding starts from the "null tree", aka the tree for `\0`.
 
-Text data is made up of 4 parts, laid out in the following order:
+Text data is made up of 5 parts, laid out in the following order:
 1. Character Tree Block
 2. Character Offset Pointer Table
 3. Character Data Pointer Pair
@@ -39,7 +39,11 @@ NOTE: Each character in this lookup table is encoded using 12 bits!
 If a character never appears in the game's script (such as "^"), it will not
 have any data at all in this block.
 
-TODO how do we know when we've reached a leaf in the tree?
+The tree itself is stored as a pre-order bitstream, least significant bit
+first. A 0 bit is a branch and a 1 bit is a leaf. While decoding, a 0 bit of
+text data takes the left branch and a 1 bit takes the right one. When we hit
+the Nth leaf (counting left to right), the next character is entry N in the
+lookup table. See `text_decoder.py`.
 
 Characters in this block are in order corresponding to their numeric code.
 For English, this is ASCII order.
@@ -90,24 +94,26 @@ TODO what points at this address pair?
 The compressed text data starts at the address immediately following the
 main char pointer pair.
 
-TODO haven't gotten here yet, need to actually decode something successfully first.
-TODO discuss blocks
-    - block of text data
-    - length table for text data
+Strings are grouped into blocks of 256. Each block is made up of the
+compressed strings themselves, one after the other, and a length table.
+Every string starts on a byte boundary and is terminated by a `\0` char.
+The length table holds the length of each string in the block, in bytes.
+Lengths are stored one byte at a time: a 0xFF means "add 255 and keep reading".
 
 5. Text Block Pointer Table
 
-TODO haven't gotten here yet. Describe this better.
-block of 2 pointer structs.
-both pointers are 32 bit.
-first pointer to start of block's text
-second pointer to start of length table
+A table of 2-pointer structs, one per block of text. Both pointers are 32 bit.
+The first points at the start of the block's text.
+The second points at the start of the block's length table.
+See `text_index.py`.
+
 TODO what points at this?
 
 
 The 500 IQ sage who came up with this one must have been doing coke with Jesus.
 '''
 
+from array import array
 from itertools import filterfalse
 from math import ceil
 from typing import Iterator, List
@@ -116,7 +122,8 @@ from typing import Iterator, List
 from more_itertools import pairwise
 
 
-from rom_data import RomData
+from .rom_data import numpy, RomData
+from .tracing import span
 
 # Some discussion on memory positions for text reading
 #https://discord.com/channels/243488870962823200/332622755419652096/1093661000550592593
@@ -132,11 +139,19 @@ ROM_OFFSET = 0x08_00_00_00
 NO_CHAR_OFFSET = 0x8000
 'Dummy offset used when a character has no tree.'
 
+LOOKUP_CHUNK_SIZE = 3 * 64
+'How many bytes of a char lookup table to read at once. Holds 128 chars.'
+
+# TODO these need updated to support other languages.
+MIN_VALID_CHAR = 0x01
+'Lowest char code that is a valid character. See `CharTree.isValidChar`.'
+MAX_VALID_CHAR = 0x7D
+'Highest char code that is a valid character. See `CharTree.isValidChar`.'
+
 class CharPointerPair:
     'Accessor over `RomData` for a character data pointer pair.'
 
-    # TODO it would be nice to have a better detection mechanism for this address
-    # rather than just hard-coding it for each game. A signature or something.
+    # NOTE: See rom_scanner.py for finding this address in a given ROM.
     def __init__(self, romData: RomData, address: int):
         self._address = address
         self._romData = romData
@@ -169,12 +184,11 @@ class CharTree:
     @staticmethod
     def isValidChar(char: int) -> bool:
         'Returns whether or not the given char code corresponds to a valid character.'
-        # TODO this needs updated to support other languages.
-        return 0x00 < char < 0x7E
+        return MIN_VALID_CHAR <= char <= MAX_VALID_CHAR
 
     def __init__(self, char: str, offset: int):
         self._char = char
-        self._lookupTable: 'List[str]|None' = None
+        self._lookupTable: 'array[int]|None' = None
         self._treeData: 'RomData|None' = None
 
         # I don't love storing this value since it directly depends on the
@@ -182,6 +196,14 @@ class CharTree:
         # in CharTreeBlock.
         self._offset = offset
 
+    def char(self) -> str:
+        'Returns the character this tree decodes the next character for.'
+        return self._char
+
+    def offset(self) -> int:
+        'Returns the offset of this tree from the start of the tree block.'
+        return self._offset
+
     def empty(self) -> bool:
         'Returns whether or not this is an empty tree (i.e. no character data).'
         return self._lookupTable is None and self._treeData is None
@@ -189,31 +211,62 @@ class CharTree:
     def loadLookupTable(self, romData: RomData, startAddress: int):
         '''Reads characters from `romData` starting at `startAddress`
         into the char lookup table.'''
-        self._lookupTable = []
+        self._lookupTable = array('H')
 
         # startAddress is the start of the TREE data.
         # The previous byte is the start of the lookup table.
-        for addr in range(startAddress - 1, 0, -3):
-            # Remember, these are 12-bit chars and this table is reversed.
-            partA = romData.getInt8(addr - 0)
-            partB = romData.getInt8(addr - 1)
-            partC = romData.getInt8(addr - 2)
-
-            char1 = (partA << 4) | (partB >> 4)
-            char2 = ((partB & 0xF) << 8) | partC
+        # We don't know how long the table is, so read it in chunks until one
+        # of them contains the end.
+        chunkEnd = startAddress
+        while chunkEnd >= 3:
+            chunkStart = max(chunkEnd - LOOKUP_CHUNK_SIZE, chunkEnd % 3)
+            # Remember, this table is reversed.
+            packed = romData.getBytes(chunkStart, chunkEnd - chunkStart)[::-1]
+            chars = CharTree.unpackChars(packed)
 
             # There may be a smarter way to figure out the length of the
             # lookup table, but we're just going to read characters until we
             # see garbage, then assume that's the end.
-            if CharTree.isValidChar(char1):
-                self._lookupTable.append(chr(char1))
-            else:
+            end = CharTree.firstInvalidChar(chars)
+            self._lookupTable.extend(chars[:end])
+            if end < len(chars):
                 break
+            chunkEnd = chunkStart
 
-            if CharTree.isValidChar(char2):
-                self._lookupTable.append(chr(char2))
-            else:
-                break
+    @staticmethod
+    def unpackChars(packed: bytes) -> 'array[int]':
+        '''Unpacks pairs of 12-bit chars from every 3 bytes of `packed`.
+        Bytes `[A, B, C]` hold chars `ABC` as `[AB][BC]`, one nibble each.'''
+        chars = array('H', bytes(len(packed) // 3 * 4))
+        if numpy is not None:
+            parts = numpy.frombuffer(packed, dtype=numpy.uint8).reshape(-1, 3).astype(numpy.uint16)
+            unpacked = numpy.frombuffer(chars, dtype=numpy.uint16)
+            unpacked[0::2] = (parts[:, 0] << 4) | (parts[:, 1] >> 4)
+            unpacked[1::2] = ((parts[:, 1] & 0xF) << 8) | parts[:, 2]
+        else:
+            partsA, partsB, partsC = packed[0::3], packed[1::3], packed[2::3]
+            chars[0::2] = array('H', [(a << 4) | (b >> 4) for a, b in zip(partsA, partsB)])
+            chars[1::2] = array('H', [((b & 0xF) << 8) | c for b, c in zip(partsB, partsC)])
+        return chars
+
+    @staticmethod
+    def firstInvalidChar(chars: 'array[int]') -> int:
+        '''Returns the index of the first char in `chars` that isn't
+        `isValidChar`, or `len(chars)` if they're all valid.'''
+        if numpy is not None:
+            values = numpy.frombuffer(chars, dtype=numpy.uint16)
+            invalid = numpy.flatnonzero((values < MIN_VALID_CHAR) | (values > MAX_VALID_CHAR))
+            return int(invalid[0]) if len(invalid) else len(chars)
+        return next(
+            (index for index, char in enumerate(chars) if not CharTree.isValidChar(char)),
+            len(chars),
+        )
+
+    def lookupTable(self) -> 'array[int]':
+        'Returns the char codes in the lookup table, in leaf order.'
+        if self._lookupTable is None:
+            raise Exception('Char lookup table not loaded yet!')
+        return self._lookupTable
 
     def loadTreeData(self, romData: RomData, startAddress: int, endAddress: int):
         'Reads the `romData` from `startAddress` to `endAddress` as a tree.'
@@ -236,16 +289,19 @@ class CharTree:
         return len(self._treeData)
 
     def __str__(self) -> str:
-        return f'{CharTree.__name__}({repr(self._char)}, {self._lookupTable})'
+        lookupTable = None if self._lookupTable is None else list(map(chr, self._lookupTable))
+        return f'{CharTree.__name__}({repr(self._char)}, {lookupTable})'
 
 class CharTreeBlock:
     'An accessor over `RomData` for reading Huffman character tree blocks.'
     def __init__(self, romData: RomData, charPtrs: CharPointerPair):
         self._romData = romData
+        self._charPtrs = charPtrs
         self._charTrees: List[CharTree] = []
 
-        self._loadCharLookupTables(charPtrs)
-        self._loadCharTrees(charPtrs)
+        with span('text.charTreeBlock'):
+            self._loadCharLookupTables(charPtrs)
+            self._loadCharTrees(charPtrs)
 
     def _loadCharLookupTables(self, charPtrs: CharPointerPair):
         'Reads in character lookup tables for each char in the offset table.'
@@ -254,9 +310,11 @@ class CharTreeBlock:
         lookupEndAddress = charPtrs.getPairAddress()
 
         # Iterate through the table of 16-bit address offsets for each char.
-        for charCode, ptrOffsetAddress in enumerate(range(lookupStartAddress, lookupEndAddress, 2)):
-            offset = self._romData.getInt16(ptrOffsetAddress)
-
+        offsets = self._romData.getInt16Array(
+            lookupStartAddress,
+            (lookupEndAddress - lookupStartAddress) // 2,
+        )
+        for charCode, offset in enumerate(offsets):
             if offset == 0x0:
                 # Load complete, we've reached the end-of-table padding.
                 return
@@ -295,6 +353,10 @@ class CharTreeBlock:
             endAddress=(charPtrs.getLookupTableAddress() - 1),
         )
 
+    def pointerPair(self) -> CharPointerPair:
+        'Returns the pointer pair this tree block was loaded from.'
+        return self._charPtrs
+
     def __getitem__(self, key: 'str|int') -> CharTree:
         if isinstance(key, str):
             if len(key) > 1:
@@ -313,11 +375,17 @@ class CharTreeBlock:
 
 
 # Local test. Load a rom file and get strings out of it.
+# Run from the project root with `python -m data.rom_text <rom file>`
 if __name__ == '__main__':
     from sys import argv, exit
 
+    from .rom_scanner import scanTextAnchors
+
     data = RomData.fromFile(argv[1])
-    pair = CharPointerPair(data, 0x3842c)
+    pairAddress = scanTextAnchors(data).charPointerPair
+    if pairAddress is None:
+        exit('No character pointer pair found in ROM')
+    pair = CharPointerPair(data, pairAddress)
     print(pair)
     trees = CharTreeBlock(data, pair)
     print('TREE BLOCK START', hex(pair.getTreeBlockAddress()))
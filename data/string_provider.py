@@ -0,0 +1,135 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterator
+
+from .text_decoder import TextDecoder
+
+DEFAULT_CACHE_SIZE = 1024
+'How many decoded strings a `StringProvider` holds on to by default.'
+
+@dataclass
+class CacheStats:
+    'A snapshot of how well a `StringProvider` cache is doing.'
+    hits: int
+    'Lookups answered from the cache.'
+    misses: int
+    'Lookups that had to decode the string.'
+    size: int
+    'Number of strings currently cached.'
+    maxSize: int
+    'Maximum number of strings the cache will hold.'
+
+    def hitRate(self) -> float:
+        'Returns the fraction of lookups answered from the cache.'
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class StringProvider:
+    '''Lazily decodes game strings by ID, keeping the most recently used ones
+    in a bounded LRU cache.
+
+    Views should pull strings through this rather than decoding the whole
+    script up front, so memory stays flat no matter how many strings a game
+    has. Strings changed with `setString` are kept separately and are never
+    evicted, since the ROM data doesn't have them yet.
+    '''
+
+    def __init__(self, decoder: TextDecoder, cacheSize: int=DEFAULT_CACHE_SIZE):
+        if cacheSize < 1:
+            raise ValueError(f'Cache size must be positive, got {cacheSize}')
+        self._decoder = decoder
+        self._cacheSize = cacheSize
+        self._cache: 'OrderedDict[int, str]' = OrderedDict()
+        self._edited: Dict[int, str] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self) -> int:
+        return self._decoder.stringCount()
+
+    def __getitem__(self, id: int) -> str:
+        if not 0 <= id < len(self):
+            raise IndexError(f'String ID {id} out of range')
+
+        edited = self._edited.get(id)
+        if edited is not None:
+            return edited
+
+        cache = self._cache
+        string = cache.get(id)
+        if string is not None:
+            self._hits += 1
+            cache.move_to_end(id)
+            return string
+
+        self._misses += 1
+        string = self._decoder.decodeString(id)
+        cache[id] = string
+        if len(cache) > self._cacheSize:
+            cache.popitem(last=False)
+        return string
+
+    def __iter__(self) -> Iterator[str]:
+        '''Iterates over every string in ID order.
+
+        NOTE: This bypasses the cache so a full pass doesn't evict everything.
+        '''
+        for id in range(len(self)):
+            edited = self._edited.get(id)
+            yield edited if edited is not None else self._decoder.decodeString(id)
+
+    def decoder(self) -> TextDecoder:
+        'Returns the decoder strings are pulled through.'
+        return self._decoder
+
+    def setDecoder(self, decoder: TextDecoder) -> None:
+        '''Pulls strings through `decoder` from now on, e.g. after the script
+        was rewritten in the ROM. Drops every cached string, but keeps edits.'''
+        self._decoder = decoder
+        self._cache.clear()
+
+    def setString(self, id: int, text: str) -> None:
+        'Replaces the string with the given ID. Does not touch ROM data.'
+        if not 0 <= id < len(self):
+            raise IndexError(f'String ID {id} out of range')
+        self._edited[id] = text
+        self._cache.pop(id, None)
+
+    def revertString(self, id: int) -> None:
+        'Forgets the edit to the string with the given ID, so it reads from the ROM again.'
+        self._edited.pop(id, None)
+
+    def editedStrings(self) -> Dict[int, str]:
+        'Returns all strings changed with `setString`, keyed by ID.'
+        return dict(self._edited)
+
+    def isEdited(self, id: int) -> bool:
+        'Returns whether the string with the given ID was changed with `setString`.'
+        return id in self._edited
+
+    def clearEdits(self) -> None:
+        'Forgets all changed strings, e.g. after they have been written to the ROM.'
+        self._edited.clear()
+
+    def setCacheSize(self, cacheSize: int) -> None:
+        'Changes the maximum number of cached strings, evicting old ones if needed.'
+        if cacheSize < 1:
+            raise ValueError(f'Cache size must be positive, got {cacheSize}')
+        self._cacheSize = cacheSize
+        while len(self._cache) > cacheSize:
+            self._cache.popitem(last=False)
+
+    def clearCache(self) -> None:
+        'Drops all cached strings and resets the hit/miss counters.'
+        self._cache.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def cacheStats(self) -> CacheStats:
+        'Returns the current hit/miss statistics for the cache.'
+        return CacheStats(
+            hits=self._hits,
+            misses=self._misses,
+            size=len(self._cache),
+            maxSize=self._cacheSize,
+        )
@@ -0,0 +1,175 @@
+'''
+Decodes compressed game strings using the character trees in a `CharTreeBlock`.
+
+Walking a Huffman tree one bit at a time is slow in Python, so each
+character's tree is flattened into a lookup table up front. A table is indexed
+by the next `LOOKUP_BITS` bits of text data and gives back both the decoded
+character and how many bits its code actually used, so most characters take a
+single step to decode. Codes longer than `LOOKUP_BITS` fall through to a small
+second-level table for their prefix.
+
+See `rom_text.py` for a description of the compression scheme itself.
+'''
+
+from typing import Dict, List, Tuple
+
+from .rom_data import RomData
+from .rom_text import CharTreeBlock
+from .text_index import TextIndex
+from .tracing import span
+
+LOOKUP_BITS = 8
+'How many bits of text data the first-level lookup tables are indexed by.'
+
+MAX_CODE_LENGTH = 24
+'Trees deeper than this are assumed to be garbage (e.g. a bad pointer).'
+
+MAX_STRING_CHARS = 0x10000
+'Decoding gives up on strings longer than this.'
+
+CHAR_BITS = 12
+'Characters in the tree lookup tables are encoded using 12 bits.'
+
+# Table entries are packed ints. A non-negative entry is
+# `(char << LENGTH_BITS) | codeLength`. A negative entry `~n` means the code is
+# longer than the table is wide, and `n` indexes the tree's sub-tables.
+LENGTH_BITS = 8
+LENGTH_MASK = (1 << LENGTH_BITS) - 1
+
+class CharDecodeTable:
+    '''A flattened, multi-bit lookup table for a single character tree.
+
+    NOTE: Not an accessor over `RomData`. Everything is read in up front.
+    '''
+
+    @staticmethod
+    def readTreeCodes(romData: RomData, treeAddress: int) -> List[Tuple[int, int, int]]:
+        '''Walks the tree at `treeAddress` and returns `(char, code, length)`
+        for each of its leaves, in leaf order.
+
+        The tree is stored as a pre-order bitstream (LSB first). A `0` bit is a
+        branch and a `1` bit is a leaf. When decoding, a `0` bit of text data
+        takes the left branch and a `1` bit takes the right one. Leaf `n`'s
+        character is the `n`th 12-bit entry of the (reversed) char lookup table
+        that sits directly before the tree.
+        '''
+        treeBitAddress = treeAddress * 8
+        bitAddress = treeBitAddress
+        leaves: List[Tuple[int, int, int]] = []
+
+        # Codes are built LSB first, matching the order text bits are read in.
+        stack = [(0, 0)]
+        while stack:
+            code, length = stack.pop()
+            if length > MAX_CODE_LENGTH:
+                raise ValueError(f'Char tree at {hex(treeAddress)} is too deep')
+
+            isLeaf = (romData.getInt8(bitAddress >> 3) >> (bitAddress & 7)) & 1
+            bitAddress += 1
+
+            if isLeaf:
+                charBitAddress = treeBitAddress - CHAR_BITS * (len(leaves) + 1)
+                char = (romData.getInt16(charBitAddress >> 3) >> (charBitAddress & 7)) & 0xFFF
+                leaves.append((char, code, length))
+            else:
+                # Pushed in reverse so the left branch is read first.
+                stack.append((code | (1 << length), length + 1))
+                stack.append((code, length + 1))
+
+        return leaves
+
+    def __init__(self, leaves: List[Tuple[int, int, int]]):
+        maxLength = max(length for _, _, length in leaves)
+        self.width = min(maxLength, LOOKUP_BITS)
+        self.mask = (1 << self.width) - 1
+        self.entries = [0] * (1 << self.width)
+        self.subTables: List[Tuple[int, List[int]]] = []
+
+        longCodes: Dict[int, List[Tuple[int, int, int]]] = {}
+        for char, code, length in leaves:
+            if length <= self.width:
+                self._fill(self.entries, code, length, length, char)
+            else:
+                longCodes.setdefault(code & self.mask, []).append((char, code, length))
+
+        for prefix, subLeaves in longCodes.items():
+            subWidth = max(length for _, _, length in subLeaves) - self.width
+            subEntries = [0] * (1 << subWidth)
+            for char, code, length in subLeaves:
+                self._fill(subEntries, code >> self.width, length - self.width, length, char)
+            self.entries[prefix] = ~len(self.subTables)
+            self.subTables.append(((1 << subWidth) - 1, subEntries))
+
+    def _fill(self, entries: List[int], code: int, codeLength: int, totalLength: int, char: int):
+        'Points every table index that starts with `code` at `char`.'
+        entry = (char << LENGTH_BITS) | totalLength
+        for high in range(0, len(entries), 1 << codeLength):
+            entries[high | code] = entry
+
+class TextDecoder:
+    '''Decodes strings from the game's compressed text data.
+
+    Strings are addressed by ID and found through a `TextIndex`.
+    '''
+
+    def __init__(self, romData: RomData, treeBlock: CharTreeBlock, textIndex: TextIndex):
+        self._romData = romData
+        self._textIndex = textIndex
+        self._tables: Dict[int, CharDecodeTable] = {}
+
+        treeBlockAddress = treeBlock.pointerPair().getTreeBlockAddress()
+        for tree in treeBlock:
+            if tree.empty():
+                continue
+            leaves = CharDecodeTable.readTreeCodes(romData, treeBlockAddress + tree.offset())
+            self._tables[ord(tree.char())] = CharDecodeTable(leaves)
+
+    def textIndex(self) -> TextIndex:
+        'Returns the index used to find strings.'
+        return self._textIndex
+
+    def stringCount(self) -> int:
+        'Returns the number of strings in the game.'
+        return len(self._textIndex)
+
+    def decodeString(self, id: int) -> str:
+        'Decodes the string with the given ID.'
+        with span('text.decodeString'):
+            bitAddress, length = self._textIndex.locate(id)
+            return self.decodeAt(bitAddress, length)
+
+    def decodeAt(self, bitAddress: int, length: int) -> str:
+        '''Decodes a single string from `length` bytes of text data
+        starting at `bitAddress`.'''
+        address = bitAddress >> 3
+        # Treating the whole string as one big little-endian int gives us
+        # the bits in exactly the order the game reads them.
+        bits = int.from_bytes(self._romData.getBytes(address, length), 'little') \
+            >> (bitAddress & 7)
+        bitLength = length * 8 - (bitAddress & 7)
+        tables = self._tables
+
+        chars: List[str] = []
+        pos = 0
+        char = 0 # Every string starts from the "null tree".
+        # Bounded so corrupt data can't spin forever on zero-length codes.
+        for _ in range(MAX_STRING_CHARS):
+            table = tables.get(char)
+            if table is None:
+                raise ValueError(f'No tree for char {hex(char)} in string at {hex(address)}')
+
+            entry = table.entries[(bits >> pos) & table.mask]
+            if entry < 0:
+                subMask, subEntries = table.subTables[~entry]
+                entry = subEntries[(bits >> (pos + table.width)) & subMask]
+
+            pos += entry & LENGTH_MASK
+            if pos > bitLength:
+                raise ValueError(f'String at {hex(address)} overran its length')
+
+            char = entry >> LENGTH_BITS
+            if char == 0:
+                return ''.join(chars)
+            chars.append(chr(char))
+
+        raise ValueError(f'String at {hex(address)} never terminated')
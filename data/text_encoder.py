@@ -0,0 +1,367 @@
+'''
+Compresses game strings and writes them back into the ROM.
+
+This is the inverse of `text_decoder.py`. See `rom_text.py` for a description
+of the compression scheme itself.
+
+There are two ways strings get written:
+
+- Incremental: If the existing char trees already have a code for every
+  character pair in the edited strings, only the blocks containing edited
+  strings are touched. Unedited strings in those blocks are copied as-is,
+  since their compressed bits are still valid. If a block grows past the space
+  it had, the blocks after it are shifted down (again, copied, not recompressed).
+- Full: Otherwise, new char trees are built from the character pair
+  frequencies of the whole script, and every string is recompressed.
+
+NOTE: Nothing is ever relocated. The new data must fit in the space the
+original data used, or a `ValueError` is raised before anything is written.
+'''
+
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from heapq import heapify, heappop, heappush
+from itertools import count
+from math import ceil
+from typing import Any, Dict, Iterable, List, Tuple
+
+from .rom_data import RomData
+from .rom_text import CharTreeBlock, NO_CHAR_OFFSET, ROM_OFFSET
+from .text_decoder import CHAR_BITS, CharDecodeTable, MAX_CODE_LENGTH, TextDecoder
+from .text_index import TEXT_BLOCK_ENTRY_SIZE, TextIndex
+
+MAX_CHAR = 0xFFF
+'Characters are encoded using 12 bits, so this is the largest one we can store.'
+
+Codes = Dict[int, Dict[int, Tuple[int, int]]]
+'''Maps the previous char to the `(code, length)` for each next char.
+Codes are stored LSB first, in the order the game reads them.'''
+
+@dataclass
+class EncodedCharTree:
+    'A single character tree, ready to be written to the Character Tree Block.'
+    char: int
+    'The char whose tree this is (i.e. the previous char when decoding).'
+    leaves: List[int] = field(default_factory=list)
+    'Leaf chars, in leaf order. This becomes the char lookup table.'
+    treeBits: int = 0
+    'The pre-order tree bitstream, LSB first.'
+    treeBitLength: int = 0
+    'Number of bits in `treeBits`.'
+    codes: Dict[int, Tuple[int, int]] = field(default_factory=dict)
+    '`(code, length)` for each leaf char.'
+
+    def lookupBytes(self) -> bytes:
+        '''Returns the (reversed) char lookup table. Leaf `n` is stored
+        `12 * (n + 1)` bits before the end.'''
+        size = self.sizeLookup()
+        packed = 0
+        for leafIndex, leafChar in enumerate(self.leaves):
+            packed |= leafChar << (size * 8 - CHAR_BITS * (leafIndex + 1))
+        return packed.to_bytes(size, 'little')
+
+    def treeBytes(self) -> bytes:
+        'Returns the tree bitstream, padded to a whole byte.'
+        return self.treeBits.to_bytes(self.sizeTree(), 'little')
+
+    def sizeLookup(self) -> int:
+        'Returns the size of the char lookup table, in bytes.'
+        return ceil(len(self.leaves) * CHAR_BITS / 8)
+
+    def sizeTree(self) -> int:
+        'Returns the size of the tree data, in bytes.'
+        return ceil(self.treeBitLength / 8)
+
+def buildCharTrees(strings: Iterable[str]) -> Dict[int, EncodedCharTree]:
+    '''Builds a Huffman tree for each char from the frequency of each char
+    following it in `strings`. Strings are implicitly `\\0` terminated.'''
+    pairCounts: Dict[int, Dict[int, int]] = {}
+    for string in strings:
+        prevChar = 0
+        for char in _charCodes(string):
+            nextCounts = pairCounts.setdefault(prevChar, {})
+            nextCounts[char] = nextCounts.get(char, 0) + 1
+            prevChar = char
+
+    return {
+        char: _buildCharTree(char, nextCounts)
+        for char, nextCounts in sorted(pairCounts.items())
+    }
+
+def _buildCharTree(char: int, nextCounts: Dict[int, int]) -> EncodedCharTree:
+    # Leaves are ints, branches are (left, right) tuples. The counter
+    # breaks ties so trees are deterministic, and so nodes are never compared.
+    tiebreak = count()
+    heap: List[Tuple[int, int, Any]] = [
+        (freq, next(tiebreak), nextChar) for nextChar, freq in sorted(nextCounts.items())
+    ]
+    heapify(heap)
+    while len(heap) > 1:
+        leftFreq, _, left = heappop(heap)
+        rightFreq, _, right = heappop(heap)
+        heappush(heap, (leftFreq + rightFreq, next(tiebreak), (left, right)))
+
+    tree = EncodedCharTree(char)
+    stack: List[Tuple[Any, int, int]] = [(heap[0][2], 0, 0)]
+    while stack:
+        node, code, length = stack.pop()
+        if length > MAX_CODE_LENGTH:
+            raise ValueError(f'Tree for char {hex(char)} is too deep to encode')
+
+        if isinstance(node, int):
+            tree.treeBits |= 1 << tree.treeBitLength
+            tree.codes[node] = (code, length)
+            tree.leaves.append(node)
+        else:
+            # Pushed in reverse so the left branch is written first.
+            stack.append((node[1], code | (1 << length), length + 1))
+            stack.append((node[0], code, length + 1))
+        tree.treeBitLength += 1
+
+    return tree
+
+def encodeString(string: str, codes: Codes) -> bytes:
+    'Compresses a single string (and its `\\0` terminator) with the given codes.'
+    packed = 0
+    bitLength = 0
+    prevChar = 0
+    for char in _charCodes(string):
+        try:
+            code, length = codes[prevChar][char]
+        except KeyError:
+            raise ValueError(f'No code for {hex(char)} after {hex(prevChar)}') from None
+        packed |= code << bitLength
+        bitLength += length
+        prevChar = char
+    return packed.to_bytes(ceil(bitLength / 8), 'little')
+
+def encodeLengths(lengths: Iterable[int]) -> bytes:
+    '''Builds a block's length table. Lengths are stored one byte at a time,
+    where 0xFF means "add 255 and keep reading".'''
+    table = bytearray()
+    for length in lengths:
+        while length >= 0xFF:
+            table.append(0xFF)
+            length -= 0xFF
+        table.append(length)
+    return bytes(table)
+
+def _charCodes(string: str) -> List[int]:
+    'Returns the char codes of `string`, plus the terminating `\\0`.'
+    chars = [ord(char) for char in string]
+    if any(char == 0 or char > MAX_CHAR for char in chars):
+        raise ValueError(f'String contains characters that cannot be encoded: {repr(string)}')
+    chars.append(0)
+    return chars
+
+class TextEncoder:
+    '''Writes edited strings back into the ROM's compressed text data.
+
+    After writing, the `CharTreeBlock`, `TextIndex`, and anything decoding
+    through them are stale and need to be reloaded.
+    '''
+
+    def __init__(self, romData: RomData, treeBlock: CharTreeBlock, textIndex: TextIndex):
+        self._romData = romData
+        self._treeBlock = treeBlock
+        self._textIndex = textIndex
+        self._decoder = TextDecoder(romData, treeBlock, textIndex)
+
+        # Invert the existing trees so we can encode with them.
+        self._codes: Codes = {}
+        treeBlockAddress = treeBlock.pointerPair().getTreeBlockAddress()
+        for tree in treeBlock:
+            if tree.empty():
+                continue
+            leaves = CharDecodeTable.readTreeCodes(romData, treeBlockAddress + tree.offset())
+            self._codes[ord(tree.char())] = {
+                char: (code, length) for char, code, length in leaves
+            }
+
+    def canEncodeIncrementally(self, strings: Iterable[str]) -> bool:
+        'Returns whether the existing char trees can encode all of `strings`.'
+        for string in strings:
+            prevChar = 0
+            for char in _charCodes(string):
+                if char not in self._codes.get(prevChar, ()):
+                    return False
+                prevChar = char
+        return True
+
+    def writeStrings(self, edits: Dict[int, str], incremental: bool=True) -> List[int]:
+        '''Writes the edited strings (keyed by ID) to the ROM.
+
+        Uses the incremental path when `incremental` is set and the existing
+        trees can encode every edit. Returns the blocks that were rewritten.
+
+        If the data has a journal, all of the writes are a single entry, so
+        they are undone together.
+        '''
+        for id in edits:
+            if not 0 <= id < len(self._textIndex):
+                raise IndexError(f'String ID {id} out of range')
+        if not edits:
+            return []
+
+        journal = self._romData.journal()
+        with journal.transaction() if journal is not None else nullcontext():
+            if incremental and self.canEncodeIncrementally(edits.values()):
+                return self._writeIncremental(edits)
+            return self._writeFull(edits)
+
+    def _writeIncremental(self, edits: Dict[int, str]) -> List[int]:
+        index = self._textIndex
+        dirtyBlocks = sorted({index.blockOf(id) for id in edits})
+        payloads = {block: self._encodeBlock(block, edits, self._codes) for block in dirtyBlocks}
+
+        # Blocks that still fit in their old space are rewritten in place.
+        # Once one doesn't fit, everything after it gets shifted down.
+        inPlace: List[int] = []
+        written: List[int] = []
+        for block in dirtyBlocks:
+            text, lengths = payloads[block]
+            start, end = self._blockFootprint(block)
+            if len(text) + len(lengths) > end - start:
+                written = self._layoutBlocks(block, payloads)
+                break
+            inPlace.append(block)
+
+        # This happens after any layout, since laying out copies unedited
+        # blocks using their old locations.
+        for block in inPlace:
+            if block in written:
+                continue
+            text, lengths = payloads[block]
+            start = index.blockAddresses(block)[0]
+            self._romData.setBytes(start, text)
+            self._romData.setBytes(start + len(text), lengths)
+            self._setBlockPointers(block, start, start + len(text))
+            written.append(block)
+
+        return sorted(written)
+
+    def _writeFull(self, edits: Dict[int, str]) -> List[int]:
+        strings = [
+            edits[id] if id in edits else self._decoder.decodeString(id)
+            for id in range(len(self._textIndex))
+        ]
+        trees = buildCharTrees(strings)
+        treeBytes, offsets = self._packCharTrees(trees)
+
+        codes: Codes = {char: tree.codes for char, tree in trees.items()}
+        allEdits = dict(enumerate(strings))
+        payloads = {
+            block: self._encodeBlock(block, allEdits, codes)
+            for block in range(self._textIndex.blockCount())
+        }
+        # The trees are only written once the text is known to fit, so a
+        # failed write leaves the ROM as it was.
+        written = self._layoutBlocks(0, payloads)
+        charPtrs = self._treeBlock.pointerPair()
+        self._romData.setBytes(charPtrs.getTreeBlockAddress(), treeBytes)
+        self._romData.setInt16Array(charPtrs.getLookupTableAddress(), offsets)
+        return written
+
+    def _packCharTrees(self, trees: Dict[int, EncodedCharTree]) -> Tuple[bytes, List[int]]:
+        '''Builds the char tree block and its offset table, to go in place of
+        the old ones. The offset table keeps its address and size, since game
+        code points at the pointer pair right after it.'''
+        charPtrs = self._treeBlock.pointerPair()
+        treeBlockAddress = charPtrs.getTreeBlockAddress()
+        offsetTableAddress = charPtrs.getLookupTableAddress()
+        offsetTableSize = (charPtrs.getPairAddress() - offsetTableAddress) // 2
+
+        if max(trees) >= offsetTableSize:
+            raise ValueError(f'Char {hex(max(trees))} does not fit in the char offset table')
+
+        block = bytearray()
+        offsets = [NO_CHAR_OFFSET] * (max(trees) + 1)
+        for char, tree in trees.items():
+            block += tree.lookupBytes()
+            offsets[char] = len(block)
+            block += tree.treeBytes()
+            if offsets[char] >= NO_CHAR_OFFSET:
+                raise ValueError('Char trees are too large for 16-bit offsets')
+
+        # Leave at least one byte between the last tree and the offset table.
+        # CharTreeBlock assumes the last tree ends 1 byte before the table.
+        if len(block) >= offsetTableAddress - treeBlockAddress:
+            raise ValueError(
+                f'Char trees need {len(block)} bytes, but only '
+                f'{offsetTableAddress - treeBlockAddress - 1} are available'
+            )
+
+        block += bytes(offsetTableAddress - treeBlockAddress - len(block))
+        offsets += [0x0] * (offsetTableSize - len(offsets))
+        return bytes(block), offsets
+
+    def _encodeBlock(self, block: int, strings: Dict[int, str], codes: Codes) -> Tuple[bytes, bytes]:
+        '''Builds the text data and length table for `block`. Strings not in
+        `strings` are copied from the ROM as-is.'''
+        text = bytearray()
+        lengths: List[int] = []
+        for id in self._textIndex.blockRange(block):
+            string = strings.get(id)
+            if string is None:
+                bitAddress, length = self._textIndex.locate(id)
+                encoded = self._romData.getBytes(bitAddress >> 3, length)
+            else:
+                encoded = encodeString(string, codes)
+            text += encoded
+            lengths.append(len(encoded))
+        return bytes(text), encodeLengths(lengths)
+
+    def _blockFootprint(self, block: int) -> Tuple[int, int]:
+        '''Returns the `[start, end)` range of space `block` can use in place.
+        This runs from the start of its text to the start of any other block's
+        text or length table (or the block pointer table), whichever is first.'''
+        start, ownLengthTable = self._textIndex.blockAddresses(block)
+        end = self._textIndex.textTableAddress()
+        for other in range(self._textIndex.blockCount()):
+            for address in self._textIndex.blockAddresses(other):
+                if start < address < end and address != ownLengthTable:
+                    end = address
+        return start, end
+
+    def _layoutBlocks(self, firstBlock: int, payloads: Dict[int, Tuple[bytes, bytes]]) -> List[int]:
+        '''Writes blocks `firstBlock` onward back to back, as text followed by
+        its length table. Blocks without a payload are copied as-is.'''
+        index = self._textIndex
+        blockCount = index.blockCount()
+
+        # If earlier blocks keep their length tables somewhere after this
+        # point, we'd overwrite them. Lay out everything instead.
+        firstStart = index.blockAddresses(firstBlock)[0]
+        if any(index.blockAddresses(block)[1] >= firstStart for block in range(firstBlock)):
+            firstBlock = 0
+            firstStart = index.blockAddresses(0)[0]
+
+        # Read everything before writing anything, since blocks may move
+        # on top of each other's old data.
+        blocks = range(firstBlock, blockCount)
+        allPayloads = [
+            payloads[block] if block in payloads else self._encodeBlock(block, {}, self._codes)
+            for block in blocks
+        ]
+
+        regionEnd = index.textTableAddress()
+        needed = sum(len(text) + len(lengths) for text, lengths in allPayloads)
+        if firstStart + needed > regionEnd:
+            raise ValueError(
+                f'Text needs {needed} bytes, but only {regionEnd - firstStart} are available'
+            )
+
+        address = firstStart
+        for block, (text, lengths) in zip(blocks, allPayloads):
+            self._romData.setBytes(address, text)
+            self._romData.setBytes(address + len(text), lengths)
+            self._setBlockPointers(block, address, address + len(text))
+            address += len(text) + len(lengths)
+        return list(blocks)
+
+    def _setBlockPointers(self, block: int, textAddress: int, lengthAddress: int) -> None:
+        "Points `block`'s Text Block Pointer Table entry at its new data."
+        self._romData.setInt32Array(
+            self._textIndex.textTableAddress() + block * TEXT_BLOCK_ENTRY_SIZE,
+            [textAddress + ROM_OFFSET, lengthAddress + ROM_OFFSET],
+        )
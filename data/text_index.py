@@ -0,0 +1,169 @@
+from array import array
+from typing import List, Optional, Tuple
+
+from .rom_data import RomData
+from .rom_text import ROM_OFFSET
+
+STRINGS_PER_BLOCK = 256
+'Every text block (except maybe the last) holds this many strings.'
+
+TEXT_BLOCK_ENTRY_SIZE = 8
+'Each Text Block Pointer Table entry is two 32-bit pointers.'
+
+class TextIndex:
+    '''Random-access index over the game's compressed strings.
+
+    Parses the Text Block Pointer Table and every block's length table once,
+    so finding any string afterwards is a couple of array lookups instead of a
+    walk through its block's length table.
+
+    NOTE: Not an accessor over `RomData`. Everything is read in up front.
+    '''
+
+    def __init__(self, romData: RomData, textTableAddress: int, blockCount: Optional[int]=None):
+        '''Loads the index from the Text Block Pointer Table at `textTableAddress`.
+
+        If `blockCount` isn't given, we read table entries until one of them
+        doesn't look like a pair of pointers into the ROM.
+        '''
+        self._textTableAddress = textTableAddress
+
+        self._blockStarts = array('I')
+        'Byte address of the start of each block of text data.'
+        self._lengthTableStarts = array('I')
+        "Byte address of each block's length table."
+        self._stringBitOffsets = array('I')
+        'Absolute bit address of each string, indexed by string ID.'
+        self._stringLengths = array('H')
+        'Length of each string, in bytes.'
+
+        self._loadBlockTable(romData, blockCount)
+        for block in range(len(self._blockStarts)):
+            count = self._loadLengthTable(romData, block)
+            # String IDs are mapped to blocks by dividing (see `blockOf`), so
+            # a short block anywhere but the end would throw every later ID off.
+            if count != STRINGS_PER_BLOCK and block + 1 < len(self._blockStarts):
+                raise ValueError(
+                    f'Text block {block} has {count} strings, but only the last block '
+                    f'may have fewer than {STRINGS_PER_BLOCK}'
+                )
+
+    @staticmethod
+    def fromArrays(textTableAddress: int, arrays: List['array[int]']) -> 'TextIndex':
+        '''Rebuilds an index from the `arrays()` of an earlier one, without reading any ROM data.
+        :raises
+            ValueError: if `arrays` don't look like they came from `arrays()`.
+        '''
+        if [values.typecode for values in arrays] != ['I', 'I', 'I', 'H'] \
+        or len(arrays[0]) != len(arrays[1]) or len(arrays[2]) != len(arrays[3]):
+            raise ValueError('Not the arrays of a TextIndex')
+        blockCount, stringCount = len(arrays[0]), len(arrays[2])
+        if not (blockCount - 1) * STRINGS_PER_BLOCK < stringCount <= blockCount * STRINGS_PER_BLOCK \
+        and (blockCount, stringCount) != (0, 0):
+            raise ValueError(f'{stringCount} strings do not fill {blockCount} text blocks')
+        index = TextIndex.__new__(TextIndex)
+        index._textTableAddress = textTableAddress
+        index._blockStarts, index._lengthTableStarts, index._stringBitOffsets, index._stringLengths = arrays
+        return index
+
+    def arrays(self) -> List['array[int]']:
+        'Returns everything this index read from the ROM, e.g. to cache it. See `fromArrays`.'
+        return [self._blockStarts, self._lengthTableStarts, self._stringBitOffsets, self._stringLengths]
+
+    def _loadBlockTable(self, romData: RomData, blockCount: Optional[int]):
+        'Reads the pointer pair for each block of text.'
+        romEnd = ROM_OFFSET + romData.size()
+        maxBlocks = (romData.size() - self._textTableAddress) // TEXT_BLOCK_ENTRY_SIZE
+        if blockCount is None:
+            blockCount = maxBlocks
+        elif blockCount > maxBlocks:
+            raise IndexError(f'Text block table does not fit {blockCount} blocks')
+
+        pointers = romData.getInt32Array(self._textTableAddress, blockCount * 2)
+        for block in range(blockCount):
+            textPtr = pointers[block * 2]
+            lengthPtr = pointers[block * 2 + 1]
+
+            # Like the char lookup tables, we just read until we see garbage.
+            # Text blocks are stored in order, so this also stops at the first
+            # block that goes backwards.
+            if not (ROM_OFFSET <= textPtr < romEnd and ROM_OFFSET <= lengthPtr < romEnd) \
+            or (self._blockStarts and textPtr - ROM_OFFSET <= self._blockStarts[-1]):
+                break
+
+            self._blockStarts.append(textPtr - ROM_OFFSET)
+            self._lengthTableStarts.append(lengthPtr - ROM_OFFSET)
+
+    def _loadLengthTable(self, romData: RomData, block: int) -> int:
+        '''Reads the lengths of every string in `block`. Returns how many there are.
+
+        Full blocks always have `STRINGS_PER_BLOCK` strings. The last block may
+        have fewer, so we also stop once the strings run into whatever comes
+        after the block's text data (its length table, the next block, or the
+        block pointer table).
+        '''
+        textStart = self._blockStarts[block]
+        textEnd = min(
+            (address for address in (
+                self._lengthTableStarts[block],
+                self._blockStarts[block + 1] if block + 1 < len(self._blockStarts) else None,
+                self._textTableAddress,
+            ) if address is not None and address > textStart),
+            default=romData.size(),
+        )
+
+        # Lengths are stored one byte at a time.
+        # 0xFF means "add 255 and keep reading".
+        lengthTableStart = self._lengthTableStarts[block]
+        lengthBytes = romData.getInt8Array(lengthTableStart, romData.size() - lengthTableStart)
+
+        address = textStart
+        length = 0
+        count = 0
+        for part in lengthBytes:
+            length += part
+            if part == 0xFF:
+                continue
+
+            self._stringBitOffsets.append(address * 8)
+            self._stringLengths.append(length)
+            address += length
+            length = 0
+            count += 1
+            if count == STRINGS_PER_BLOCK or address >= textEnd:
+                break
+        return count
+
+    def __len__(self) -> int:
+        return len(self._stringLengths)
+
+    def blockCount(self) -> int:
+        'Returns the number of text blocks.'
+        return len(self._blockStarts)
+
+    def blockOf(self, id: int) -> int:
+        '''Returns the block the string with the given ID is stored in.
+        Every block but the last holds exactly `STRINGS_PER_BLOCK` strings, which `__init__` checks.'''
+        return id // STRINGS_PER_BLOCK
+
+    def blockRange(self, block: int) -> range:
+        'Returns the range of string IDs stored in `block`.'
+        start = block * STRINGS_PER_BLOCK
+        return range(start, min(start + STRINGS_PER_BLOCK, len(self)))
+
+    def blockAddresses(self, block: int) -> Tuple[int, int]:
+        "Returns the addresses of `block`'s text data and length table."
+        return self._blockStarts[block], self._lengthTableStarts[block]
+
+    def locate(self, id: int) -> Tuple[int, int]:
+        '''Returns the bit address and length (in bytes) of the string
+        with the given ID.'''
+        return self._stringBitOffsets[id], self._stringLengths[id]
+
+    def textTableAddress(self) -> int:
+        'Returns the address of the Text Block Pointer Table.'
+        return self._textTableAddress
+
+    def __str__(self) -> str:
+        return f'{TextIndex.__name__}({hex(self._textTableAddress)}, ' \
+            f'{self.blockCount()} blocks, {len(self)} strings)'
@@ -0,0 +1,213 @@
+'''
+Substring search over the game script.
+
+`TextSearchIndex` keeps an inverted index from every trigram (3 character
+substring) to the strings containing it, built once per script. A search only
+checks strings that contain every trigram of the query, and when a query
+grows (e.g. while typing) only the previous matches are checked again.
+
+Results are a `RowSet`, a bitmap of matching string IDs, so checking a single
+row (e.g. from a Qt filter proxy) is a constant-time lookup. Regex searches
+can't use the index, so they check every string.
+
+Searching may run on a worker thread while `setString` is called from another.
+A search that overlaps an edit may miss it, but won't break the index.
+'''
+
+from array import array
+from bisect import bisect_left, insort
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+import re
+
+NGRAM_SIZE = 3
+'Length of the substrings the index is keyed by.'
+
+SEARCH_BATCH_SIZE = 1024
+'How many strings `TextSearchIndex.iterSearch` checks per batch.'
+
+class RowSet:
+    'A set of row numbers in `[0, rowCount)`, stored as a bitmap.'
+
+    def __init__(self, rows: Iterable[int], rowCount: int):
+        self._bitmap = bytearray((rowCount + 7) // 8)
+        self._rowCount = rowCount
+        self._count = 0
+        self.update(rows)
+
+    def update(self, rows: Iterable[int]) -> None:
+        'Adds `rows` to the set.'
+        bitmap = self._bitmap
+        for row in rows:
+            mask = 1 << (row & 7)
+            if not bitmap[row >> 3] & mask:
+                bitmap[row >> 3] |= mask
+                self._count += 1
+
+    def __contains__(self, row: int) -> bool:
+        return 0 <= row < self._rowCount and (self._bitmap[row >> 3] >> (row & 7)) & 1 == 1
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self) -> Iterator[int]:
+        bitmap = self._bitmap
+        for byteIndex in range(len(bitmap)):
+            byte = bitmap[byteIndex]
+            while byte:
+                lowBit = byte & -byte
+                yield byteIndex * 8 + lowBit.bit_length() - 1
+                byte ^= lowBit
+
+    def rowCount(self) -> int:
+        'Returns the number of rows this set can hold, matching or not.'
+        return self._rowCount
+
+    def __str__(self) -> str:
+        return f'{RowSet.__name__}({self._count}/{self._rowCount} rows)'
+
+class TextSearchIndex:
+    '''An inverted trigram index over a list of strings, for fast substring search.
+
+    Holds a copy of every string (plus a case-folded copy for
+    case-insensitive search), so searching never has to decode anything.
+    Keep it up to date with `setString` when strings are edited.
+    '''
+
+    def __init__(self, strings: Iterable[str]):
+        self._strings: List[str] = []
+        self._folded: List[str] = []
+        self._postings: Dict[str, 'array[int]'] = {}
+        'Sorted IDs of the strings containing each trigram (of the folded text).'
+
+        postings = self._postings
+        for row, string in enumerate(strings):
+            folded = string.casefold()
+            self._strings.append(string)
+            self._folded.append(folded)
+            for gram in TextSearchIndex._ngrams(folded):
+                rows = postings.get(gram)
+                if rows is None:
+                    rows = postings[gram] = array('I')
+                rows.append(row)
+
+        # The last search, so a longer query can be checked against just its matches.
+        self._lastQuery: Optional[str] = None
+        self._lastCaseSensitive = False
+        self._lastMatches: Set[int] = set()
+        self._version = 0
+        'Bumped on every edit, so a search running on another thread knows its results are stale.'
+
+    @staticmethod
+    def _ngrams(text: str) -> Set[str]:
+        return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    def __getitem__(self, row: int) -> str:
+        return self._strings[row]
+
+    def setString(self, row: int, text: str) -> None:
+        'Replaces the indexed string for `row`.'
+        oldGrams = TextSearchIndex._ngrams(self._folded[row])
+        folded = text.casefold()
+        newGrams = TextSearchIndex._ngrams(folded)
+
+        for gram in oldGrams - newGrams:
+            rows = self._postings[gram]
+            del rows[bisect_left(rows, row)]
+            if not rows:
+                del self._postings[gram]
+        for gram in newGrams - oldGrams:
+            insort(self._postings.setdefault(gram, array('I')), row)
+
+        self._strings[row] = text
+        self._folded[row] = folded
+        self._lastQuery = None
+        self._version += 1
+
+    def search(self, query: str, caseSensitive: bool=True, regex: bool=False) -> RowSet:
+        '''Returns the rows whose string contains `query`.
+
+        A row also matches if its ID (as a decimal number) contains `query`,
+        the same as searching the ID column of the string table.
+        With `regex=True`, `query` is a regular expression matched against
+        strings only.
+        :raises
+            re.error: if `query` is not a valid regex.
+        '''
+        return RowSet(
+            (row for batch in self.iterSearch(query, caseSensitive, regex) for row in batch),
+            len(self),
+        )
+
+    def iterSearch(
+        self,
+        query: str,
+        caseSensitive: bool=True,
+        regex: bool=False,
+        batchSize: int=SEARCH_BATCH_SIZE,
+    ) -> Iterator[List[int]]:
+        '''Like `search`, but yields matching rows in ascending batches as they're found.
+
+        About `batchSize` strings are checked per batch, so a caller (e.g. a
+        worker thread) can cancel a search by just not asking for the next
+        batch. Only searches that run to the end are used to refine the next one.
+        '''
+        version = self._version
+        if regex:
+            pattern = re.compile(query, 0 if caseSensitive else re.IGNORECASE)
+            candidates: Sequence[int] = range(len(self))
+            idMatches: Set[int] = set()
+            strings = self._strings
+            isMatch: Callable[[int], bool] = lambda row: pattern.search(strings[row]) is not None
+        else:
+            candidates = sorted(self._candidates(query, caseSensitive))
+            idMatches = set()
+            if query.isdigit():
+                idMatches = {row for row in range(len(self)) if query in str(row)}
+                candidates = sorted(idMatches.union(candidates))
+            needle = query if caseSensitive else query.casefold()
+            strings = self._strings if caseSensitive else self._folded
+            isMatch = lambda row: needle in strings[row]
+
+        textMatches: Set[int] = set()
+        for start in range(0, len(candidates), batchSize):
+            batch = []
+            for row in candidates[start:start + batchSize]:
+                if isMatch(row):
+                    textMatches.add(row)
+                    batch.append(row)
+                elif row in idMatches:
+                    batch.append(row)
+            if batch:
+                yield batch
+
+        # Only remember this if nothing was edited while we were searching.
+        if not regex and version == self._version:
+            self._lastQuery = query
+            self._lastCaseSensitive = caseSensitive
+            self._lastMatches = textMatches
+
+    def _candidates(self, query: str, caseSensitive: bool) -> Iterable[int]:
+        'Returns the rows that could contain `query`, going by the index and the last search.'
+        refining = self._lastQuery is not None and self._lastQuery in query \
+            and self._lastCaseSensitive == caseSensitive
+
+        grams = TextSearchIndex._ngrams(query.casefold())
+        if grams:
+            postings: List['array[int]'] = []
+            for gram in grams:
+                rows = self._postings.get(gram)
+                if rows is None:
+                    return ()
+                postings.append(rows)
+
+            # Start from the rarest trigram to keep the intermediate sets small.
+            postings.sort(key=len)
+            indexed = set(postings[0]).intersection(*postings[1:])
+            # Anything that contains the new query also contains the old one.
+            return indexed & self._lastMatches if refining else indexed
+        elif refining:
+            return self._lastMatches
+        return range(len(self))
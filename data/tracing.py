@@ -0,0 +1,229 @@
+'''
+Lightweight tracing of the hot paths, for finding out where the time goes.
+
+Wrap interesting work in `with span('name'):`, or decorate a function with
+`@traced('name')`. Tracing is off by default, and then a span costs one
+global lookup and an empty `with` block.
+
+Turn it on with `start`, or by setting `PSYNERGY_TRACE` to an output path
+(see `startFromEnvironment`). When the program exits, every span is written
+as Chrome trace-event JSON (open it in `chrome://tracing` or Perfetto) and a
+per-phase summary is printed to stderr.
+
+With `memory=True` (or `PSYNERGY_TRACE_MEMORY=1`), each span also records
+the peak memory allocated while it ran, using `tracemalloc`. This slows
+everything down a lot, so durations from a memory trace are only rough.
+tracemalloc tracks the whole process, so spans that overlap on different
+threads will see each other's allocations.
+'''
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import wraps
+from json import dump
+from os import environ, getpid
+from sys import stderr
+from threading import current_thread, get_ident, local
+from time import perf_counter_ns
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+import atexit
+
+TRACE_ENV = 'PSYNERGY_TRACE'
+'Environment variable with the path to write a trace to. Tracing is off if it is unset or empty.'
+TRACE_MEMORY_ENV = 'PSYNERGY_TRACE_MEMORY'
+'Environment variable that turns on memory tracing when set to a non-empty value other than 0.'
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+@dataclass
+class SpanRecord:
+    'A single finished span.'
+    name: str
+    start: int
+    'Start time, in nanoseconds since the tracer started.'
+    duration: int
+    'In nanoseconds.'
+    threadId: int
+    args: Dict[str, Any]
+    peakMemory: Optional[int] = None
+    'Peak bytes allocated while the span ran, if memory is being traced.'
+
+@dataclass
+class _OpenSpan:
+    'Memory bookkeeping for a span that is still running.'
+    startMemory: int = 0
+    peakMemory: int = 0
+    'Highest traced memory seen so far, including by finished child spans.'
+
+@dataclass
+class Tracer:
+    '''Collects spans and writes them out.
+
+    Spans may be recorded from any thread. Use the module-level `span` and
+    `traced` rather than calling this directly.
+    '''
+    outputPath: str
+    memory: bool = False
+    records: List[SpanRecord] = field(default_factory=list)
+    threadNames: Dict[int, str] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._origin = perf_counter_ns()
+        self._local = local()
+        if self.memory:
+            import tracemalloc
+            self._tracemalloc: Any = tracemalloc
+            tracemalloc.start()
+
+    @contextmanager
+    def span(self, name: str, args: Dict[str, Any]) -> Iterator[None]:
+        stack: List[_OpenSpan] = getattr(self._local, 'stack', None) or []
+        self._local.stack = stack
+        openSpan = _OpenSpan()
+        if self.memory:
+            current, peak = self._tracemalloc.get_traced_memory()
+            openSpan.startMemory = openSpan.peakMemory = current
+            # The peak is about to be reset, so hand it to the enclosing span first.
+            if stack:
+                stack[-1].peakMemory = max(stack[-1].peakMemory, peak)
+            # Without reset_peak (before Python 3.9), peaks can only grow, so
+            # a span may report a peak from before it started.
+            if hasattr(self._tracemalloc, 'reset_peak'):
+                self._tracemalloc.reset_peak()
+        stack.append(openSpan)
+
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = perf_counter_ns()
+            stack.pop()
+            peakMemory = None
+            if self.memory:
+                openSpan.peakMemory = max(openSpan.peakMemory, self._tracemalloc.get_traced_memory()[1])
+                peakMemory = openSpan.peakMemory - openSpan.startMemory
+                if stack:
+                    stack[-1].peakMemory = max(stack[-1].peakMemory, openSpan.peakMemory)
+
+            threadId = get_ident()
+            if threadId not in self.threadNames:
+                self.threadNames[threadId] = current_thread().name
+            # list.append is atomic, so no lock is needed here.
+            self.records.append(SpanRecord(name, start - self._origin, end - start, threadId, args, peakMemory))
+
+    def write(self) -> None:
+        'Writes every span so far as Chrome trace-event JSON.'
+        pid = getpid()
+        events: List[Dict[str, Any]] = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': threadId, 'args': {'name': name}}
+            for threadId, name in self.threadNames.items()
+        ]
+        for record in list(self.records):
+            args = dict(record.args)
+            if record.peakMemory is not None:
+                args['peakMemoryBytes'] = record.peakMemory
+            events.append({
+                'name': record.name,
+                'cat': record.name.split('.')[0],
+                'ph': 'X',
+                'ts': record.start / 1000,
+                'dur': record.duration / 1000,
+                'pid': pid,
+                'tid': record.threadId,
+                'args': args,
+            })
+        with open(self.outputPath, 'w') as outputFile:
+            dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, outputFile)
+
+    def summary(self) -> str:
+        'Returns a table of the count, total, mean and max time (and peak memory) per span name.'
+        byName: Dict[str, List[SpanRecord]] = {}
+        for record in list(self.records):
+            byName.setdefault(record.name, []).append(record)
+        if not byName:
+            return 'Trace summary: no spans recorded'
+
+        width = max(len(name) for name in byName)
+        header = f'  {"span":<{width}}  {"count":>7}  {"total ms":>10}  {"mean ms":>9}  {"max ms":>9}'
+        if self.memory:
+            header += f'  {"peak KiB":>10}'
+        lines = ['Trace summary:', header]
+        # Slowest first, since that's what anyone reading this is looking for.
+        for name, records in sorted(byName.items(), key=lambda item: -sum(r.duration for r in item[1])):
+            total = sum(record.duration for record in records) / 1e6
+            line = f'  {name:<{width}}  {len(records):>7}  {total:>10.2f}  ' + \
+                f'{total / len(records):>9.3f}  {max(r.duration for r in records) / 1e6:>9.3f}'
+            if self.memory:
+                line += f'  {max(r.peakMemory or 0 for r in records) / 1024:>10.1f}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def finish(self) -> None:
+        'Writes the trace and prints the summary to stderr.'
+        self.write()
+        print(self.summary(), file=stderr)
+        print(f'Wrote trace to {self.outputPath}', file=stderr, flush=True)
+        if self.memory:
+            self._tracemalloc.stop()
+
+_tracer: Optional[Tracer] = None
+
+def start(outputPath: str, memory: bool=False) -> Tracer:
+    'Starts tracing. The trace is written to `outputPath` when the program exits.'
+    global _tracer
+    if _tracer is not None:
+        raise Exception(f'Already tracing to {_tracer.outputPath}')
+    _tracer = Tracer(outputPath, memory)
+    atexit.register(stop)
+    return _tracer
+
+def startFromEnvironment() -> Optional[Tracer]:
+    'Starts tracing if `PSYNERGY_TRACE` is set. Returns the tracer, or `None` if tracing is off.'
+    outputPath = environ.get(TRACE_ENV)
+    if not outputPath or _tracer is not None:
+        return _tracer
+    return start(outputPath, environ.get(TRACE_MEMORY_ENV, '0') not in ('', '0'))
+
+def stop() -> None:
+    'Stops tracing, writing out the trace. Does nothing if tracing is off.'
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        atexit.unregister(stop)
+        tracer.finish()
+
+def isTracing() -> bool:
+    return _tracer is not None
+
+class _NullSpan:
+    'Does nothing. Shared by every span while tracing is off.'
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str, **args: Any) -> Any:
+    '''Returns a context manager that records the time spent in it as `name`.
+
+    Names are dotted, and the first part is used as the trace category,
+    e.g. `text.decode`. Keyword `args` are shown with the span in the trace.
+    '''
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, args)
+
+def traced(name: str) -> Callable[[F], F]:
+    'Decorates a function so every call to it is recorded as a span.'
+    def decorate(function: F) -> F:
+        @wraps(function)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(name, {}):
+                return function(*args, **kwargs)
+        return wrapper # type: ignore
+    return decorate
@@ -1,12 +1,51 @@
-import logging
-import gitinfo
+from typing import Optional
 
 PROGRAM_NAME = 'Psynergy'
 PROGRAM_DESCRIPTION='Graphical editor for Golden Sun and other Camelot games.'
 PROGRAM_VERSION = '0.0.0'
 
-# Override PROGRAM_VERSION for local development
-logging.getLogger(gitinfo.__name__).setLevel(logging.CRITICAL)
-commit = gitinfo.get_git_info()
-if commit is not None:
-    PROGRAM_VERSION = f"dev {commit.get('author_date')} ({commit.get('commit')})"
\ No newline at end of file
+BUILD_VERSION_MODULE = '_version'
+'''Optional module holding a `BUILD_VERSION` string, baked in by running this
+file (`python info.py`). Release builds should ship it so the version never
+has to be looked up at runtime.'''
+
+_version: Optional[str] = None
+
+def programVersion() -> str:
+    '''Returns the version string to report to users.
+
+    This is `PROGRAM_VERSION`, unless a baked-in build version exists, or
+    we're running from a git checkout (then it's the current commit).
+    Only worked out the first time it's needed, since looking up git info
+    is slow and most launches never show the version.
+    '''
+    global _version
+    if _version is None:
+        _version = _bakedVersion() or _gitVersion() or PROGRAM_VERSION
+    return _version
+
+def _bakedVersion() -> Optional[str]:
+    from importlib import import_module
+    try:
+        return import_module(BUILD_VERSION_MODULE).BUILD_VERSION
+    except ImportError:
+        return None
+
+def _gitVersion() -> Optional[str]:
+    'Returns a version for local development, based on the current git commit.'
+    import logging
+    import gitinfo
+
+    logging.getLogger(gitinfo.__name__).setLevel(logging.CRITICAL)
+    commit = gitinfo.get_git_info()
+    if commit is None:
+        return None
+    return f"dev {commit.get('author_date')} ({commit.get('commit')})"
+
+# Bakes the current version into BUILD_VERSION_MODULE, next to this file.
+if __name__ == '__main__':
+    from os.path import dirname, join
+    version = _gitVersion() or PROGRAM_VERSION
+    with open(join(dirname(__file__) or '.', f'{BUILD_VERSION_MODULE}.py'), 'w') as versionFile:
+        versionFile.write(f'BUILD_VERSION = {repr(version)}\n')
+    print(version)
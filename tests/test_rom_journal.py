@@ -0,0 +1,126 @@
+'''
+Tests for `RomJournal`, run against a small synthetic ROM (see `bench/synthetic_rom.py`).
+
+Run from the project root with `python -m unittest` (or `python -m pytest`).
+'''
+
+from os.path import join
+from tempfile import TemporaryDirectory
+import unittest
+
+from bench.synthetic_rom import buildRom
+from data.rom_data import RomData
+from data.rom_journal import RomJournal
+from data.rom_loader import Rom
+from data.rom_text import CharPointerPair, CharTreeBlock
+from data.text_decoder import TextDecoder
+from data.text_encoder import TextEncoder
+from data.text_index import TextIndex
+
+class RomJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rom = buildRom(stringCount=3000)
+        self.data = RomData(memoryview(self.rom.data))
+        self.journal = RomJournal(self.data)
+
+    def _treeBlock(self) -> CharTreeBlock:
+        return CharTreeBlock(self.data, CharPointerPair(self.data, self.rom.charPointerPair))
+
+    def _decodeAll(self):
+        decoder = TextDecoder(self.data, self._treeBlock(), TextIndex(self.data, self.rom.textTable))
+        return [decoder.decodeString(id) for id in range(decoder.stringCount())]
+
+    def _writeStrings(self, edits, incremental=True):
+        encoder = TextEncoder(self.data, self._treeBlock(), TextIndex(self.data, self.rom.textTable))
+        return encoder.writeStrings(edits, incremental)
+
+    def test_undoWriteStringsInOneStep(self):
+        # Shorter, so the block's length table and its pointers move too.
+        edited = self.rom.strings[0].split(' ')[0]
+        self.assertNotEqual(edited, self.rom.strings[0])
+        self._writeStrings({0: edited})
+        self.assertEqual(self._decodeAll()[0], edited)
+
+        self.journal.undo()
+        self.assertFalse(self.journal.canUndo())
+        self.assertEqual(self._decodeAll(), self.rom.strings)
+
+        self.journal.redo()
+        self.assertEqual(self._decodeAll(), [edited] + self.rom.strings[1:])
+
+    def test_undoFullRewriteInOneStep(self):
+        # Copies of the shortest string, so the recompressed script still fits.
+        shortest = min(self.rom.strings, key=len)
+        edits = {id: shortest for id in range(100)}
+        self._writeStrings(edits, incremental=False)
+        self.assertEqual(self._decodeAll()[:100], list(edits.values()))
+
+        self.journal.undo()
+        self.assertFalse(self.journal.canUndo())
+        self.assertEqual(self._decodeAll(), self.rom.strings)
+
+    def test_separateTransactions(self):
+        with self.journal.transaction():
+            self.data.setBytes(0x100, b'ab')
+            self.data.setBytes(0x200, b'cd')
+        with self.journal.transaction():
+            self.data.setBytes(0x102, b'ef')
+
+        self.journal.undo()
+        self.assertEqual(self.data.getBytes(0x100, 4), b'ab\0\0')
+        self.assertEqual(self.data.getBytes(0x200, 2), b'cd')
+        self.journal.undo()
+        self.assertEqual(self.data.getBytes(0x100, 4), bytes(4))
+        self.assertEqual(self.data.getBytes(0x200, 2), bytes(2))
+
+    def test_mergedWritesKeepFirstOldBytes(self):
+        self.data.setBytes(0x100, b'abc')
+        self.data.setBytes(0x104, b'gh')
+        self.data.setBytes(0x102, b'XYZ')
+        self.journal.undo()
+        self.assertEqual(self.data.getBytes(0x100, 6), bytes(6))
+        self.journal.redo()
+        self.assertEqual(self.data.getBytes(0x100, 6), b'abXYZh')
+
+    def test_newestEntryIsNeverEvicted(self):
+        self.journal.setMaxSize(4)
+        self.data.setBytes(0x100, b'x' * 100)
+        self.assertTrue(self.journal.canUndo())
+        self.journal.undo()
+        self.assertEqual(self.data.getBytes(0x100, 100), bytes(100))
+
+class RomUndoTest(unittest.TestCase):
+
+    def setUp(self):
+        self.synthetic = buildRom(stringCount=3000)
+        self.directory = TemporaryDirectory(ignore_cleanup_errors=True)
+        path = join(self.directory.name, 'synthetic.gba')
+        with open(path, 'wb') as romFile:
+            romFile.write(self.synthetic.data)
+        self.rom = Rom(path)
+
+    def tearDown(self):
+        # Unmaps the file, so it can be deleted.
+        del self.rom
+        self.directory.cleanup()
+
+    def test_undoReloadsStrings(self):
+        strings = self.rom.strings()
+        assert strings is not None
+        edited = self.synthetic.strings[0].split(' ')[0]
+        strings.setString(0, edited)
+        self.rom.writeStrings()
+        self.rom.pointerIndex()
+
+        self.assertTrue(self.rom.undo())
+        self.assertEqual(list(strings), self.synthetic.strings)
+        self.assertEqual(strings[0], self.synthetic.strings[0])
+        self.assertIsNone(self.rom._pointerIndex)
+
+        self.assertTrue(self.rom.redo())
+        self.assertEqual(strings[0], edited)
+        self.assertFalse(self.rom.redo())
+
+if __name__ == '__main__':
+    unittest.main()
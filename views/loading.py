@@ -0,0 +1,122 @@
+from typing import Dict, Optional, Tuple
+
+from PyQt5.QtCore import pyqtSignal, QObject, QRunnable
+
+from data.analysis_cache import AnalysisCache
+from data.checksums import HASH_ALGORITHMS
+from data.rom_loader import Rom
+from data.tracing import span
+
+class RomLoadTask(QRunnable):
+    '''Loads a ROM file on a worker thread, reporting each piece as it's ready.
+
+    The `Rom` is handed over by `headerLoaded` as soon as the file is mapped
+    and its header is read, so the GUI can show something right away. The
+    slower steps (hashing, finding and indexing the script) keep running
+    here and fill in the rest. The GUI shouldn't ask the `Rom` for data
+    that's still being loaded until the matching signal fires.
+
+    Every task gets a number, so signals from a load that was superseded
+    (by opening another ROM) can be ignored.
+    '''
+
+    class Signals(QObject):
+        # QRunnable isn't a QObject, so it can't have signals itself.
+        headerLoaded = pyqtSignal(int, Rom)
+        'The ROM file is mapped and its header is known.'
+        progress = pyqtSignal(int, str, int)
+        'A new step started: (task number, description, percent done).'
+        crc32Loaded = pyqtSignal(int, str)
+        'The CRC32 of the ROM is known.'
+        stringsLoaded = pyqtSignal(int)
+        '`Rom.strings()` is ready (even if no script was found).'
+        finished = pyqtSignal(int)
+        'Everything is loaded.'
+        failed = pyqtSignal(int, str)
+        'Loading stopped because of an error.'
+
+    STEPS = ['Reading header', 'Calculating CRC32', 'Finding text tables', 'Indexing text']
+
+    def __init__(self, number: int, filePath: str, cache: Optional[AnalysisCache]=None):
+        super().__init__()
+        self.number = number
+        self.signals = RomLoadTask.Signals()
+        self._filePath = filePath
+        self._cache = cache
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        'Stops loading after the current step.'
+        self._cancelled = True
+
+    def run(self) -> None:
+        with span('load.rom', path=self._filePath):
+            self._run()
+
+    def _run(self) -> None:
+        signals = self.signals
+        try:
+            self._step(0)
+            rom = Rom(self._filePath, self._cache)
+            signals.headerLoaded.emit(self.number, rom)
+
+            self._step(1)
+            crc32 = rom.crc32()
+            signals.crc32Loaded.emit(self.number, crc32)
+
+            self._step(2)
+            rom.textAnchors(crc32)
+
+            self._step(3)
+            rom.strings()
+            signals.stringsLoaded.emit(self.number)
+
+            signals.finished.emit(self.number)
+        except RomLoadTask._Cancelled:
+            pass
+        except Exception as e:
+            signals.failed.emit(self.number, str(e))
+
+    class _Cancelled(Exception):
+        pass
+
+    def _step(self, step: int) -> None:
+        if self._cancelled:
+            raise RomLoadTask._Cancelled()
+        self.signals.progress.emit(
+            self.number,
+            RomLoadTask.STEPS[step],
+            100 * step // len(RomLoadTask.STEPS),
+        )
+
+class ChecksumTask(QRunnable):
+    '''Works out the checksums of a loaded ROM on a worker thread.
+
+    Cheap when nothing changed since last time (they're cached), or when only
+    the CRC32 is needed after an edit (only the edits are rehashed).
+    '''
+
+    class Signals(QObject):
+        finished = pyqtSignal(int, dict)
+        'Checksums are ready: (task number, hex digests keyed by algorithm).'
+        failed = pyqtSignal(int, str)
+
+    def __init__(self, number: int, rom: Rom, algorithms: Tuple[str, ...]=HASH_ALGORITHMS):
+        super().__init__()
+        self.number = number
+        self.signals = ChecksumTask.Signals()
+        self._rom = rom
+        self._algorithms = algorithms
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        'Stops hashing after the current chunk.'
+        self._cancelled = True
+
+    def run(self) -> None:
+        try:
+            checksums: Optional[Dict[str, str]] = self._rom.checksums(self._algorithms, lambda: self._cancelled)
+            if checksums is not None:
+                self.signals.finished.emit(self.number, checksums)
+        except Exception as e:
+            self.signals.failed.emit(self.number, str(e))
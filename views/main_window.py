@@ -1,8 +1,8 @@
 from os.path import dirname
 from pathlib import Path
-from typing import cast
+from typing import cast, Optional
 
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QThreadPool
 from PyQt5.QtGui import (
     QDragEnterEvent,
     QDropEvent
@@ -13,7 +13,6 @@ from PyQt5.QtWidgets import (
     QLabel,
     QMenuBar,
     QMainWindow,
-    QTabWidget,
     QVBoxLayout,
     QWidget,
 )
@@ -21,9 +20,11 @@ from PyQt5.QtWidgets import (
 from data.rom_loader import Rom
 from info import PROGRAM_NAME
 
+from .loading import RomLoadTask
 from .rom_info import RomInfoTab
 from .state import state
 from .text_editor import TextEditTab
+from .widgets import LazyTabWidget
 
 class MainWindow(QMainWindow):
     '''The top-level window.
@@ -47,6 +48,16 @@ class MainWindow(QMainWindow):
         self._currentView = None
         self.applyView(self._makeDefaultView())
 
+        # ROMs are loaded on a worker thread, so the window never freezes.
+        self._loadPool = QThreadPool(self)
+        self._loadPool.setMaxThreadCount(1)
+        self._loadTask: Optional[RomLoadTask] = None
+        self._loadCount = 0
+        self._editorTabs: Optional[LazyTabWidget] = None
+        self._romTab = -1
+        self._textEditTab = -1
+        self._crc32: Optional[str] = None
+
     def dragEnterEvent(self, e: QDragEnterEvent) -> None:
         '''Event handler for hovering over the window with a dragged file.
         Only allows subsequent `dropEvent` to fire if the file is a ROM file.
@@ -79,9 +90,8 @@ class MainWindow(QMainWindow):
         saveAsAction = fileMenu.addAction('Save As...')
 
         openAction.triggered.connect(self.openRomFileDialog)
-        # TODO wire these up to something
-        saveAction.triggered.connect(lambda: print('Clicked Save'))
-        saveAsAction.triggered.connect(lambda: print('Clicked Save As'))
+        saveAction.triggered.connect(self.saveRomFile)
+        saveAsAction.triggered.connect(self.saveRomFileDialog)
 
         return menuBar
 
@@ -98,11 +108,88 @@ class MainWindow(QMainWindow):
         self.openRomFile(filename)
 
     def openRomFile(self, filepath: str) -> None:
-        'Opens a ROM file from a file path.'
-        try:
-            # TODO needs some kind of detection for invalid files from CLI
-            state.loadedRom = Rom(filepath)
+        '''Opens a ROM file from a file path.
+
+        Loading happens in the background. The editor tabs are shown as soon
+        as the ROM header is read, and filled in as the rest is loaded.
+        '''
+        if self._loadTask is not None:
+            self._loadTask.cancel()
+
+        # TODO needs some kind of detection for invalid files from CLI
+        self._loadCount += 1
+        task = RomLoadTask(self._loadCount, filepath, state.analysisCache)
+        task.signals.headerLoaded.connect(self._onHeaderLoaded)
+        task.signals.progress.connect(self._onLoadProgress)
+        task.signals.crc32Loaded.connect(self._onCrc32Loaded)
+        task.signals.stringsLoaded.connect(self._onStringsLoaded)
+        task.signals.finished.connect(self._onLoadFinished)
+        task.signals.failed.connect(self._onLoadFailed)
+        self._loadTask = task
+        self._loadPool.start(task)
+
+    def _isCurrentLoad(self, number: int) -> bool:
+        return self._loadTask is not None and self._loadTask.number == number
+
+    def _onHeaderLoaded(self, number: int, rom: Rom) -> None:
+        if self._isCurrentLoad(number):
+            state.loadedRom = rom
+            self._crc32 = None
             self.applyView(self._makeEditorTabsView())
+
+    def _onLoadProgress(self, number: int, step: str, percent: int) -> None:
+        if self._isCurrentLoad(number):
+            self.statusBar().showMessage(f'{step}... ({percent}%)')
+
+    def _onCrc32Loaded(self, number: int, crc32: str) -> None:
+        if not self._isCurrentLoad(number) or self._editorTabs is None:
+            return
+        self._crc32 = crc32
+        romInfoTab = self._editorTabs.tabContent(self._romTab)
+        if romInfoTab is not None:
+            cast(RomInfoTab, romInfoTab).setCrc32(crc32)
+
+    def _onStringsLoaded(self, number: int) -> None:
+        'Lets the text editor be built, now that the script is indexed.'
+        if self._isCurrentLoad(number) and self._editorTabs is not None:
+            self._editorTabs.setTabReady(self._textEditTab)
+
+    def _onLoadFinished(self, number: int) -> None:
+        if self._isCurrentLoad(number):
+            self._loadTask = None
+            self.statusBar().clearMessage()
+
+    def _onLoadFailed(self, number: int, message: str) -> None:
+        if self._isCurrentLoad(number):
+            self._loadTask = None
+            self.statusBar().showMessage(f'Failed to load ROM: {message}')
+            # TODO better error handling. Probably print to window
+            print(message)
+
+    def saveRomFile(self) -> None:
+        'Writes changes to the loaded ROM back to its file.'
+        if state.loadedRom is None:
+            return
+        try:
+            state.loadedRom.save()
+        except Exception as e:
+            # TODO better error handling. Probably print to window
+            print(e)
+
+    def saveRomFileDialog(self) -> None:
+        'Saves the loaded ROM to a new file using a file selection dialog.'
+        if state.loadedRom is None:
+            return
+        filename = QFileDialog().getSaveFileName(
+            caption='Save GBA/NDS File As',
+            filter='GBA/NDS file (*.gba *.nds)',
+            directory=state.loadedRom.filePath(),
+        )[0]
+        if not filename:
+            return
+        try:
+            state.loadedRom.saveAs(filename)
+            state.workingDir = dirname(filename)
         except Exception as e:
             # TODO better error handling. Probably print to window
             print(e)
@@ -116,17 +203,25 @@ class MainWindow(QMainWindow):
 
         return editorGroupBox
 
-    def _makeEditorTabsView(self) -> QTabWidget:
+    def _makeEditorTabsView(self) -> LazyTabWidget:
+        '''Makes the editor tabs. Each one is only built when first shown,
+        and pulls its data from the loaded ROM, which caches it.'''
         # TODO disable tabs for editors we don't support for the loaded game
-        bar = QTabWidget(self)
-        bar.addTab(RomInfoTab(bar), 'ROM')
-        bar.addTab(QLabel('TODO'), 'Map')
-        bar.addTab(TextEditTab(bar), 'Text Editor')
-        bar.addTab(QLabel('TODO'), 'Shops')
-        bar.addTab(QLabel('TODO'), 'Abilities')
-        bar.addTab(QLabel('TODO'), 'Party')
-        bar.addTab(QLabel('TODO'), 'Elemental Data')
-        bar.addTab(QLabel('TODO'), 'Encounters')
-        bar.addTab(QLabel('TODO'), 'Forge')
-        bar.addTab(QLabel('TODO'), 'Sprites')
+        bar = LazyTabWidget(self, releaseAfter=state.releaseTabsAfter)
+        self._editorTabs = bar
+
+        def todo(parent: QWidget) -> QWidget:
+            return QLabel('TODO', parent)
+
+        self._romTab = bar.addLazyTab(lambda parent: RomInfoTab(parent, self._crc32), 'ROM')
+        bar.addLazyTab(todo, 'Map')
+        # Waits for the load task to index the script. See _onStringsLoaded.
+        self._textEditTab = bar.addLazyTab(TextEditTab, 'Text Editor', ready=False)
+        bar.addLazyTab(todo, 'Shops')
+        bar.addLazyTab(todo, 'Abilities')
+        bar.addLazyTab(todo, 'Party')
+        bar.addLazyTab(todo, 'Elemental Data')
+        bar.addLazyTab(todo, 'Encounters')
+        bar.addLazyTab(todo, 'Forge')
+        bar.addLazyTab(todo, 'Sprites')
         return bar
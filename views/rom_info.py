@@ -1,5 +1,7 @@
-from typing import cast, Optional
+from typing import cast, Dict, Optional
 
+from PyQt5.QtCore import QThreadPool
+from PyQt5.QtGui import QShowEvent
 from PyQt5.QtWidgets import (
     QGridLayout,
     QGroupBox,
@@ -7,12 +9,21 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 
+from .loading import ChecksumTask
 from .state import state
 from .widgets import ReadOnlyLine
 
+CALCULATING = 'Calculating...'
+
 class RomInfoTab(QGroupBox):
-    'Displays some basic information about the loaded ROM.'
-    def __init__(self, parent: Optional[QWidget]=None):
+    '''Displays some basic information about the loaded ROM.
+
+    The CRC32 can be filled in later with `setCrc32`, since it takes a while
+    to compute. Once it's known, the other checksums are worked out on a
+    worker thread, and all of them are refreshed whenever the tab is shown
+    after the ROM was edited.
+    '''
+    def __init__(self, parent: Optional[QWidget]=None, crc32: Optional[str]=None):
         super().__init__(parent)
 
         loadedRom = state.loadedRom
@@ -24,7 +35,11 @@ class RomInfoTab(QGroupBox):
         intNameLine = ReadOnlyLine(loadedRom.header().internalName())
         gameIdLine  = ReadOnlyLine(loadedRom.header().fullGameId())
         sizeLine    = ReadOnlyLine(str(loadedRom.data().size()))
-        crc32Line   = ReadOnlyLine(loadedRom.data().crc32())
+        crc32Line   = ReadOnlyLine(crc32 or CALCULATING)
+        md5Line     = ReadOnlyLine(CALCULATING)
+        sha1Line    = ReadOnlyLine(CALCULATING)
+        self._crc32Line = crc32Line
+        self._checksumLines = {'crc32': crc32Line, 'md5': md5Line, 'sha1': sha1Line}
 
         layout = QGridLayout(self)
 
@@ -48,7 +63,59 @@ class RomInfoTab(QGroupBox):
         layout.addWidget(self._label('CRC32:'),     5, 0)
         layout.addWidget(crc32Line,                 5, 1)
 
+        layout.addWidget(self._label('MD5:'),       6, 0)
+        layout.addWidget(md5Line,                   6, 1)
+
+        layout.addWidget(self._label('SHA-1:'),     7, 0)
+        layout.addWidget(sha1Line,                  7, 1)
+
         self.setLayout(layout)
 
+        # Hashing happens off the GUI thread, one task at a time.
+        self._checksumPool = QThreadPool(self)
+        self._checksumPool.setMaxThreadCount(1)
+        self._checksumTask: Optional[ChecksumTask] = None
+        self._checksumCount = 0
+        self._crc32Known = crc32 is not None
+
+    def setCrc32(self, crc32: str) -> None:
+        'Shows the CRC32 worked out while loading, then works out the rest.'
+        self._crc32Line.setText(crc32)
+        self._crc32Known = True
+        self._refreshChecksums()
+
+    def showEvent(self, event: QShowEvent) -> None:
+        super().showEvent(event)
+        # Before the CRC32 is known, the load task is still busy hashing.
+        if self._crc32Known:
+            self._refreshChecksums()
+
+    def _refreshChecksums(self) -> None:
+        loadedRom = state.loadedRom
+        if loadedRom is None:
+            return
+        if self._checksumTask is not None:
+            self._checksumTask.cancel()
+        self._checksumCount += 1
+        task = ChecksumTask(self._checksumCount, loadedRom)
+        task.signals.finished.connect(self._onChecksums)
+        task.signals.failed.connect(self._onChecksumsFailed)
+        self._checksumTask = task
+        self._checksumPool.start(task)
+
+    def _onChecksums(self, number: int, checksums: Dict[str, str]) -> None:
+        if self._checksumTask is None or self._checksumTask.number != number:
+            return
+        self._checksumTask = None
+        for algorithm, line in self._checksumLines.items():
+            if algorithm in checksums:
+                line.setText(checksums[algorithm])
+
+    def _onChecksumsFailed(self, number: int, message: str) -> None:
+        if self._checksumTask is not None and self._checksumTask.number == number:
+            self._checksumTask = None
+            # TODO better error handling. Probably print to window
+            print(message)
+
     def _label(self, text: str) -> QLabel:
         return QLabel(text, self)
\ No newline at end of file
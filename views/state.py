@@ -1,10 +1,15 @@
 from typing import Optional
 
+from data.analysis_cache import AnalysisCache
 from data.rom_loader import Rom
 
 class AppState:
     def __init__(self):
         self.loadedRom: Optional[Rom] = None
         self.workingDir: Optional[str] = None
+        self.releaseTabsAfter: Optional[float] = None
+        'Seconds before an editor tab that is not shown gets destroyed. `None` keeps them all.'
+        self.analysisCache: Optional[AnalysisCache] = None
+        'Where ROM analysis is remembered between sessions. `None` analyzes every ROM from scratch.'
 
 state = AppState()
@@ -2,9 +2,11 @@ from typing import Optional
 
 from PyQt5.QtCore import pyqtSignal
 from PyQt5.QtWidgets import (
+    QCheckBox,
     QGroupBox,
     QHBoxLayout,
     QLineEdit,
+    QMessageBox,
     QPushButton,
     QTextEdit,
     QVBoxLayout,
@@ -13,6 +15,7 @@ from PyQt5.QtWidgets import (
 
 from data.optional import Option
 
+from .state import state
 from .widgets import StringList
 
 class TextEditTab(QGroupBox):
@@ -25,6 +28,8 @@ class TextEditTab(QGroupBox):
         self._editingItem: Optional[StringList.Cell] = None
 
         self._searchBar   = self._makeSearchBar()
+        self._matchCase   = QCheckBox('Match case', self)
+        self._useRegex    = QCheckBox('Regex', self)
         self._stringTable = self._makeStringTable()
         self._editBox     = self._makeEditBox()
         self._previewBox  = self._makePreviewBox()
@@ -32,8 +37,12 @@ class TextEditTab(QGroupBox):
 
         self.connectSignals()
 
+        searchLayout = QHBoxLayout()
+        searchLayout.addWidget(self._searchBar)
+        searchLayout.addWidget(self._matchCase)
+        searchLayout.addWidget(self._useRegex)
         leftColLayout = QVBoxLayout()
-        leftColLayout.addWidget(self._searchBar)
+        leftColLayout.addLayout(searchLayout)
         leftColLayout.addWidget(self._stringTable)
         rightColLayout = QVBoxLayout()
         rightColLayout.addWidget(self._previewBox)
@@ -50,9 +59,10 @@ class TextEditTab(QGroupBox):
         return searchBar
 
     def _makeStringTable(self) -> StringList:
-        # TODO obviously load real data
-        items = ['Test item', 'Something cool here', 'Hi mom'] * 2000
-        stringList = StringList(items, self)
+        loadedRom = state.loadedRom
+        strings = loadedRom.strings() if loadedRom is not None else None
+        # TODO tell the user when the script couldn't be found
+        stringList = StringList(strings if strings is not None else [], self)
         return stringList
 
     def _makeEditBox(self) -> 'EditBox':
@@ -81,7 +91,12 @@ class TextEditTab(QGroupBox):
         def onItemSelected(itemOpt: Option[StringList.Cell]) -> None:
             self._keepButton.setDisabled(True)
             self._editingItem = itemOpt.getOrRaise()
-            self._editBox.setText(self._editingItem.text())
+            try:
+                self._editBox.setText(self._editingItem.text())
+            except (ValueError, IndexError) as e:
+                # Leave the box empty, so a replacement can still be typed and kept.
+                print(e) # TODO better error handling
+                self._editBox.setText('')
         self._stringTable.selectionModel().selectedItemChanged.connect(onItemSelected)
 
         # Reflect changes to the edited string in the preview box.
@@ -94,17 +109,36 @@ class TextEditTab(QGroupBox):
             self._keepButton.setDisabled(False)
         self._editBox.userEditedText.connect(onItemEdited)
 
-        # Apply edited string to table when "keep" is clicked.
+        # Apply edited string to table and ROM when "keep" is clicked.
         def onKeepButtonClicked() -> None:
-            if self._editingItem is not None:
-                self._editingItem.setText(self._editBox.toPlainText())
+            if self._editingItem is None:
+                return
+            self._editingItem.setText(self._editBox.toPlainText())
+            loadedRom = state.loadedRom
+            if loadedRom is not None:
+                try:
+                    loadedRom.writeStrings()
+                except Exception as e:
+                    # Nothing was written. Drop the edit, but leave it in the
+                    # box so it can be shortened and kept again.
+                    self._editingItem.revertText()
+                    QMessageBox.warning(self, 'Could not keep changes', str(e))
+                    return
             self._keepButton.setDisabled(True)
         self._keepButton.clicked.connect(onKeepButtonClicked)
 
         # Apply search query to string list
         def onSearchboxChanged() -> None:
-            self._stringTable.setSearchText(self._searchBar.text())
+            self._stringTable.setSearchText(
+                self._searchBar.text(),
+                caseSensitive=self._matchCase.isChecked(),
+                regex=self._useRegex.isChecked(),
+            )
         self._searchBar.textChanged.connect(onSearchboxChanged)
+        self._matchCase.toggled.connect(onSearchboxChanged)
+        self._useRegex.toggled.connect(onSearchboxChanged)
+        # TODO better error handling. Probably show this under the search bar
+        self._stringTable.searchFailed.connect(lambda msg: print(msg))
 
 
 class EditBox(QTextEdit):
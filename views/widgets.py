@@ -1,22 +1,48 @@
-from typing import cast, List, Optional
+from dataclasses import dataclass
+from threading import Event, Lock
+from time import monotonic
+from typing import Any, Callable, cast, List, Optional, Set, Union
+import re
 
 from PyQt5.QtCore import (
     pyqtSignal,
     pyqtSlot,
+    QAbstractTableModel,
     QItemSelection,
     QItemSelectionModel,
     QModelIndex,
+    QObject,
+    QPoint,
+    QRunnable,
     QSortFilterProxyModel,
+    Qt,
+    QThreadPool,
+    QTimer,
 )
-from PyQt5.QtGui import QStandardItemModel, QStandardItem
 from PyQt5.QtWidgets import (
     QHeaderView,
+    QLabel,
     QLineEdit,
     QTableView,
+    QTabWidget,
+    QVBoxLayout,
     QWidget,
 )
 
 from data.optional import Option
+from data.string_provider import StringProvider
+from data.text_decoder import TextDecoder
+from data.text_search import RowSet, TextSearchIndex
+from data.tracing import span, traced
+
+StringSource = Union[List[str], StringProvider]
+'Anything `StringList` can display: an ID-indexed list of strings, or a lazy provider.'
+
+SEARCH_DEBOUNCE_MS = 150
+'How long `StringList` waits after the last keystroke before searching.'
+
+SEARCH_REFRESH_MS = 100
+'How often partial search results are shown while a long search runs.'
 
 class ReadOnlyLine(QLineEdit):
     'A read-only `QLineEdit`.'
@@ -24,6 +50,114 @@ class ReadOnlyLine(QLineEdit):
         super().__init__(contents)
         self.setReadOnly(True)
 
+class LazyTabWidget(QTabWidget):
+    '''A `QTabWidget` whose tabs are only built the first time they're shown.
+
+    Each tab is added with a factory that builds its contents. Tabs can also
+    wait for their data (e.g. while a ROM is still loading), showing a
+    placeholder until `setTabReady` is called.
+
+    With `releaseAfter` set, tabs that haven't been visible for that many
+    seconds are destroyed, and rebuilt from their factory if shown again.
+    Factories should get their data from somewhere cached (like `Rom`) so
+    rebuilding is cheap.
+    '''
+
+    @dataclass
+    class _Tab:
+        factory: Callable[[QWidget], QWidget]
+        container: QWidget
+        'What the tab widget actually holds. Contents go inside it.'
+        ready: bool
+        content: Optional[QWidget] = None
+        hiddenSince: Optional[float] = None
+
+    RELEASE_CHECK_MS = 10 * 1000
+    'How often to look for tabs to release.'
+
+    def __init__(self, parent: Optional[QWidget]=None, releaseAfter: Optional[float]=None):
+        super().__init__(parent)
+        self._tabs: List[LazyTabWidget._Tab] = []
+        self._releaseAfter = releaseAfter
+        self.currentChanged.connect(self._onCurrentChanged)
+
+        if releaseAfter is not None:
+            self._releaseTimer = QTimer(self)
+            self._releaseTimer.setInterval(min(LazyTabWidget.RELEASE_CHECK_MS, int(releaseAfter * 1000)))
+            self._releaseTimer.timeout.connect(self._releaseHiddenTabs)
+            self._releaseTimer.start()
+
+    def addLazyTab(
+        self,
+        factory: Callable[[QWidget], QWidget],
+        label: str,
+        ready: bool=True,
+        placeholder: str='Loading...',
+    ) -> int:
+        '''Adds a tab whose contents are built by `factory(parent)` the first time it's shown.
+        If `ready` is false, `placeholder` is shown until `setTabReady` is called.
+        Returns the index of the new tab.'''
+        container = QWidget(self)
+        layout = QVBoxLayout(container)
+        layout.setContentsMargins(0, 0, 0, 0)
+        if not ready:
+            layout.addWidget(QLabel(placeholder, container))
+
+        # Added to our list first, since adding the first tab makes it current.
+        self._tabs.append(LazyTabWidget._Tab(factory, container, ready))
+        return self.addTab(container, label)
+
+    def setTabReady(self, index: int) -> None:
+        'Lets the tab at `index` be built. Builds it right away if it is showing.'
+        tab = self._tabs[index]
+        if tab.ready:
+            return
+        tab.ready = True
+        if index == self.currentIndex():
+            self._build(tab)
+
+    def tabContent(self, index: int) -> Optional[QWidget]:
+        'Returns the contents of the tab at `index`, or `None` if it has not been built.'
+        return self._tabs[index].content
+
+    def releaseTab(self, index: int) -> None:
+        'Destroys the contents of the tab at `index`. They will be rebuilt when it is next shown.'
+        tab = self._tabs[index]
+        if tab.content is None or index == self.currentIndex():
+            return
+        tab.content.deleteLater()
+        tab.content = None
+
+    def _build(self, tab: 'LazyTabWidget._Tab') -> None:
+        layout = tab.container.layout()
+        # Clear out the placeholder, if there is one.
+        while layout.count() > 0:
+            layout.takeAt(0).widget().deleteLater()
+        with span('gui.buildTab', tab=self.tabText(self.indexOf(tab.container))):
+            tab.content = tab.factory(tab.container)
+            layout.addWidget(tab.content)
+
+    def _onCurrentChanged(self, index: int) -> None:
+        now = monotonic()
+        for tabIndex, tab in enumerate(self._tabs):
+            if tabIndex == index:
+                tab.hiddenSince = None
+            elif tab.hiddenSince is None:
+                tab.hiddenSince = now
+
+        if 0 <= index < len(self._tabs):
+            tab = self._tabs[index]
+            if tab.ready and tab.content is None:
+                self._build(tab)
+
+    def _releaseHiddenTabs(self) -> None:
+        if self._releaseAfter is None:
+            return
+        now = monotonic()
+        for index, tab in enumerate(self._tabs):
+            if tab.hiddenSince is not None and now - tab.hiddenSince >= self._releaseAfter:
+                self.releaseTab(index)
+
 class StringList(QTableView):
     '''Displays a list of strings with their index.
 
@@ -44,23 +178,153 @@ class StringList(QTableView):
         ID = 0
         VALUE = 1
 
-    class Model(QStandardItemModel):
-        'A two-column model for holding strings and their IDs.'
-        def __init__(self, parent: 'StringList.ProxyModel'):
+    class Model(QAbstractTableModel):
+        '''A two-column model for holding strings and their IDs.
+
+        Nothing is stored per row. Cells are computed in `data()` when the
+        view asks for them, and IDs are just row numbers, so this costs the
+        same for 6 strings as for 6,000. Strings can come from a plain list
+        or a `StringProvider`, which only decodes what's actually shown.
+        '''
+        HEADERS = ['ID', 'String'] # TODO possibly allow overriding the string label
+        DECODE_ERROR = '<decode error>'
+        'Shown in place of a string that fails to decode, so one bad pointer doesn\'t take down the list.'
+
+        def __init__(self, strings: 'StringSource', parent: 'StringList'):
             super().__init__(parent)
-            self.setColumnCount(2)
-            self.setHorizontalHeaderItem(StringList.Column.ID, QStandardItem('ID'))
-            # TODO possibly allow overriding this label
-            self.setHorizontalHeaderItem(StringList.Column.VALUE, QStandardItem('String'))
+            self._strings = strings
+            self._searchIndex: Optional[TextSearchIndex] = None
+            self._searchIndexLock = Lock()
+            'The search index is built on a worker thread. This hands it over without losing edits.'
+            self._editedWhileIndexing: Optional[Set[int]] = None
+            'Rows changed while the search index is being built. `None` when no build is running.'
+
+        def rowCount(self, parent: QModelIndex=QModelIndex()) -> int:
+            # Table models have no children, so only the root has rows.
+            return 0 if parent.isValid() else len(self._strings)
+
+        def columnCount(self, parent: QModelIndex=QModelIndex()) -> int:
+            return 0 if parent.isValid() else len(StringList.Model.HEADERS)
+
+        def data(self, index: QModelIndex, role: int=Qt.ItemDataRole.DisplayRole) -> Any:
+            if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+                return None
+            if index.column() == StringList.Column.ID:
+                return str(index.row())
+            try:
+                return self._strings[index.row()]
+            except (ValueError, IndexError):
+                # Not printed: the view asks for cells on every repaint.
+                return StringList.Model.DECODE_ERROR
+
+        def headerData(
+            self,
+            section: int,
+            orientation: Qt.Orientation,
+            role: int=Qt.ItemDataRole.DisplayRole,
+        ) -> Any:
+            if orientation == Qt.Orientation.Horizontal \
+            and role == Qt.ItemDataRole.DisplayRole \
+            and 0 <= section < len(StringList.Model.HEADERS):
+                return StringList.Model.HEADERS[section]
+            return None
 
-        def itemFromIndex(self, index: QModelIndex) -> 'StringList.Cell':
-            return cast(StringList.Cell, super().itemFromIndex(index))
+        def string(self, row: int) -> str:
+            return self._strings[row]
+
+        def setString(self, row: int, text: str) -> None:
+            '''Replaces the string in `row` and updates the view.
+            Cells can't be edited directly (the default `flags()`), so this is the only way.'''
+            with self._searchIndexLock:
+                if isinstance(self._strings, StringProvider):
+                    self._strings.setString(row, text)
+                else:
+                    self._strings[row] = text
+                self._reindex(row, text)
+            self._rowChanged(row)
+
+        def revertString(self, row: int) -> None:
+            '''Drops the edit to the string in `row`, so it reads from the ROM
+            again, and updates the view. Plain lists have nothing to go back to.'''
+            if not isinstance(self._strings, StringProvider):
+                return
+            with self._searchIndexLock:
+                self._strings.revertString(row)
+                self._reindex(row, self._strings[row])
+            self._rowChanged(row)
+
+        def _reindex(self, row: int, text: str) -> None:
+            'Updates the search index for a changed row. Call with `_searchIndexLock` held.'
+            if self._searchIndex is not None:
+                self._searchIndex.setString(row, text)
+            elif self._editedWhileIndexing is not None:
+                self._editedWhileIndexing.add(row)
+
+        def _rowChanged(self, row: int) -> None:
+            valueIndex = self.index(row, StringList.Column.VALUE)
+            self.dataChanged.emit(valueIndex, valueIndex)
 
-    class Cell(QStandardItem):
-        'An cell in the list-table that cannot be directly edited.'
-        def __init__(self, text: str):
-            super().__init__(text)
-            self.setEditable(False)
+        def itemFromIndex(self, index: QModelIndex) -> 'StringList.Cell':
+            return StringList.Cell(self, index.row())
+
+        def searchIndex(self) -> TextSearchIndex:
+            '''Returns the search index over every string.
+            Built the first time it's needed, since that means decoding the whole script.
+
+            Strings can still be changed (on the GUI thread) while it's being
+            built, so those rows are indexed again once the build is done.
+            '''
+            with self._searchIndexLock:
+                if self._searchIndex is not None:
+                    return self._searchIndex
+                self._editedWhileIndexing = set()
+
+            while True:
+                decoder = self._decoder()
+                try:
+                    with span('search.buildIndex', strings=len(self._strings)):
+                        index = TextSearchIndex(self._strings)
+                except Exception:
+                    # Decoding while the script is rewritten can read garbage.
+                    if self._decoder() is decoder:
+                        raise
+                    continue
+
+                with self._searchIndexLock:
+                    # If the script was rewritten in the ROM, strings may have
+                    # been decoded from data that moved. Start over.
+                    if self._decoder() is not decoder:
+                        self._editedWhileIndexing = set()
+                        continue
+                    for row in cast(Set[int], self._editedWhileIndexing):
+                        index.setString(row, self._strings[row])
+                    self._editedWhileIndexing = None
+                    self._searchIndex = index
+                    return index
+
+        def _decoder(self) -> Optional[TextDecoder]:
+            'Returns what strings are decoded through, if they come from the ROM.'
+            return self._strings.decoder() if isinstance(self._strings, StringProvider) else None
+
+    class Cell:
+        '''A handle to one item (row) in the list-table.
+        Made on demand, so holding onto one doesn't keep anything else alive.'''
+        def __init__(self, model: 'StringList.Model', row: int):
+            self._model = model
+            self._row = row
+
+        def id(self) -> int:
+            return self._row
+
+        def text(self) -> str:
+            return self._model.string(self._row)
+
+        def setText(self, text: str) -> None:
+            self._model.setString(self._row, text)
+
+        def revertText(self) -> None:
+            'Drops any edit to this item. See `StringList.Model.revertString`.'
+            self._model.revertString(self._row)
 
     class ProxyModel(QSortFilterProxyModel):
         '''Enables us to filter strings displayed in the table by some search query.
@@ -69,7 +333,21 @@ class StringList(QTableView):
         '''
         def __init__(self, parent: 'StringList') -> None:
             super().__init__(parent)
-            self.setFilterKeyColumn(StringList.Column.ALL)
+            self._rowFilter: Optional[RowSet] = None
+
+        def setRowFilter(self, rows: Optional[RowSet]) -> None:
+            '''Only shows the given (source) rows. `None` shows everything.
+            This resets the model, which clears the view's selection. See `StringList._setRowFilter`.'''
+            # A reset is much cheaper than invalidateFilter() here. That diffs
+            # the old and new rows, removing them range by range, which takes
+            # seconds when matches are scattered across a big script.
+            self.beginResetModel()
+            self._rowFilter = rows
+            self.endResetModel()
+
+        def filterAcceptsRow(self, sourceRow: int, sourceParent: QModelIndex) -> bool:
+            # The search already happened. This is just a bitmap lookup per row.
+            return self._rowFilter is None or sourceRow in self._rowFilter
 
         def sourceModel(self) -> 'StringList.Model':
             return cast(StringList.Model, super().sourceModel())
@@ -93,38 +371,228 @@ class StringList(QTableView):
             # Rationale: parent.selectedItemChanged is Callable, idk why mypy isn't seeing that.
             self.selectedItemChanged.connect(parent.selectedItemChanged) # type: ignore[arg-type]
 
-    def __init__(self, items: List[str], parent: Optional[QWidget]=None):
+    class SearchTask(QRunnable):
+        '''Runs one search on a worker thread, sending matching rows back in batches.
+
+        Every task gets a number, so results from a task that was superseded
+        (and cancelled) but still had batches in flight can be ignored.
+        '''
+
+        class Signals(QObject):
+            # QRunnable isn't a QObject, so it can't have signals itself.
+            batchFound = pyqtSignal(int, list)
+            'Some matching rows were found by the search with this number.'
+            finished = pyqtSignal(int)
+            'The search with this number ran to the end.'
+            failed = pyqtSignal(int, str)
+            'The search with this number had an error, e.g. an invalid regex.'
+
+        def __init__(
+            self,
+            number: int,
+            model: 'StringList.Model',
+            query: str,
+            caseSensitive: bool,
+            regex: bool,
+        ):
+            super().__init__()
+            self.number = number
+            self.signals = StringList.SearchTask.Signals()
+            self._model = model
+            self._query = query
+            self._caseSensitive = caseSensitive
+            self._regex = regex
+            self._cancelled = Event()
+
+        def cancel(self) -> None:
+            'Stops the search after the batch it is working on. Safe to call from any thread.'
+            self._cancelled.set()
+
+        def run(self) -> None:
+            try:
+                # Building the index the first time is the slow part, so it happens here too.
+                with span('search.run', query=self._query, regex=self._regex):
+                    index = self._model.searchIndex()
+                    for batch in index.iterSearch(self._query, self._caseSensitive, self._regex):
+                        if self._cancelled.is_set():
+                            return
+                        self.signals.batchFound.emit(self.number, batch)
+                self.signals.finished.emit(self.number)
+            except re.error as e:
+                self.signals.failed.emit(self.number, f'Invalid regex: {e}')
+            except Exception as e:
+                # Runs on a pool thread, where nothing else would report it.
+                self.signals.failed.emit(self.number, str(e))
+
+    @traced('gui.stringList.populate')
+    def __init__(self, items: StringSource, parent: Optional[QWidget]=None):
         super().__init__(parent)
         self.horizontalHeader().setStretchLastSection(True)
         self.setAlternatingRowColors(True)
         self.setSelectionMode(QTableView.SelectionMode.SingleSelection)
         self.verticalHeader().hide()
 
-        model = StringList.Model(self)
+        self._restoringSelection = False
+        'Set while `_setRowFilter` re-selects the item that was already selected.'
 
-        # NOTE: Adding items before setting the ProxyModel allows us to skip
-        # running all of the items through the proxy's filter, which
-        # dramatically improves load time.
-        for index, string in enumerate(items):
-            model.setItem(index, StringList.Column.ID,    StringList.Cell(str(index)))
-            model.setItem(index, StringList.Column.VALUE, StringList.Cell(string))
+        # NOTE: The model doesn't copy or decode anything up front, so this is
+        # just as fast for a whole game script as for an empty one.
+        model = StringList.Model(items, self)
 
         proxyModel = StringList.ProxyModel(self)
         proxyModel.setSourceModel(model)
 
         self.setModel(proxyModel)
         self.setSelectionModel(StringList.SelectionModel(proxyModel, self))
+        # ResizeToContents would measure every row. The widest ID is the last one.
         self.horizontalHeader().setSectionResizeMode(
             StringList.Column.ID,
-            QHeaderView.ResizeMode.ResizeToContents,
+            QHeaderView.ResizeMode.Fixed,
+        )
+        self.setColumnWidth(
+            StringList.Column.ID,
+            self.fontMetrics().horizontalAdvance(f' {max(len(items) - 1, 0)} ') + 8,
         )
+        # Rows are all one line tall, so don't measure them either.
+        self.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 6)
+
+        # Searches run one at a time on their own thread, never the GUI thread.
+        self._searchPool = QThreadPool(self)
+        self._searchPool.setMaxThreadCount(1)
+        self._searchTask: Optional[StringList.SearchTask] = None
+        self._searchCount = 0
+        self._searchQuery = ''
+        self._searchCaseSensitive = True
+        self._searchRegex = False
+        self._searchResults: Optional[RowSet] = None
+
+        self._searchDebounce = QTimer(self)
+        self._searchDebounce.setSingleShot(True)
+        self._searchDebounce.setInterval(SEARCH_DEBOUNCE_MS)
+        self._searchDebounce.timeout.connect(self._startSearch)
+
+        # Showing results re-filters every row, so batches are shown at most this often.
+        self._searchRefresh = QTimer(self)
+        self._searchRefresh.setSingleShot(True)
+        self._searchRefresh.setInterval(SEARCH_REFRESH_MS)
+        self._searchRefresh.timeout.connect(self._showSearchResults)
 
     def model(self) -> 'StringList.ProxyModel':
         'Functionally equivalent to `QTableView.model()`. Just changes return type.'
         return cast(StringList.ProxyModel, super().model())
 
-    def setSearchText(self, search: str) -> None:
-        self.model().setFilterFixedString(search)
+    searchFailed = pyqtSignal(str)
+    'Signal for when a search query could not be run, e.g. an invalid regex.'
+
+    searchFinished = pyqtSignal(int)
+    'Signal for when a search is done and its results are shown. Carries the match count.'
+
+    def setSearchDelay(self, milliseconds: int) -> None:
+        'Changes how long to wait after `setSearchText` before searching.'
+        self._searchDebounce.setInterval(milliseconds)
+
+    def setSearchText(self, search: str, caseSensitive: bool=True, regex: bool=False) -> None:
+        '''Only shows items whose string or ID contains `search`.
+
+        The search runs in the background a moment after the last call, so
+        this can be called on every keystroke. With `regex=True`, `search` is
+        a regular expression matched against strings only.
+        '''
+        self._searchQuery = search
+        self._searchCaseSensitive = caseSensitive
+        self._searchRegex = regex
+        self._cancelSearch()
+
+        if search:
+            self._searchDebounce.start()
+        else:
+            self._searchDebounce.stop()
+            self._setRowFilter(None)
+
+    def _cancelSearch(self) -> None:
+        if self._searchTask is not None:
+            self._searchTask.cancel()
+            self._searchTask = None
+        self._searchRefresh.stop()
+        self._searchResults = None
+
+    def _startSearch(self) -> None:
+        self._cancelSearch()
+        self._searchCount += 1
+        task = StringList.SearchTask(
+            self._searchCount,
+            self.model().sourceModel(),
+            self._searchQuery,
+            self._searchCaseSensitive,
+            self._searchRegex,
+        )
+        task.signals.batchFound.connect(self._onSearchBatch)
+        task.signals.finished.connect(self._onSearchFinished)
+        task.signals.failed.connect(self._onSearchFailed)
+        self._searchTask = task
+        self._searchResults = RowSet((), self.model().sourceModel().rowCount())
+        self._searchPool.start(task)
+
+    def _isCurrentSearch(self, number: int) -> bool:
+        return self._searchTask is not None and self._searchTask.number == number
+
+    def _onSearchBatch(self, number: int, rows: List[int]) -> None:
+        if self._isCurrentSearch(number) and self._searchResults is not None:
+            self._searchResults.update(rows)
+            if not self._searchRefresh.isActive():
+                self._searchRefresh.start()
+
+    def _onSearchFinished(self, number: int) -> None:
+        if self._isCurrentSearch(number):
+            self._searchRefresh.stop()
+            self._showSearchResults()
+            self._searchTask = None
+            self.searchFinished.emit(len(self._searchResults or ()))
+
+    def _onSearchFailed(self, number: int, message: str) -> None:
+        if self._isCurrentSearch(number):
+            self._searchTask = None
+            self.searchFailed.emit(message)
+
+    def _showSearchResults(self) -> None:
+        if self._searchResults is not None:
+            with span('gui.stringList.filter', matches=len(self._searchResults)):
+                self._setRowFilter(self._searchResults)
+
+    def _setRowFilter(self, rows: Optional[RowSet]) -> None:
+        '''Filters the table without losing the user's place.
+
+        Filtering resets the model, which would clear the selection and jump
+        back to the top every time more results come in. Instead, the selected
+        item stays selected (without firing `selectedItemChanged`, since it
+        didn't change), and the row at the top of the view stays there, as
+        long as they still match.
+        '''
+        model = self.model()
+        sourceModel = model.sourceModel()
+        selected = model.mapToSource(self.currentIndex()).row()
+        top = model.mapToSource(self.indexAt(QPoint(0, 0))).row()
+
+        model.setRowFilter(rows)
+
+        selectedIndex = model.mapFromSource(sourceModel.index(selected, StringList.Column.VALUE)) \
+            if selected >= 0 else QModelIndex()
+        topIndex = model.mapFromSource(sourceModel.index(top, StringList.Column.VALUE)) \
+            if top >= 0 else QModelIndex()
+        if selectedIndex.isValid():
+            self._restoringSelection = True
+            try:
+                self.selectionModel().setCurrentIndex(
+                    selectedIndex,
+                    QItemSelectionModel.SelectionFlag.ClearAndSelect,
+                )
+            finally:
+                self._restoringSelection = False
+        if topIndex.isValid():
+            self.scrollTo(topIndex, QTableView.ScrollHint.PositionAtTop)
+        elif selectedIndex.isValid():
+            self.scrollTo(selectedIndex)
 
     def selectionModel(self) -> 'StringList.SelectionModel':
         'Functionally equivalent to `QTableView.selectionModel()`. Just changes return type.'
@@ -137,6 +605,8 @@ class StringList(QTableView):
         selects the item itself. Clients should use `selectedItemChanged` instead.
         '''
         super().selectionChanged(selected, deselected)
+        if self._restoringSelection:
+            return
 
         selectedIndex   = self._getSelectionIndex(selected)
         deselectedIndex = self._getSelectionIndex(deselected)